@@ -0,0 +1,78 @@
+"""ALSA 入力2系統（self / other）を同時に動かしたときのイベントループ遅延を測る。
+
+実行: python -m bench.alsa_loop_lag [秒数]
+  環境変数 ALSA_DEVICE_SELF / ALSA_DEVICE_OTHER で入力デバイスを指定（未指定は既定デバイス）。
+  pyalsaaudio と実際の録音デバイスが必要。
+
+各方式（blocking / thread / nonblock）で、5ms ごとに起きるはずのタスクが
+どれだけ遅れて起きたか（ループ遅延）の p50 / p99 / 最大を表示する。
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from client.audio_io import AlsaaudioSource
+
+PROBE_S = 0.005
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _run(mode: str, seconds: float):
+    dev_self = os.getenv("ALSA_DEVICE_SELF")
+    dev_other = os.getenv("ALSA_DEVICE_OTHER")
+    sources = [AlsaaudioSource(device=dev_self, mode=mode), AlsaaudioSource(device=dev_other, mode=mode)]
+    counts = [0, 0]
+    lags = []
+
+    async def consume(i, src):
+        async with src:
+            async for _ in src.frames():
+                counts[i] += 1
+
+    async def probe():
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(PROBE_S)
+            lags.append((loop.time() - t0 - PROBE_S) * 1000.0)
+
+    tasks = [asyncio.create_task(consume(i, s)) for i, s in enumerate(sources)]
+    await asyncio.sleep(0.2)  # デバイスのオープン待ち
+    lags.clear()
+    probe_task = asyncio.create_task(probe())
+    t_end = time.monotonic() + seconds
+    while time.monotonic() < t_end:
+        await asyncio.sleep(0.1)
+    probe_task.cancel()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(probe_task, *tasks, return_exceptions=True)
+    drops = sum(s.capture_stats()["dropped_frames"] for s in sources)
+    print(
+        f"  {mode:<9s} frames={counts[0]}/{counts[1]} drops={drops} "
+        f"lag p50={_pct(lags, 0.5):6.2f}ms p99={_pct(lags, 0.99):6.2f}ms max={max(lags, default=0.0):6.2f}ms"
+    )
+
+
+def main():
+    try:
+        import alsaaudio  # type: ignore  # noqa: F401
+    except ImportError:
+        print("pyalsaaudio がインストールされていません（pip install pyalsaaudio）。")
+        sys.exit(1)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print(f"ALSA self+other, {seconds:.0f}s per mode, probe every {PROBE_S * 1000:.0f}ms")
+    for mode in ("blocking", "thread", "nonblock"):
+        asyncio.run(_run(mode, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""フレーム解析のマイクロベンチマーク（1フレームあたりの CPU 時間[µs]）。
+
+実行: python -m bench.frame_analysis [フレーム数]
+
+- before: 従来の rms_int16（1サンプルずつ int.from_bytes）を sender_task と同様に
+  1フレームあたり2回呼んだ場合。
+- after: analyze_frame を1回（NumPy 版 / NumPy なし版）。
+"""
+
+import math
+import random
+import sys
+import time
+
+from client import frame_analysis
+from client.audio_io import FRAME_BYTES
+
+
+def _rms_int16_legacy(frame: bytes) -> float:
+    # 変更前の実装（比較用にそのまま残す）
+    count = len(frame) // 2
+    sum_s = 0
+    sum_sq = 0
+    for i in range(0, len(frame), 2):
+        s = int.from_bytes(frame[i : i + 2], byteorder="little", signed=True)
+        sum_s += s
+        sum_sq += s * s
+    mean = sum_s / count
+    var = max(0.0, sum_sq / count - mean * mean)
+    return math.sqrt(var) / 32768.0
+
+
+def _make_frames(n: int):
+    rnd = random.Random(1)
+    samples = FRAME_BYTES // 2
+    frames = []
+    for _ in range(n):
+        amp = rnd.choice((300, 3000, 12000))
+        buf = bytearray()
+        for _ in range(samples):
+            buf += int(rnd.gauss(0, amp) if amp < 12000 else rnd.uniform(-amp, amp)).to_bytes(
+                2, "little", signed=True
+            )
+        frames.append(bytes(buf))
+    return frames
+
+
+def _cpu_us_per_frame(fn, frames, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.process_time()
+        for f in frames:
+            fn(f)
+        best = min(best, time.process_time() - t0)
+    return best / len(frames) * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    frames = _make_frames(n)
+    print(f"frames={n} frame_bytes={FRAME_BYTES} numpy={'yes' if frame_analysis.HAVE_NUMPY else 'no'}")
+
+    def before(f):
+        _rms_int16_legacy(f)
+        _rms_int16_legacy(f)
+
+    rows = [("before: rms_int16 x2 (per-sample)", _cpu_us_per_frame(before, frames))]
+    rows.append(("after: analyze_frame (memoryview)", _cpu_us_per_frame(frame_analysis._analyze_pure, frames)))
+    if frame_analysis.HAVE_NUMPY:
+        rows.append(("after: analyze_frame (numpy)", _cpu_us_per_frame(frame_analysis._analyze_numpy, frames)))
+        t0 = time.process_time()
+        frame_analysis.analyze_frames(frames)
+        rows.append(("after: analyze_frames (numpy batch)", (time.process_time() - t0) / n * 1e6))
+
+    base = rows[0][1]
+    for name, us in rows:
+        print(f"  {name:<40s} {us:9.1f} µs/frame  (x{base / us:5.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""上り音声のパケット長ごとの送信コストを測る（ローカルの WebSocket サーバへ送信）。
+
+実行: python -m bench.packetization [音声秒数]
+
+各パケット長（20/40/60/100ms）で、同じ長さの音声を送り切るまでの
+- messages: WebSocket メッセージ数
+- overhead: WebSocket ヘッダ（推定）の割合
+- cpu: 音声1秒あたりのクライアント CPU 時間
+- writes: トランスポートへの書き込み回数（ws.transport.write を包んで数える。送信のシステムコール
+  （send）はおおむねこの回数になる。/proc/self/io の syscw は send を数えないので使わない）
+を表示する。サーバは別プロセスで動かすので、CPU 時間はクライアント側のみ。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import websockets
+
+from client.audio_io import FRAME_BYTES, FRAME_MS
+from client.packetizer import Packetizer
+
+PORT = int(os.getenv("BENCH_PORT", "8765"))
+
+
+def _serve():
+    async def handler(ws):
+        async for _ in ws:
+            pass
+
+    async def main():
+        async with websockets.serve(handler, "127.0.0.1", PORT, max_size=None):
+            await asyncio.Future()
+
+    asyncio.run(main())
+
+
+def _count_writes(ws) -> dict:
+    """ws のトランスポートの write を包んで、呼ばれた回数とバイト数を数える。"""
+    counts = {"writes": 0, "bytes": 0}
+    transport = ws.transport
+    write = transport.write
+
+    def counted(data):
+        counts["writes"] += 1
+        counts["bytes"] += len(data)
+        write(data)
+
+    transport.write = counted
+    return counts
+
+
+async def _run(packet_ms: int, seconds: float):
+    # 同じフレームを繰り返すと permessage-deflate（websockets の既定）がほぼ消してしまうので、
+    # deflate の窓（32KB）より長い分の乱数を順に使う
+    frames = [os.urandom(FRAME_BYTES) for _ in range(64 * 1024 // FRAME_BYTES + 1)]
+    n = int(seconds * 1000 / FRAME_MS)
+    pk = Packetizer(packet_ms=packet_ms)
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}", max_size=None) as ws:
+        counts = _count_writes(ws)
+        c0 = time.process_time()
+        for i in range(n):
+            packet = pk.add(frames[i % len(frames)])
+            if packet is not None:
+                t0 = time.perf_counter()
+                await ws.send(packet)
+                pk.on_sent(packet, time.perf_counter() - t0)
+        packet = pk.flush()
+        if packet is not None:
+            await ws.send(packet)
+            pk.on_sent(packet, 0.0)
+        cpu = time.process_time() - c0
+    st = pk.stats.as_dict()
+    print(
+        f"  {packet_ms:3d}ms  messages={st['messages']:5d}  overhead={st['overhead_pct']:5.2f}%  "
+        f"cpu={cpu / seconds * 1000:7.2f}ms/s-audio  writes={counts['writes']:5d} ({counts['bytes'] / 1024:.0f}KiB)"
+    )
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    server = multiprocessing.Process(target=_serve, daemon=True)
+    server.start()
+    time.sleep(0.5)
+    try:
+        print(f"audio={seconds:.0f}s frame={FRAME_MS}ms ({FRAME_BYTES}B)")
+        for packet_ms in (20, 40, 60, 100):
+            asyncio.run(_run(packet_ms, seconds))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
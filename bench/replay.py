@@ -0,0 +1,164 @@
+"""記録したセッション（RECORD=1）を手元で流し直し、発話の区切りと再生の統計を比べる。
+
+実行: python -m bench.replay session-....ksr [--fast] [--speed 倍率]
+
+- 記録の中身: 時間・ストリームごとのフレーム数・TTS チャンク数と、記録時の応答の遅れ
+  （stop を送ってから最初の TTS チャンクを受け取るまで）の p50/p95。
+- 送信: 記録したマイク入力を sender_task の frame_iter として流す（接続はメモリ上の偽物で、
+  送った stop を記録上の時刻で控える）。記録時に送った stop と数・時刻の差を表示する。
+  VAD_MODE などの環境変数を変えて流し直せば、発話の区切りがどう変わるかを比べられる。
+- 再生: 記録した TTS チャンクを JitteredOutput（書き込み先なし）に流し、PlaybackStats と
+  jb.stats() を表示する（--fast では再生の刻みが実時間なので省く）。
+"""
+
+import asyncio
+import contextlib
+import json
+import sys
+import time
+
+from client import ws_client
+from client.audio_io import FRAME_MS, RATE
+from client.player import JitteredOutput
+from client.recorder import KIND_CONTROL_OUT, KIND_MIC, KIND_TTS, KIND_TTS_FRAMED, SessionReplay
+
+
+class _MemorySocket:
+    """送ったものを控えるだけの接続（recv は何も返さない）。"""
+
+    def __init__(self, replay: SessionReplay, stream: str):
+        self.replay = replay
+        self.stream = stream
+        self.audio_bytes = 0
+        self.stops = []  # 記録上の時刻[µs]
+
+    async def send(self, message):
+        if isinstance(message, str):
+            if json.loads(message).get("type") == "stop":
+                self.stops.append(self.replay.position_us.get(self.stream, 0))
+        else:
+            self.audio_bytes += len(message)
+
+    async def recv(self):
+        await asyncio.Future()
+
+
+def _pick(values, q):
+    d = sorted(values)
+    return d[min(len(d) - 1, int(q * len(d)))] if d else float("nan")
+
+
+def _is_stop(record) -> bool:
+    try:
+        return json.loads(record.payload).get("type") == "stop"
+    except ValueError:
+        return False
+
+
+def _summarize(replay: SessionReplay):
+    print(f"duration={replay.duration_s:.1f}s streams={', '.join(replay.streams) or '-'}")
+    for name in replay.streams:
+        mic = replay.count(KIND_MIC, name)
+        tts = replay.count((KIND_TTS, KIND_TTS_FRAMED), name)
+        stops = sum(1 for r in replay.controls(outgoing=True, stream=name) if _is_stop(r))
+        print(f"  {name:<9s} mic_frames={mic} tts_chunks={tts} stops={stops}")
+    # 記録時の応答の遅れ: stop を送ってから、次に TTS チャンクを受け取るまで
+    delays, waiting = [], None
+    for r in replay.read((KIND_TTS, KIND_TTS_FRAMED, KIND_CONTROL_OUT)):
+        if r.kind in (KIND_TTS, KIND_TTS_FRAMED):
+            if waiting is not None:
+                delays.append((r.t_us - waiting) / 1000.0)
+                waiting = None
+        elif r.kind == KIND_CONTROL_OUT and waiting is None and _is_stop(r):
+            waiting = r.t_us
+    if delays:
+        print(f"  recorded response n={len(delays)} p50={_pick(delays, 0.5):.0f}ms p95={_pick(delays, 0.95):.0f}ms")
+
+
+def _compare(name: str, recorded, replayed):
+    """記録時の stop と流し直した stop を近いもの同士で組にして、時刻の差を出す。"""
+    deltas, unmatched = [], 0
+    pool = list(replayed)
+    for t in recorded:
+        if not pool:
+            unmatched += 1
+            continue
+        nearest = min(pool, key=lambda x: abs(x - t))
+        if abs(nearest - t) > 1_000_000:  # 1秒以上離れていれば別の発話
+            unmatched += 1
+            continue
+        pool.remove(nearest)
+        deltas.append(abs(nearest - t) / 1000.0)
+    print(
+        f"  {name:<9s} stops recorded={len(recorded)} replayed={len(replayed)}"
+        f" unmatched={unmatched} extra={len(pool)}"
+        f"  |Δt| p50={_pick(deltas, 0.5):.0f}ms p95={_pick(deltas, 0.95):.0f}ms"
+    )
+
+
+async def _run(path: str, realtime: bool, speed: float):
+    replay = SessionReplay(path, realtime=realtime, speed=speed)
+    _summarize(replay)
+
+    sockets = {}
+    tasks = []
+    for name in replay.mic_streams():
+        sock = sockets[name] = _MemorySocket(replay, name)
+
+        @contextlib.asynccontextmanager
+        async def connect(sock=sock):
+            yield sock
+
+        tasks.append(
+            asyncio.create_task(
+                ws_client.sender_task(
+                    "memory://", "", name, replay.frame_iter(name),
+                    capture_rate=replay.rate_of(name, RATE), connect=connect,
+                )
+            )
+        )
+
+    out = None
+    if realtime and replay.count((KIND_TTS, KIND_TTS_FRAMED)):
+        out = JitteredOutput(lambda frame: None)
+        await out.__aenter__()
+        tasks.append(asyncio.create_task(replay.play_tts(out.on_chunk, out.set_input_rate, on_tts_done=out.end_utterance)))
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    await asyncio.gather(*(event.wait() for event in replay.done.values()))
+    await asyncio.sleep(0.5)  # 最後の発話の stop と、再生バッファの残り
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"replay {'realtime x%.1f' % speed if realtime else 'fast'}: {elapsed:.2f}s wall, {cpu:.2f}s cpu")
+    for name, sock in sockets.items():
+        recorded = [r.t_us for r in replay.controls(outgoing=True, stream=name) if _is_stop(r)]
+        _compare(name, recorded, sock.stops)
+    if out is not None:
+        await out.__aexit__(None, None, None)
+        print(f"  playback  {out.stats.as_dict()}")
+        print(f"  jitter    {out.jb.stats()}")
+
+
+def main():
+    args = sys.argv[1:]
+    realtime = "--fast" not in args
+    speed = 1.0
+    if "--speed" in args:
+        i = args.index("--speed")
+        speed = float(args[i + 1])
+        del args[i : i + 2]
+    paths = [a for a in args if not a.startswith("--")]
+    if not paths:
+        print(__doc__)
+        sys.exit(2)
+    print(f"frame={FRAME_MS}ms")
+    asyncio.run(_run(paths[0], realtime, speed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""VAD バックエンドのオフライン評価（1フレームあたりの CPU 時間・誤検出・エンドポイント遅延）。
+
+実行:
+  python -m bench.vad                    # 合成した音声（静かな部屋 / 雑音 / ハム）で評価
+  python -m bench.vad a.wav b.wav ...    # 手元の WAV（モノラル int16）で評価
+  python -m bench.vad --modes fixed,zcr a.wav
+
+ラベル: WAV と同じ名前の .txt（Audacity のラベル書き出し形式。1行に「開始秒<TAB>終了秒[<TAB>名前]」）に
+発話区間を書く。ラベルの無い WAV は全体を非発話として扱う。
+各バックエンドの設定は実機と同じ環境変数（VAD_THRESHOLD / VAD_MIN_SIL_MS / VAD_START_DB など）で変えられる。
+
+出力（バックエンドごと）:
+- cpu: update()（analyze_frame を含む）の1フレームあたりの CPU 時間[µs]。
+- fp: 非発話フレームのうち発話中と判定された割合（誤検出率）。発話区間の終わりから
+  TAIL_S 秒は終了待ち（ハングオーバー）なので数えない（そこは delay で見る）。
+- false/min: ラベルの発話区間の外で始まった START の数（非発話1分あたり）。
+- missed: START が1度も起きなかった発話区間の数。
+- delay: 発話区間の終わりから END までの時間[ms]（中央値 / p95）。次の発話まで END が無ければ数えない。
+"""
+
+import math
+import os
+import random
+import sys
+import time
+import wave
+from array import array
+
+from client import vad
+from client.audio_io import FRAME_MS, RATE, frame_bytes_at
+from client.frame_analysis import analyze_frame
+
+TAIL_S = 1.0
+
+
+def _read_wav(path: str):
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"{path}: int16 の WAV のみ対応しています")
+        rate = w.getframerate()
+        channels = w.getnchannels()
+        data = w.readframes(w.getnframes())
+    if channels > 1:
+        # 1チャンネル目だけを使う
+        samples = array("h")
+        samples.frombytes(data)
+        data = samples[::channels].tobytes()
+    return rate, data
+
+
+def _read_labels(path: str):
+    label_path = os.path.splitext(path)[0] + ".txt"
+    segments = []
+    if os.path.exists(label_path):
+        with open(label_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2:
+                    segments.append((float(parts[0]), float(parts[1])))
+    return sorted(segments)
+
+
+def _synth(noise: float, hum: float = 0.0, seconds: float = 12.0, rate: int = RATE, seed: int = 1):
+    """発話らしい音（基本周波数の揺れる倍音＋音節ごとの抑揚、語尾は減衰）を雑音の上に置く。"""
+    rnd = random.Random(seed)
+    segments = [(1.0, 2.4), (4.0, 5.8), (7.5, 8.3), (9.6, 11.0)]
+    out = array("h")
+    for n in range(int(seconds * rate)):
+        t = n / rate
+        v = rnd.gauss(0.0, noise) + hum * math.sin(2 * math.pi * 50 * t)
+        for a, b in segments:
+            if a <= t < b + 0.15:
+                f0 = 140 + 20 * math.sin(2 * math.pi * 0.7 * t)
+                env = 0.5 + 0.5 * abs(math.sin(2 * math.pi * 3.0 * (t - a)))
+                if t >= b:  # 語尾の減衰
+                    env *= math.exp(-(t - b) / 0.03)
+                v += 0.12 * env * sum(math.sin(2 * math.pi * f0 * k * t) / k for k in (1, 2, 3, 5))
+        out.append(int(max(-1.0, min(1.0, v)) * 32767))
+    return rate, out.tobytes(), segments
+
+
+def _evaluate(endpointer, rate: int, pcm: bytes, segments):
+    fb = frame_bytes_at(rate)
+    frames = [pcm[i : i + fb] for i in range(0, len(pcm) - fb + 1, fb)]
+    events = []
+    decisions = []
+    cpu = 0.0
+    for k, frame in enumerate(frames):
+        t0 = time.process_time()
+        event = endpointer.update(frame, analyze_frame(frame))
+        cpu += time.process_time() - t0
+        decisions.append(endpointer.speaking)
+        if event is not None:
+            events.append((k * FRAME_MS / 1000.0, event))
+
+    def in_speech(t: float) -> bool:
+        return any(a <= t < b for a, b in segments)
+
+    def in_tail(t: float) -> bool:
+        return any(b <= t < b + TAIL_S for a, b in segments)
+
+    # フレーム単位の誤検出（非発話フレームを発話中と判定した割合）
+    nonspeech = [
+        d for k, d in enumerate(decisions)
+        if not in_speech(k * FRAME_MS / 1000.0) and not in_tail(k * FRAME_MS / 1000.0)
+    ]
+    fp = sum(nonspeech) / len(nonspeech) if nonspeech else 0.0
+    nonspeech_min = len(nonspeech) * FRAME_MS / 60000.0
+
+    starts = [t for t, e in events if e == vad.START]
+    ends = [t for t, e in events if e == vad.END]
+    # 発話の直前 FRAME_MS の取りこぼしは誤検出に数えない
+    false_starts = sum(1 for t in starts if not any(a - FRAME_MS / 1000.0 <= t < b for a, b in segments))
+    missed = sum(1 for a, b in segments if not any(a - FRAME_MS / 1000.0 <= t < b for t in starts))
+    delays = []
+    for i, (a, b) in enumerate(segments):
+        limit = segments[i + 1][0] if i + 1 < len(segments) else math.inf
+        after = [t for t in ends if b <= t < limit]
+        if after:
+            delays.append((after[0] - b) * 1000.0)
+    return {
+        "frames": len(frames),
+        "cpu_s": cpu,
+        "fp_frames": sum(nonspeech),
+        "nonspeech_frames": len(nonspeech),
+        "nonspeech_min": nonspeech_min,
+        "false_starts": false_starts,
+        "missed": missed,
+        "delays": delays,
+        "fp": fp,
+    }
+
+
+def _pick(values, q: float) -> float:
+    d = sorted(values)
+    return d[min(len(d) - 1, int(q * len(d)))] if d else float("nan")
+
+
+def main():
+    args = sys.argv[1:]
+    modes = list(vad.VAD_MODES)
+    if "--modes" in args:
+        i = args.index("--modes")
+        modes = args[i + 1].split(",")
+        del args[i : i + 2]
+
+    if args:
+        inputs = []
+        for path in args:
+            rate, pcm = _read_wav(path)
+            inputs.append((os.path.basename(path), rate, pcm, _read_labels(path)))
+    else:
+        inputs = [
+            ("quiet", *_synth(0.001)),
+            ("noisy", *_synth(0.03, seed=2)),
+            ("hum", *_synth(0.001, hum=0.05, seed=3)),
+        ]
+    print(f"frame={FRAME_MS}ms inputs={', '.join(name for name, *_ in inputs)}")
+
+    for mode in modes:
+        try:
+            vad.make_endpointer(mode)
+        except ImportError as e:
+            print(f"  {mode:<9s} skipped ({e})")
+            continue
+        total = {"frames": 0, "cpu_s": 0.0, "fp_frames": 0, "nonspeech_frames": 0, "nonspeech_min": 0.0,
+                 "false_starts": 0, "missed": 0, "delays": []}
+        per_input = []
+        for name, rate, pcm, segments in inputs:
+            r = _evaluate(vad.make_endpointer(mode), rate, pcm, segments)
+            per_input.append(f"{name}: fp={r['fp'] * 100:.1f}% false={r['false_starts']} missed={r['missed']}")
+            for key in total:
+                total[key] += r[key]
+        fp = total["fp_frames"] / total["nonspeech_frames"] if total["nonspeech_frames"] else 0.0
+        false_rate = total["false_starts"] / total["nonspeech_min"] if total["nonspeech_min"] else 0.0
+        d = total["delays"]
+        print(
+            f"  {mode:<9s} cpu={total['cpu_s'] / max(1, total['frames']) * 1e6:7.1f} µs/frame"
+            f"  fp={fp * 100:5.1f}%  false/min={false_rate:5.1f}  missed={total['missed']}"
+            f"  delay p50={_pick(d, 0.5):6.0f}ms p95={_pick(d, 0.95):6.0f}ms"
+        )
+        print(f"            ({'; '.join(per_input)})")
+
+
+if __name__ == "__main__":
+    main()
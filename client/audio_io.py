@@ -1,6 +1,12 @@
 import asyncio
 import math
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from .frame_analysis import analyze_frame
+from .log import get_logger
+from .ring import CaptureRing
+
+_log = get_logger("capture")
 
 
 RATE = 24000
@@ -9,6 +15,18 @@ SAMPLE_WIDTH = 2  # 1サンプルのバイト数（int16=16ビット整数のこ
 FRAME_MS = 20
 FRAME_BYTES = int(RATE * (FRAME_MS / 1000.0)) * SAMPLE_WIDTH * CHANNELS  # 1フレーム(20ms)のバイト数。16000Hz×0.02秒×2バイト×1ch=640
 
+# capture_stats() のうち増えるだけの値（リングの分とデバイスの device_stats() の分）
+CAPTURE_COUNTERS = CaptureRing.COUNTERS | {"device_overflows", "xruns", "read_errors"}
+
+
+class CaptureError(RuntimeError):
+    """入力デバイスから読めなくなった（frames() が送出する。デバイスを開き直せば復旧しうる）。"""
+
+
+def frame_bytes_at(rate: int, channels: int = CHANNELS) -> int:
+    """サンプリングレート rate での1フレーム(20ms)のバイト数（デバイスのレートが RATE と異なる場合用）。"""
+    return int(rate * (FRAME_MS / 1000.0)) * SAMPLE_WIDTH * channels
+
 
 class ToneGeneratorSource:
     """テスト用の擬似入力。1秒のビープ音→400msの無音を出力。
@@ -63,9 +81,24 @@ class SoundDeviceSource:
       - 文字列を指定: デバイス名の部分一致で最初に見つかった入力デバイスを使用
         （例: `SD_INPUT_DEVICE=Microphone` や `SD_INPUT_DEVICE=Realtek`）。
     - 一覧表示: `SD_LIST_DEVICES=1` を設定すると、起動時にデバイス一覧を表示。
+
+    受け渡し: PortAudio のコールバック（別スレッド）は事前確保したリング（CaptureRing）へ
+    直接書き込むだけ。イベントループは frames() 側が待っているときだけ起こされる。
+    リングが満杯のときに捨てたフレームは `capture_stats()` の dropped_frames に数える。
+    - `SD_CAPTURE_BUFFER_MS`: リング容量（既定 1000ms）。
+    - `SD_CAPTURE_BATCH`: 何フレーム溜まったらイベントループを起こすか（既定 1）。
+
+    rate: デバイスを開くサンプリングレート（既定 RATE）。フレームは rate での 20ms 分になる。
+    送信レートとの変換は sender_task 側（resample.Resampler）で行う。
     """
 
-    def __init__(self, device: Optional[int | str] = None):
+    def __init__(
+        self,
+        device: Optional[int | str] = None,
+        channels: int = CHANNELS,
+        sink: Optional[Callable[[object], None]] = None,
+        rate: int = RATE,
+    ):
         import os
         import sounddevice as sd  # type: ignore
 
@@ -124,23 +157,39 @@ class SoundDeviceSource:
                 "SD_INPUT_DEVICE の指定に一致する入力デバイスが見つかりません（既定デバイスへはフォールバックしません）。"
             )
 
-        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=50)
+        capacity = max(1, int(os.getenv("SD_CAPTURE_BUFFER_MS", "1000")) // FRAME_MS)
+        batch = int(os.getenv("SD_CAPTURE_BATCH", "1"))
+        self.rate = rate
+        self._ring = CaptureRing(frame_bytes_at(rate), capacity_frames=capacity, batch_frames=batch)
+        self.channels = channels
+        # sink: 指定すると録音データ（channels チャンネルのインターリーブ）をリングではなくこれに渡す
+        self._sink = sink
         self._stream = None
+        # PortAudio が報告した入力オーバーフロー（status.input_overflow）。sink 指定時もここで数える
+        self.device_overflows = 0
+
+    def device_stats(self) -> dict:
+        return {"device_overflows": self.device_overflows}
+
+    def capture_stats(self) -> dict:
+        return {**self._ring.stats(), **self.device_stats()}
 
     async def __aenter__(self):
+        ring = self._ring
+        ring.attach(asyncio.get_running_loop())
+        write = self._sink or ring.write
+
         def callback(indata, frames, time, status):  # RawInputStream: indata は bytes ライク
-            try:
-                # そのまま bytes へ（演算なし。bytes=生のバイト列データ）
-                self._queue.put_nowait(bytes(indata))
-            except Exception:
-                # キュー（順番待ちの箱）が満杯のときは捨てる（オーバーフロー対策）
-                pass
+            # 音声スレッド: リングへコピーするだけ（bytes を作らない。満杯なら捨てて数える）
+            if status and status.input_overflow:
+                self.device_overflows += 1
+            write(indata)
 
         self._stream = self.sd.RawInputStream(
-            samplerate=RATE,
+            samplerate=self.rate,
             dtype="int16",
-            channels=CHANNELS,
-            blocksize=int(RATE * (FRAME_MS / 1000.0)),
+            channels=self.channels,
+            blocksize=int(self.rate * (FRAME_MS / 1000.0)),
             device=self.device,
             callback=callback,
         )
@@ -154,9 +203,9 @@ class SoundDeviceSource:
             self._stream = None
 
     async def frames(self) -> AsyncIterator[bytes]:
+        ring = self._ring
         while True:
-            chunk = await self._queue.get()
-            yield chunk
+            yield await ring.get()
 
 
 def rms_int16(frame: bytes) -> float:
@@ -165,50 +214,11 @@ def rms_int16(frame: bytes) -> float:
     RMS（平均二乗平方根）: 音の大きさを表す代表的な指標。値が大きいほど音量が大きい。
     実環境のマイクでは直流成分（DCオフセット）が乗ることがあるため、
     平均値を差し引いた分散から標準偏差を求める方法に変更（DCの影響を低減）。
-    """
-    if not frame:
-        return 0.0
-    count = len(frame) // 2
-    if count <= 0:
-        return 0.0
-    # 1パスで合計と二乗和を集計
-    sum_s = 0
-    sum_sq = 0
-    for i in range(0, len(frame), 2):
-        s = int.from_bytes(frame[i : i + 2], byteorder="little", signed=True)
-        sum_s += s
-        sum_sq += s * s
-    mean = sum_s / count
-    # 分散 = E[x^2] - (E[x])^2
-    mean_square = sum_sq / count
-    var = max(0.0, mean_square - mean * mean)
-    return math.sqrt(var) / 32768.0
-
-
-class SilenceDetector:
-    """RMS ベース無音検出（閾値・連続時間で判定）。
-
-    閾値: 「これより小さい値は無音とみなす」という線引きとなる値。
-    一定時間以上（min_silence_ms）連続して小さいと「無音区間の終わり」と判断する。
-    """
-
-    def __init__(self, threshold: float = 0.01, min_silence_ms: int = 400):
-        self.threshold = threshold
-        self.min_silence_ms = min_silence_ms
-        self._sil_ms = 0
-        self._last_rms = 0.0
-
-    def update(self, frame: bytes) -> bool:
-        r = rms_int16(frame)
-        self._last_rms = r
-        if r < self.threshold:
-            self._sil_ms += FRAME_MS
-        else:
-            self._sil_ms = 0
-        return self._sil_ms >= self.min_silence_ms
 
-    def reset(self):
-        self._sil_ms = 0
+    実体は frame_analysis.analyze_frame（1回のデコードで全特徴量を計算）。
+    複数の特徴量が必要な場合は analyze_frame の結果を使い回すこと。
+    """
+    return analyze_frame(frame).rms
 
 
 class AlsaaudioSource:
@@ -217,24 +227,107 @@ class AlsaaudioSource:
     注意: Linux/ALSA 環境のみ。ALSA（Advanced Linux Sound Architecture）とは
     Linux の標準的な音声入出力の仕組みのこと。import は遅延し、利用時のみ依存。
     20ms 固定フレームで RAW bytes（生のバイト列）を返す。
+
+    読み取り方式（mode、環境変数 `ALSA_MODE` でも指定可）:
+    - "nonblock"（既定）: PCM_NONBLOCK で開き、poll 用のファイル記述子を
+      イベントループへ add_reader で登録。データが来たときだけ読み取る（ループを止めない）。
+    - "thread": 専用の読み取りスレッドが PCM_NORMAL で読み、リング（CaptureRing）へ渡す。
+    - "blocking": 従来どおりイベントループ上で pcm.read() を呼ぶ（比較用。ループが止まる）。
+    nonblock / thread の受け渡しは SoundDeviceSource と同じ CaptureRing（capture_stats() で統計）。
+    rate: デバイスを開くサンプリングレート（既定 RATE）。
+
+    pcm.read() の例外（デバイスが抜けた等）は read_errors に数え、1周期（20ms）から倍々に最長1秒まで
+    待ってから読み直す。max_read_errors 回続けて失敗したら読み取りをやめ、frames() が CaptureError を
+    送出する（sink 指定時は on_error に渡す）。呼び出し側は `async with` を抜けて開き直せばよい
+    （reopening_frames()）。
     """
 
-    def __init__(self, device: Optional[str] = None):
+    MODES = ("nonblock", "thread", "blocking")
+    max_read_errors = 10
+
+    def __init__(
+        self,
+        device: Optional[str] = None,
+        mode: Optional[str] = None,
+        buffer_ms: int = 1000,
+        channels: int = CHANNELS,
+        sink: Optional[Callable[[object], None]] = None,
+        rate: int = RATE,
+        on_error: Optional[Callable[[CaptureError], None]] = None,
+    ):
+        import os
+
         self.device = device
+        self.channels = channels
+        self.rate = rate
+        self._sink = sink
+        self._on_error = on_error
+        self.mode = mode or os.getenv("ALSA_MODE", "nonblock")
+        if self.mode not in self.MODES:
+            raise ValueError(f"ALSA_MODE は {self.MODES} のいずれかを指定してください: {self.mode!r}")
         self._pcm = None
+        self._ring = CaptureRing(frame_bytes_at(rate), capacity_frames=max(1, buffer_ms // FRAME_MS))
+        self._fds: list = []
+        self._thread = None
+        self._loop = None
+        self._running = False
+        self.xruns = 0  # ALSA のオーバーラン（読み遅れで取りこぼした）回数
+        self.read_errors = 0  # pcm.read() が例外を出した回数
+        self._error_run = 0  # 続けて失敗している回数
+
+    def device_stats(self) -> dict:
+        return {"xruns": self.xruns, "read_errors": self.read_errors}
+
+    def capture_stats(self) -> dict:
+        return {**self._ring.stats(), **self.device_stats()}
 
     async def __aenter__(self):
         import alsaaudio  # type: ignore
 
-        pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL, device=self.device)
-        pcm.setchannels(CHANNELS)
-        pcm.setrate(RATE)
+        loop = asyncio.get_running_loop()
+        pcm_mode = alsaaudio.PCM_NONBLOCK if self.mode == "nonblock" else alsaaudio.PCM_NORMAL
+        pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, pcm_mode, device=self.device)
+        pcm.setchannels(self.channels)
+        pcm.setrate(self.rate)
         pcm.setformat(alsaaudio.PCM_FORMAT_S16_LE)
-        pcm.setperiodsize(int(RATE * (FRAME_MS / 1000.0)))
+        pcm.setperiodsize(int(self.rate * (FRAME_MS / 1000.0)))
         self._pcm = pcm
+        self._loop = loop
+        self._ring.attach(loop)
+        self._error_run = 0
+        self._running = True
+        if self.mode == "nonblock":
+            try:
+                fds = [fd for fd, _events in pcm.polldescriptors()]
+            except (AttributeError, alsaaudio.ALSAAudioError):
+                fds = []
+            if fds:
+                for fd in fds:
+                    loop.add_reader(fd, self._drain_nonblock)
+                self._fds = fds
+            else:
+                # poll 記述子が取れない環境ではスレッド方式へ切り替える
+                pcm.close()
+                self.mode = "thread"
+                return await self.__aenter__()
+        elif self.mode == "thread":
+            import threading
+
+            self._thread = threading.Thread(target=self._reader_thread, name=f"alsa-capture-{self.device}", daemon=True)
+            self._thread.start()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
+        self._running = False
+        if self._fds:
+            loop = asyncio.get_running_loop()
+            for fd in self._fds:
+                loop.remove_reader(fd)
+            self._fds = []
+        if self._thread is not None:
+            # read() は最長1周期（20ms）で戻るので、スレッドはすぐ終わる
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join, 1.0)
+            self._thread = None
         if self._pcm is not None:
             try:
                 self._pcm.close()
@@ -242,10 +335,74 @@ class AlsaaudioSource:
                 pass
             self._pcm = None
 
-    async def frames(self) -> AsyncIterator[bytes]:
-        import alsaaudio  # type: ignore
+    def _store(self, length: int, data) -> bool:
+        if length > 0:
+            (self._sink or self._ring.write)(data)
+            return True
+        if length < 0:  # -EPIPE: オーバーラン（pyalsaaudio が復帰処理を行う）
+            self.xruns += 1
+        return False
+
+    def _read_failed(self, exc: Exception) -> Optional[float]:
+        """読み取りの失敗を数える。読み直すまで待つ秒数を返す（続けて失敗しすぎたら止めて None）。"""
+        self.read_errors += 1
+        self._error_run += 1
+        if self._error_run >= self.max_read_errors:
+            self._running = False
+            error = CaptureError(f"ALSA 入力（{self.device or 'default'}）の読み取りが {self._error_run} 回続けて失敗しました: {exc}")
+            (self._on_error or self._ring.fail)(error)
+            return None
+        return min(1.0, FRAME_MS / 1000.0 * 2 ** (self._error_run - 1))
+
+    def _drain_nonblock(self):
+        # add_reader のコールバック（イベントループ上）。読めるだけ読んで戻る（待たない）。
+        pcm = self._pcm
+        if pcm is None:
+            return
+        while True:
+            try:
+                length, data = pcm.read()
+            except Exception as e:
+                # fd を登録したままだとすぐまた呼ばれて空回りするので、待つ間は外しておく
+                for fd in self._fds:
+                    self._loop.remove_reader(fd)
+                delay = self._read_failed(e)
+                if delay is not None:
+                    self._loop.call_later(delay, self._resume_nonblock)
+                return
+            self._error_run = 0
+            if not self._store(length, data):
+                return
+
+    def _resume_nonblock(self):
+        if self._running and self._pcm is not None:
+            for fd in self._fds:
+                self._loop.add_reader(fd, self._drain_nonblock)
+
+    def _reader_thread(self):
+        import time
+
+        pcm = self._pcm
+        while self._running and pcm is not None:
+            try:
+                length, data = pcm.read()
+            except Exception as e:
+                if not self._running:
+                    return
+                delay = self._read_failed(e)
+                if delay is None:
+                    return
+                time.sleep(delay)
+                continue
+            self._error_run = 0
+            self._store(length, data)
 
+    async def frames(self) -> AsyncIterator[bytes]:
         assert self._pcm is not None
+        if self.mode != "blocking":
+            ring = self._ring
+            while True:
+                yield await ring.get()
         pcm = self._pcm
         while True:
             # read() は (length, data) を返す（length=読み取れたサンプル数、data=生データ）
@@ -254,3 +411,132 @@ class AlsaaudioSource:
                 await asyncio.sleep(FRAME_MS / 1000.0)
                 continue
             yield data
+
+
+class ChannelSplitter:
+    """インターリーブされた多チャンネル int16 を、チャンネルごとのリングへ分配する。
+
+    各チャンネルのリングの書き込み先スロットへ、memoryview のストライド参照
+    （例: [ch::channels]）から直接コピーする（中間の bytes や配列を作らない）。
+    1回の write で全チャンネルを同じ位置まで書くので、チャンネル間のサンプルはずれない。
+    """
+
+    def __init__(self, rings: Dict[int, CaptureRing], channels: int, frame_bytes: int = FRAME_BYTES):
+        self.rings = rings
+        self.channels = channels
+        self.frame_samples = frame_bytes // SAMPLE_WIDTH
+        self.block_bytes = frame_bytes * channels
+        self._carry = bytearray()  # 1フレームに満たない端数（通常は発生しない）
+
+    def write(self, data):
+        mv = memoryview(data).cast("B")
+        if self._carry or len(mv) % self.block_bytes:
+            self._carry += mv
+            n = len(self._carry) // self.block_bytes * self.block_bytes
+            mv = memoryview(bytes(self._carry[:n]))
+            del self._carry[:n]
+        samples = mv.cast("h")
+        step = self.frame_samples * self.channels
+        for start in range(0, len(samples), step):
+            block = samples[start : start + step]
+            for ch, ring in self.rings.items():
+                slot = ring.ring.reserve()
+                if slot is None:
+                    ring.dropped_frames += 1
+                    ring.overflows += 1
+                    continue
+                slot.cast("h")[:] = block[ch :: self.channels]
+                ring.commit_reserved()
+
+
+class MultiChannelSource:
+    """1つの多チャンネル入力デバイス（例: ステレオの USB オーディオや I2S HAT）を開き、
+    チャンネルごと（self / other）のフレーム列に分けて供給する。
+
+    マイク2本を別々のデバイスとして開く代わりにストリーム・コールバックスレッドが1つで済み、
+    2本のマイクのサンプル位置も揃う。
+
+    - backend: "sounddevice" または "alsa"（alsa の blocking 方式は使えないため thread に切り替える）
+    - mapping: ストリーム名 → チャンネル番号（既定 {"self": 0, "other": 1}）
+    self と other の frames() をそれぞれ `async with` で使ってよい（最初の入場で開き、最後の退場で閉じる）。
+    rate: デバイスを開くサンプリングレート（既定 RATE）。
+    """
+
+    def __init__(
+        self,
+        backend: str = "sounddevice",
+        device: Optional[int | str] = None,
+        channels: int = 2,
+        mapping: Optional[Dict[str, int]] = None,
+        buffer_ms: int = 1000,
+        rate: int = RATE,
+    ):
+        self.mapping = dict(mapping or {"self": 0, "other": 1})
+        for name, ch in self.mapping.items():
+            if not 0 <= ch < channels:
+                raise ValueError(f"{name} のチャンネル番号 {ch} が範囲外です（channels={channels}）")
+        capacity = max(1, buffer_ms // FRAME_MS)
+        fb = frame_bytes_at(rate)
+        self.rings: Dict[str, CaptureRing] = {name: CaptureRing(fb, capacity_frames=capacity) for name in self.mapping}
+        splitter = ChannelSplitter({self.mapping[n]: r for n, r in self.rings.items()}, channels, frame_bytes=fb)
+        if backend == "sounddevice":
+            self._source = SoundDeviceSource(device=device, channels=channels, sink=splitter.write, rate=rate)
+        elif backend == "alsa":
+            import os
+
+            mode = os.getenv("ALSA_MODE", "nonblock")
+            self._source = AlsaaudioSource(
+                device=device,
+                mode="thread" if mode == "blocking" else mode,
+                channels=channels,
+                sink=splitter.write,
+                rate=rate,
+                on_error=self._fail,
+            )
+        else:
+            raise ValueError(f"backend は 'sounddevice' か 'alsa' を指定してください: {backend!r}")
+        self._users = 0
+
+    def _fail(self, error: CaptureError):
+        for ring in self.rings.values():
+            ring.fail(error)
+
+    async def __aenter__(self):
+        if self._users == 0:
+            loop = asyncio.get_running_loop()
+            for ring in self.rings.values():
+                ring.attach(loop)
+            await self._source.__aenter__()
+        self._users += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._users -= 1
+        if self._users == 0:
+            await self._source.__aexit__(exc_type, exc, tb)
+
+    def capture_stats(self) -> Dict[str, dict]:
+        """ストリームごとのリングの統計。デバイス側の数（オーバーフロー・xrun など）は両方に同じ値が入る。"""
+        device = self._source.device_stats()
+        return {name: {**ring.stats(), **device} for name, ring in self.rings.items()}
+
+    async def frames(self, name: str) -> AsyncIterator[bytes]:
+        ring = self.rings[name]
+        while True:
+            yield await ring.get()
+
+
+async def reopening_frames(source, *args, retry_s: float = 1.0) -> AsyncIterator[bytes]:
+    """`async with source` の中で source.frames(*args) を流す。
+
+    CaptureError（デバイスから読めなくなった）なら retry_s 秒待ってデバイスを開き直す
+    （送信タスクの接続はそのまま）。
+    """
+    while True:
+        try:
+            async with source as s:
+                async for f in s.frames(*args):
+                    yield f
+        except CaptureError as e:
+            _log.warning("[capture] %s。%.1f 秒後に開き直します。", e, retry_s)
+            await asyncio.sleep(retry_s)
@@ -0,0 +1,311 @@
+"""音声コーデック（上り・下りの帯域を減らすための圧縮形式）。
+
+- "pcm_s16le": 無圧縮（従来どおり）。24kHz で 48KB/s。
+- "pcmu": G.711 μ-law。1サンプル8ビット（1/2）。
+- "pcma": G.711 A-law。1サンプル8ビット（1/2）。
+- "ima_adpcm": IMA-ADPCM。1サンプル4ビット（約1/4）。
+
+G.711 は表引き（LUT）で変換する。NumPy があれば表引きをベクトル演算でまとめて行い、
+なければ map と表の __getitem__（C 実装のループ）で行う。
+IMA-ADPCM は前のサンプルに依存する逐次処理のため、量子化幅と差分を事前計算した表で1サンプルずつ処理する。
+Python のループなので G.711 の数十倍重い（24kHz・20ms で符号化 約380µs、復号 約170µs。bench/codec_bench.py）。
+ラズパイでマイク2本なら pcmu を使い、ima_adpcm は帯域が足りないときだけ AUDIO_CODEC で明示する。
+
+IMA-ADPCM の1メッセージ（ブロック）形式（各メッセージは単独で復号できる）:
+  先頭4バイト = 最初のサンプル(int16 LE) + ステップ番号(uint8) + 最後の上位ニブルが詰め物なら1
+  以降 = 残りのサンプルを4ビットずつ（下位ニブルが先）
+
+どのコーデックを使うかは hello で取り決める（negotiate_codec）。
+"""
+
+import array
+import sys
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import numpy as np  # type: ignore
+
+    HAVE_NUMPY = True
+except ImportError:  # NumPy は任意依存
+    np = None
+    HAVE_NUMPY = False
+
+
+PCM = "pcm_s16le"
+_LITTLE = sys.byteorder == "little"
+
+
+def _samples(pcm) -> array.array:
+    a = array.array("h")
+    a.frombytes(pcm)
+    if not _LITTLE:
+        a.byteswap()
+    return a
+
+
+def _to_bytes(a: array.array) -> bytes:
+    if not _LITTLE:
+        a.byteswap()
+    return a.tobytes()
+
+
+# ---------------------------------------------------------------------------
+# G.711（μ-law / A-law）
+# ---------------------------------------------------------------------------
+
+_SEG_UEND = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+_SEG_AEND = (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF)
+
+
+def _segment(value: int, table) -> int:
+    for i, end in enumerate(table):
+        if value <= end:
+            return i
+    return len(table)
+
+
+def linear_to_ulaw(sample: int) -> int:
+    v = sample >> 2
+    if v < 0:
+        v, mask = -v, 0x7F
+    else:
+        mask = 0xFF
+    v = min(v, 8159) + 0x21
+    seg = _segment(v, _SEG_UEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    return ((seg << 4) | ((v >> (seg + 1)) & 0x0F)) ^ mask
+
+
+def ulaw_to_linear(u: int) -> int:
+    u = ~u & 0xFF
+    t = (((u & 0x0F) << 3) + 0x84) << ((u & 0x70) >> 4)
+    return 0x84 - t if u & 0x80 else t - 0x84
+
+
+def linear_to_alaw(sample: int) -> int:
+    v = sample >> 3
+    if v >= 0:
+        mask = 0xD5
+    else:
+        mask = 0x55
+        v = -v - 1
+    seg = _segment(v, _SEG_AEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    aval = seg << 4
+    aval |= (v >> 1) & 0x0F if seg < 2 else (v >> seg) & 0x0F
+    return aval ^ mask
+
+
+def alaw_to_linear(a: int) -> int:
+    a ^= 0x55
+    t = (a & 0x0F) << 4
+    seg = (a & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    elif seg == 1:
+        t += 0x108
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if a & 0x80 else -t
+
+
+class _G711Tables:
+    """符号化（65536 要素、uint16 で引く）と復号（256 要素）の表。初回使用時に作る。"""
+
+    def __init__(self, to_law, to_linear):
+        # 符号化表は int16 を uint16 として読んだ値（0..65535）で引く
+        self.enc = bytes(to_law(i - 65536 if i >= 32768 else i) for i in range(65536))
+        dec = array.array("h", (to_linear(i) for i in range(256)))
+        if not _LITTLE:
+            dec.byteswap()
+        self.dec_bytes = [dec[i : i + 1].tobytes() for i in range(256)]
+        if HAVE_NUMPY:
+            self.np_enc = np.frombuffer(self.enc, dtype=np.uint8)
+            self.np_dec = np.array([to_linear(i) for i in range(256)], dtype="<i2")
+
+
+_TABLES: Dict[str, _G711Tables] = {}
+
+
+def _tables(name: str) -> _G711Tables:
+    t = _TABLES.get(name)
+    if t is None:
+        if name == "pcmu":
+            t = _G711Tables(linear_to_ulaw, ulaw_to_linear)
+        else:
+            t = _G711Tables(linear_to_alaw, alaw_to_linear)
+        _TABLES[name] = t
+    return t
+
+
+class G711Codec:
+    bytes_per_sample = 1.0
+
+    def __init__(self, name: str):
+        if name not in ("pcmu", "pcma"):
+            raise ValueError(f"G.711 コーデック名が不正です: {name!r}")
+        self.name = name
+        self._t = _tables(name)
+
+    def encode(self, pcm) -> bytes:
+        n = len(pcm) // 2
+        if HAVE_NUMPY:
+            x = np.frombuffer(pcm, dtype="<u2", count=n)
+            return self._t.np_enc[x].tobytes()
+        if _LITTLE:
+            vals = memoryview(pcm)[: n * 2].cast("H")
+        else:
+            vals = [s & 0xFFFF for s in _samples(pcm[: n * 2])]
+        return bytes(map(self._t.enc.__getitem__, vals))
+
+    def decode(self, data) -> bytes:
+        if HAVE_NUMPY:
+            return self._t.np_dec[np.frombuffer(data, dtype=np.uint8)].tobytes()
+        return b"".join(map(self._t.dec_bytes.__getitem__, data))
+
+
+# ---------------------------------------------------------------------------
+# IMA-ADPCM
+# ---------------------------------------------------------------------------
+
+_INDEX_ADJUST = (-1, -1, -1, -1, 2, 4, 6, 8)
+_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+
+
+def _build_adpcm_tables():
+    # (ステップ番号, ニブル) → 予測値への加算量 / 次のステップ番号（16 × 89 の平坦な表）
+    diff: List[int] = []
+    nxt: List[int] = []
+    for idx, step in enumerate(_STEPS):
+        for nib in range(16):
+            d = step >> 3
+            if nib & 4:
+                d += step
+            if nib & 2:
+                d += step >> 1
+            if nib & 1:
+                d += step >> 2
+            diff.append(-d if nib & 8 else d)
+            nxt.append(min(88, max(0, idx + _INDEX_ADJUST[nib & 7])) * 16)
+    return tuple(diff), tuple(nxt)
+
+
+_ADPCM_DIFF, _ADPCM_NEXT = _build_adpcm_tables()
+
+
+class ImaAdpcmCodec:
+    name = "ima_adpcm"
+    bytes_per_sample = 0.5
+
+    def __init__(self):
+        # 符号化側はメッセージをまたいでステップ番号を引き継ぐ（立ち上がりを速くするため）
+        self._index = 0
+
+    def encode(self, pcm) -> bytes:
+        samples = _samples(pcm[: len(pcm) // 2 * 2])
+        if not samples:
+            return b""
+        pred = samples[0]
+        row = self._index * 16
+        out = bytearray(4 + len(samples) // 2)
+        out[0:2] = (pred & 0xFFFF).to_bytes(2, "little")
+        out[2] = self._index
+        diff_t, next_t, steps = _ADPCM_DIFF, _ADPCM_NEXT, _STEPS
+        pos = 4
+        high = False
+        for s in samples[1:]:
+            step = steps[row >> 4]
+            d = s - pred
+            if d < 0:
+                nib = 8 | min(7, ((-d) << 2) // step)
+            else:
+                nib = min(7, (d << 2) // step)
+            pred += diff_t[row + nib]
+            if pred > 32767:
+                pred = 32767
+            elif pred < -32768:
+                pred = -32768
+            row = next_t[row + nib]
+            if high:
+                out[pos] |= nib << 4
+                pos += 1
+            else:
+                out[pos] = nib
+            high = not high
+        self._index = row >> 4
+        out[3] = 1 if high else 0
+        return bytes(out[: pos + high])
+
+    def decode(self, data) -> bytes:
+        if len(data) < 4:
+            return b""
+        pred = int.from_bytes(data[0:2], "little", signed=True)
+        row = min(88, data[2]) * 16
+        out = array.array("h", [pred])
+        append = out.append
+        diff_t, next_t = _ADPCM_DIFF, _ADPCM_NEXT
+        for byte in memoryview(data)[4:]:
+            for nib in (byte & 0x0F, byte >> 4):
+                pred += diff_t[row + nib]
+                if pred > 32767:
+                    pred = 32767
+                elif pred < -32768:
+                    pred = -32768
+                row = next_t[row + nib]
+                append(pred)
+        if data[3] and len(out) > 1:
+            out.pop()  # 詰め物のニブル
+        return _to_bytes(out)
+
+
+class PcmCodec:
+    name = PCM
+    bytes_per_sample = 2.0
+
+    def encode(self, pcm) -> bytes:
+        return bytes(pcm)
+
+    def decode(self, data) -> bytes:
+        return bytes(data)
+
+
+# 優先順（小さいほど帯域が少ない）
+SUPPORTED_CODECS = ("ima_adpcm", "pcmu", "pcma", PCM)
+
+
+def make_codec(name: str):
+    """コーデック名からインスタンスを作る（ADPCM は状態を持つので接続・ストリームごとに作る）。"""
+    if name == PCM:
+        return PcmCodec()
+    if name in ("pcmu", "pcma"):
+        return G711Codec(name)
+    if name == "ima_adpcm":
+        return ImaAdpcmCodec()
+    raise ValueError(f"未対応のコーデックです: {name!r}")
+
+
+def negotiate_codec(offered: Optional[Iterable[str]], supported: Iterable[str] = SUPPORTED_CODECS) -> str:
+    """相手が挙げた順（希望順）に、こちらも対応しているものを選ぶ。無ければ PCM。"""
+    supported = set(supported)
+    for name in offered or ():
+        if name in supported:
+            return name
+    return PCM
+
+
+def parse_codec_list(value: Optional[str]) -> List[str]:
+    """環境変数 "pcmu,pcma" のようなカンマ区切りを希望順のリストにする（末尾に PCM を補う）。"""
+    names = [v.strip() for v in (value or "").split(",") if v.strip()]
+    if PCM not in names:
+        names.append(PCM)
+    return names
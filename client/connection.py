@@ -0,0 +1,181 @@
+"""接続の管理（すぐに張り直す・予備の接続を用意しておく・復旧時間の計測）。
+
+従来の sender_task / playback_task は例外が起きるたびに接続を捨て、0.5 秒から最大 10 秒まで
+伸びる待ち（backoff）の後で張り直していたため、その間に話した内容は失われていた。
+ConnectionManager は次のようにして復旧までの時間を縮める。
+
+- 最初の失敗ではすぐに張り直す（待つのは続けて失敗したときと、張り直した接続が stable_s 秒もたずに
+  切れたときだけ。0.5 秒から最大 max_backoff 秒）。
+- standby=True なら、使っている接続とは別に予備の接続を先に張っておき（WS_STANDBY=1）、
+  切れたら予備に切り替える（TCP・TLS・WebSocket のハンドシェイクを待たない）。
+  hello は使い始めるときに送るので、サーバからは普通の新しい接続に見える。
+  多重化（mux.MuxClient.channel）は同じチャンネルを2つ持てないので standby は使わない。
+- 失敗した接続の後始末（close ハンドシェイク）は待たずに裏で行う（切れた相手への close は
+  タイムアウトまで返らないことがあるため）。
+- 切断を検出してから、新しい接続で使える状態になる（mark_up()）までの時間を stats に記録する。
+"""
+
+import asyncio
+import collections
+import contextlib
+import time
+from typing import AsyncContextManager, Callable, Optional
+
+
+class RecoveryStats:
+    """切断から復旧までの時間（ms）。直近 history 件から中央値などを出す。"""
+
+    # as_dict() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"connects", "failures", "recoveries", "standby_used", "backoff_s"})
+
+    def __init__(self, history: int = 100):
+        self.connects = 0
+        self.failures = 0
+        self.recoveries = 0
+        self.standby_used = 0
+        self.backoff_s = 0.0  # 続けて失敗したときに待った合計時間
+        self.last_recovery_ms = 0.0
+        self.max_recovery_ms = 0.0
+        self._recovery_ms: collections.deque = collections.deque(maxlen=history)
+
+    def record(self, ms: float):
+        self.recoveries += 1
+        self.last_recovery_ms = ms
+        self.max_recovery_ms = max(self.max_recovery_ms, ms)
+        self._recovery_ms.append(ms)
+
+    def as_dict(self) -> dict:
+        d = sorted(self._recovery_ms)
+        pick = lambda q: d[min(len(d) - 1, int(q * len(d)))] if d else 0.0
+        return {
+            "connects": self.connects,
+            "failures": self.failures,
+            "recoveries": self.recoveries,
+            "standby_used": self.standby_used,
+            "backoff_s": round(self.backoff_s, 3),
+            "last_recovery_ms": round(self.last_recovery_ms, 1),
+            "p50_recovery_ms": round(pick(0.5), 1),
+            "p95_recovery_ms": round(pick(0.95), 1),
+            "max_recovery_ms": round(self.max_recovery_ms, 1),
+        }
+
+
+class ConnectionManager:
+    """connect（接続を作る関数。websockets.connect や MuxClient.channel）を包む。
+
+    使い方:
+        while True:
+            try:
+                async with manager.connection() as ws:
+                    ...（hello などが済んだら manager.mark_up()）
+            except Exception:
+                await manager.on_failure()
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], AsyncContextManager],
+        standby: bool = False,
+        max_backoff: float = 10.0,
+        stable_s: float = 1.0,
+    ):
+        self._connect = connect
+        self.standby = standby
+        self.max_backoff = max_backoff
+        self.stable_s = stable_s
+        self.stats = RecoveryStats()
+        self._failures_in_row = 0
+        self._up_at: Optional[float] = None
+        self._down_at: Optional[float] = None
+        self._standby_task: Optional[asyncio.Task] = None
+        self._closing: set = set()
+
+    async def _open(self):
+        cm = self._connect()
+        ws = await cm.__aenter__()
+        return cm, ws
+
+    @staticmethod
+    def _is_open(ws) -> bool:
+        # websockets の接続は state（新しい API）か closed（古い API）で閉じたか分かる
+        state = getattr(ws, "state", None)
+        if state is not None:
+            return getattr(state, "name", "OPEN") == "OPEN"
+        return not getattr(ws, "closed", False)
+
+    async def _take_standby(self):
+        task, self._standby_task = self._standby_task, None
+        if task is None:
+            return None
+        try:
+            cm, ws = await task  # 張っている途中なら待つ（新しく張り始めるより早い）
+        except Exception:
+            return None
+        if self._is_open(ws):
+            return cm, ws
+        with contextlib.suppress(Exception):
+            await cm.__aexit__(None, None, None)
+        return None
+
+    def _prepare_standby(self):
+        if self.standby and self._standby_task is None:
+            self._standby_task = asyncio.create_task(self._open())
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        pair = await self._take_standby() if self.standby else None
+        if pair is not None:
+            self.stats.standby_used += 1
+        else:
+            pair = await self._open()
+        cm, ws = pair
+        self.stats.connects += 1
+        self._prepare_standby()
+        try:
+            yield ws
+        except Exception as e:
+            task = asyncio.create_task(self._close(cm, (type(e), e, e.__traceback__)))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            raise
+        except BaseException as e:
+            await self._close(cm, (type(e), e, e.__traceback__))
+            raise
+        else:
+            await self._close(cm, (None, None, None))
+
+    @staticmethod
+    async def _close(cm, exc_info):
+        with contextlib.suppress(Exception):
+            await cm.__aexit__(*exc_info)
+
+    def mark_up(self):
+        """新しい接続が使える状態になったら呼ぶ（hello の取り決めが済んだ時点など）。"""
+        self._up_at = time.monotonic()
+        if self._down_at is not None:
+            self.stats.record((self._up_at - self._down_at) * 1000.0)
+            self._down_at = None
+
+    async def on_failure(self):
+        """接続が切れた・張れなかったときに呼ぶ。1回目はすぐ戻り、続けて失敗したら待つ。"""
+        now = time.monotonic()
+        self.stats.failures += 1
+        if self._up_at is not None and now - self._up_at >= self.stable_s:
+            self._failures_in_row = 0  # しばらく使えていた接続が切れた（1回目の失敗として扱う）
+        self._up_at = None
+        if self._down_at is None:
+            self._down_at = now
+        self._failures_in_row += 1
+        if self._failures_in_row > 1:
+            delay = min(self.max_backoff, 0.5 * 1.7 ** (self._failures_in_row - 2))
+            self.stats.backoff_s += delay
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        task, self._standby_task = self._standby_task, None
+        if task is None:
+            return
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            cm, _ = await task
+            await cm.__aexit__(None, None, None)
@@ -1,20 +1,25 @@
 """
 感情に応じたLED制御モジュール
 Raspberry Pi 5対応版（gpiozero使用）
+表示は log.get_logger（イベントループの上で端末への書き込みを待たない）
 """
 import os
 from typing import Optional
 
+from .log import get_logger
+
+_log = get_logger("emotion_led")
+
 # Raspberry Pi 5対応: gpiozeroを使用
 try:
     from gpiozero import LED as GPIO_LED
     from gpiozero import RGBLED
     GPIO_AVAILABLE = True
-    print("✅ gpiozero を使用してGPIO制御を初期化します（Raspberry Pi 5対応）")
+    _log.info("✅ gpiozero を使用してGPIO制御を初期化します（Raspberry Pi 5対応）")
 except ImportError:
     GPIO_AVAILABLE = False
-    print("⚠️  gpiozeroが利用できません。LED制御は無効化されています。")
-    print("    インストール: pip install gpiozero lgpio")
+    _log.warning("⚠️  gpiozeroが利用できません。LED制御は無効化されています。")
+    _log.warning("    インストール: pip install gpiozero lgpio")
 
 
 class EmotionLED:
@@ -51,17 +56,17 @@ class EmotionLED:
         if self.enabled:
             try:
                 self._setup_gpio()
-                print("✅ 感情RGB LED制御を初期化しました")
-                print(f"   赤: GPIO {self.PIN_RED}")
-                print(f"   緑: GPIO {self.PIN_GREEN}")
-                print(f"   青: GPIO {self.PIN_BLUE}")
-                print(f"   タイプ: {'共通アノード' if self.IS_COMMON_ANODE else '共通カソード'}")
+                _log.info("✅ 感情RGB LED制御を初期化しました")
+                _log.info("   赤: GPIO %s", self.PIN_RED)
+                _log.info("   緑: GPIO %s", self.PIN_GREEN)
+                _log.info("   青: GPIO %s", self.PIN_BLUE)
+                _log.info("   タイプ: %s", "共通アノード" if self.IS_COMMON_ANODE else "共通カソード")
             except Exception as e:
-                print(f"⚠️  GPIO初期化に失敗しました: {e}")
-                print(f"    LED制御を無効化します")
+                _log.warning("⚠️  GPIO初期化に失敗しました: %s", e)
+                _log.warning("    LED制御を無効化します")
                 self.enabled = False
         else:
-            print("ℹ️  感情LED制御は無効です（有効にするには: export USE_LED=1）")
+            _log.info("ℹ️  感情LED制御は無効です（有効にするには: export USE_LED=1）")
     
     def _setup_gpio(self):
         """GPIOの初期設定（RGB LED用・gpiozero使用）"""
@@ -97,9 +102,9 @@ class EmotionLED:
             # RGBLEDの色を設定（0.0～1.0の値）
             self.rgb_led.color = (r, g, b)
             
-            print(f"💡 LED点灯: {emotion} -> RGB({r:.1f}, {g:.1f}, {b:.1f})")
+            _log.info("💡 LED点灯: %s -> RGB(%.1f, %.1f, %.1f)", emotion, r, g, b)
         else:
-            print(f"⚠️  未知の感情: {emotion}")
+            _log.warning("⚠️  未知の感情: %s", emotion)
             # デフォルトは白色
             self.rgb_led.color = (1.0, 1.0, 1.0)
     
@@ -109,7 +114,7 @@ class EmotionLED:
             return
         
         self.rgb_led.off()
-        print("💡 RGB LEDを消灯")
+        _log.info("💡 RGB LEDを消灯")
     
     def cleanup(self):
         """GPIO資源を解放"""
@@ -118,7 +123,7 @@ class EmotionLED:
         
         self.clear()
         self.rgb_led.close()
-        print("✅ GPIO資源を解放しました")
+        _log.info("✅ GPIO資源を解放しました")
     
     def __enter__(self):
         """コンテキストマネージャー"""
@@ -0,0 +1,138 @@
+"""フレーム解析（1フレーム=20ms の int16 PCM を1回だけデコードして特徴量を求める）。
+
+送信側（sender_task）と VAD（無音検出）が同じフレームを何度もデコードしないよう、
+ここで一度に以下の特徴量を計算し、結果（FrameFeatures）を共有する。
+
+- rms: DC（直流成分）を除いた RMS。0.0〜1.0 に正規化（従来の rms_int16 と同じ値）。
+- peak: 絶対値の最大。0.0〜1.0 に正規化。
+- dc: 平均値（DCオフセット）。-1.0〜1.0 に正規化。
+- zcr: ゼロ交差率（隣り合うサンプルで符号が変わった割合）。0.0〜1.0。
+
+NumPy があればベクトル演算、なければ memoryview.cast（コピーなしで int16 として参照）と
+組み込み関数（sum/max/map）による C 実装のループで計算する。
+"""
+
+import math
+import operator
+import sys
+from typing import Iterable, List
+
+try:
+    import numpy as np  # type: ignore
+
+    HAVE_NUMPY = True
+except ImportError:  # NumPy は任意依存
+    np = None
+    HAVE_NUMPY = False
+
+
+_LITTLE = sys.byteorder == "little"
+
+
+class FrameFeatures:
+    """1フレーム分の特徴量（解析結果）。"""
+
+    __slots__ = ("rms", "peak", "dc", "zcr", "samples")
+
+    def __init__(self, rms: float = 0.0, peak: float = 0.0, dc: float = 0.0, zcr: float = 0.0, samples: int = 0):
+        self.rms = rms
+        self.peak = peak
+        self.dc = dc
+        self.zcr = zcr
+        self.samples = samples
+
+    def __repr__(self) -> str:
+        return (
+            f"FrameFeatures(rms={self.rms:.4f}, peak={self.peak:.4f}, "
+            f"dc={self.dc:.4f}, zcr={self.zcr:.3f}, samples={self.samples})"
+        )
+
+
+SILENT_FEATURES = FrameFeatures()
+
+
+def _analyze_numpy(frame) -> FrameFeatures:
+    # frombuffer はコピーなしで bytes を int16 配列として参照する
+    x = np.frombuffer(frame, dtype="<i2", count=len(frame) // 2)
+    n = x.size
+    xf = x.astype(np.float64)
+    total = float(xf.sum())
+    sq = float(np.dot(xf, xf))
+    peak = max(int(x.max()), -int(x.min()))
+    neg = x < 0
+    crossings = int(np.count_nonzero(neg[1:] != neg[:-1]))
+    return _finish(n, total, sq, peak, crossings)
+
+
+_is_negative = (0).__gt__
+
+
+def _analyze_pure(frame) -> FrameFeatures:
+    mv = memoryview(frame)
+    n = len(mv) // 2
+    if len(mv) != n * 2:
+        mv = mv[: n * 2]
+    if _LITTLE:
+        x = mv.cast("h")
+    else:  # ビッグエンディアン環境のみ並べ替え（通常の Pi/PC では通らない）
+        import array
+
+        x = array.array("h", mv)
+        x.byteswap()
+    total = sum(x)
+    sq = sum(map(operator.mul, x, x))
+    peak = max(max(x), -min(x))
+    neg = list(map(_is_negative, x))
+    crossings = sum(map(operator.ne, neg[1:], neg[:-1]))
+    return _finish(n, total, sq, peak, crossings)
+
+
+def _finish(n: int, total: float, sq: float, peak: int, crossings: int) -> FrameFeatures:
+    mean = total / n
+    # 分散 = E[x^2] - (E[x])^2
+    var = max(0.0, sq / n - mean * mean)
+    return FrameFeatures(
+        rms=math.sqrt(var) / 32768.0,
+        peak=min(1.0, peak / 32768.0),
+        dc=mean / 32768.0,
+        zcr=crossings / (n - 1) if n > 1 else 0.0,
+        samples=n,
+    )
+
+
+_analyze = _analyze_numpy if HAVE_NUMPY else _analyze_pure
+
+
+def analyze_frame(frame) -> FrameFeatures:
+    """int16 PCM（リトルエンディアン）1フレームの特徴量を求める。
+
+    frame は bytes / bytearray / memoryview のいずれでもよい（コピーしない）。
+    """
+    if len(frame) < 2:
+        return SILENT_FEATURES
+    return _analyze(frame)
+
+
+def analyze_frames(frames: Iterable[bytes]) -> List[FrameFeatures]:
+    """複数フレームをまとめて解析する（オフライン評価やベンチマーク用）。
+
+    NumPy がある場合、同じ長さのフレームは2次元配列にまとめて一括計算する。
+    """
+    frames = list(frames)
+    if not HAVE_NUMPY or not frames:
+        return [analyze_frame(f) for f in frames]
+    size = len(frames[0])
+    if size < 4 or any(len(f) != size for f in frames):
+        return [analyze_frame(f) for f in frames]
+    n = size // 2
+    x = np.frombuffer(b"".join(frames), dtype="<i2").reshape(len(frames), n)
+    xf = x.astype(np.float64)
+    totals = xf.sum(axis=1)
+    sqs = np.einsum("ij,ij->i", xf, xf)
+    peaks = np.maximum(x.max(axis=1).astype(np.int32), -x.min(axis=1).astype(np.int32))
+    neg = x < 0
+    crossings = np.count_nonzero(neg[:, 1:] != neg[:, :-1], axis=1)
+    return [
+        _finish(n, float(t), float(s), int(p), int(c))
+        for t, s, p, c in zip(totals, sqs, peaks, crossings)
+    ]
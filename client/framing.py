@@ -0,0 +1,59 @@
+"""音声バイナリメッセージのヘッダ（連番・取り込み時刻・発話ID）。
+
+従来の音声メッセージは中身（PCM やコーデックで圧縮したもの）だけで、受け取った側は
+遅れて届いたのか失われたのかを区別できなかった。hello で "header": HEADER_NAME を
+取り決めた場合だけ、各音声メッセージの先頭に次の18バイトを付ける（リトルエンディアン）。
+
+  magic(uint8=0xA7) version(uint8=1) seq(uint32) utter_id(uint32) ts_us(uint64)
+
+- seq: 接続（ストリーム）ごとの通し番号。抜けていれば損失、戻っていれば遅着・重複。
+- utter_id: 発話ID。送信側は発話ごとに増やして stop にも同じ値を入れる。
+  受信側（TTS）はサーバが返した発話の ID。
+- ts_us: 送り手の単調時計（time.monotonic）でのマイクロ秒。先頭フレームを取り込んだ
+  （サーバなら生成した）時刻。送り手と受け手の時計は揃っていないので、差の変化（ジッター）を見る用途。
+ヘッダはコーデックで圧縮した後の本体の前に付ける（多重化ヘッダを使う場合はその内側）。
+"""
+
+import struct
+import time
+from typing import Tuple
+
+HEADER_NAME = "seq1"
+MAGIC = 0xA7
+VERSION = 1
+_HEADER = struct.Struct("<BBIIQ")
+HEADER_BYTES = _HEADER.size
+
+
+class AudioHeader:
+    __slots__ = ("seq", "utter_id", "ts_us")
+
+    def __init__(self, seq: int, utter_id: int, ts_us: int):
+        self.seq = seq
+        self.utter_id = utter_id
+        self.ts_us = ts_us
+
+    @property
+    def ts_s(self) -> float:
+        return self.ts_us / 1e6
+
+    def __repr__(self) -> str:
+        return f"AudioHeader(seq={self.seq}, utter_id={self.utter_id}, ts_us={self.ts_us})"
+
+
+def now_us() -> int:
+    return int(time.monotonic() * 1e6)
+
+
+def pack_audio(seq: int, utter_id: int, ts_us: int, payload) -> bytes:
+    return _HEADER.pack(MAGIC, VERSION, seq & 0xFFFFFFFF, utter_id & 0xFFFFFFFF, ts_us & 0xFFFFFFFFFFFFFFFF) + bytes(payload)
+
+
+def unpack_audio(message) -> Tuple[AudioHeader, memoryview]:
+    """(ヘッダ, 本体) を返す。ヘッダが無い・壊れている場合は ValueError。"""
+    if len(message) < HEADER_BYTES:
+        raise ValueError("音声ヘッダより短いメッセージです")
+    magic, version, seq, utter_id, ts_us = _HEADER.unpack_from(message)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"音声ヘッダが不正です（magic={magic:#x}, version={version}）")
+    return AudioHeader(seq, utter_id, ts_us), memoryview(message)[HEADER_BYTES:]
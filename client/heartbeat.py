@@ -0,0 +1,117 @@
+"""アプリケーション層のハートビート（往復時間・時計のずれの計測と、切れた接続の早期検出）。
+
+websockets の ping_interval=30 だけでは、Wi-Fi が不安定で片側だけ切れた（half-open）接続に
+長いあいだ気づけない。hello で "heartbeat": true を提示し、サーバが返答の hello で
+"heartbeat": true を返した場合だけ、JSON の ping/pong をやり取りする。
+
+  クライアント → サーバ: {"type":"ping","id":n,"t":送信時刻[µs]}
+  サーバ → クライアント: {"type":"pong","id":n,"t":（そのまま）,"server_us":サーバの時刻[µs]}
+
+- RTT（往復時間）= 受信時刻 - t。
+- 時計のずれ（offset）= server_us - (t + 受信時刻) / 2（サーバの時計 - クライアントの時計）。
+  直近 window 件のうち RTT が最小のものを採用する（行きと帰りの遅れが最も揃っているため）。
+- 最後の pong から timeout_s（既定 0.6 秒）何も来なければ dead とし、run() が ConnectionError を出す。
+時刻は framing.now_us（time.monotonic）で、音声ヘッダの ts_us と同じ時計。
+"""
+
+import asyncio
+import collections
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from .framing import now_us
+
+
+class Heartbeat:
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"sent", "received", "dead_links"})
+
+    def __init__(self, interval_s: float = 0.2, timeout_s: float = 0.6, history: int = 300, window: int = 20):
+        self.interval_s = interval_s
+        self.timeout_s = max(timeout_s, interval_s * 2)
+        self.window = window
+        # (受信時刻[s], RTT[ms], offset[ms])
+        self.history: collections.deque = collections.deque(maxlen=history)
+        self.sent = 0
+        self.received = 0
+        self.dead_links = 0
+        self._next_id = 0
+        self._last_seen = time.monotonic()
+
+    def reset(self):
+        """接続ごとに呼ぶ（dead の判定を新しい接続の時刻から数え直す。履歴は残す）。"""
+        self._last_seen = time.monotonic()
+
+    @property
+    def dead(self) -> bool:
+        return time.monotonic() - self._last_seen > self.timeout_s
+
+    def ping_message(self) -> str:
+        self._next_id += 1
+        self.sent += 1
+        return json.dumps({"type": "ping", "id": self._next_id, "t": now_us()})
+
+    def on_pong(self, data: dict):
+        t = data.get("t")
+        server_us = data.get("server_us")
+        if not isinstance(t, int):
+            return
+        now = now_us()
+        self._last_seen = time.monotonic()
+        self.received += 1
+        rtt_ms = (now - t) / 1000.0
+        offset_ms = (server_us - (t + now) / 2) / 1000.0 if isinstance(server_us, int) else 0.0
+        self.history.append((now / 1e6, rtt_ms, offset_ms))
+
+    @property
+    def rtt_ms(self) -> Optional[float]:
+        return self.history[-1][1] if self.history else None
+
+    @property
+    def offset_ms(self) -> Optional[float]:
+        """サーバの時計 - クライアントの時計[ms]（直近 window 件で RTT 最小のもの）。"""
+        if not self.history:
+            return None
+        recent = list(self.history)[-self.window :]
+        return min(recent, key=lambda h: h[1])[2]
+
+    def to_local_us(self, server_us: int) -> int:
+        """サーバの時刻[µs]をクライアントの時計（now_us）に直す。ずれが未計測ならそのまま。"""
+        offset = self.offset_ms
+        return server_us - int(offset * 1000) if offset is not None else server_us
+
+    async def run(self, send: Callable[[str], Awaitable[None]]):
+        """interval_s ごとに ping を送る。dead になったら ConnectionError（呼び出し側が張り直す）。"""
+        self.reset()
+        while True:
+            if self.dead:
+                self.dead_links += 1
+                raise ConnectionError(f"ハートビートが {self.timeout_s:.1f} 秒途絶えました")
+            await send(self.ping_message())
+            await asyncio.sleep(self.interval_s)
+
+    def stats(self) -> dict:
+        rtts = sorted(h[1] for h in self.history)
+        pick = lambda q: rtts[min(len(rtts) - 1, int(q * len(rtts)))] if rtts else 0.0
+        offset = self.offset_ms
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "dead_links": self.dead_links,
+            "rtt_last_ms": round(self.rtt_ms or 0.0, 2),
+            "rtt_p50_ms": round(pick(0.5), 2),
+            "rtt_p95_ms": round(pick(0.95), 2),
+            "offset_ms": round(offset, 2) if offset is not None else None,
+        }
+
+
+def make_heartbeat() -> Optional[Heartbeat]:
+    """環境変数から作る（HEARTBEAT=1 で有効。HEARTBEAT_INTERVAL_MS / HEARTBEAT_TIMEOUT_MS）。"""
+    if os.getenv("HEARTBEAT", "0") != "1":
+        return None
+    return Heartbeat(
+        interval_s=int(os.getenv("HEARTBEAT_INTERVAL_MS", "200")) / 1000.0,
+        timeout_s=int(os.getenv("HEARTBEAT_TIMEOUT_MS", "600")) / 1000.0,
+    )
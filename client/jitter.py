@@ -1,10 +1,186 @@
-# jitter.py の内容をまるごと以下に置き換えてください
-
+import array
 import asyncio
-from collections import deque
-from typing import Deque, Optional, Callable
+import collections
+import math
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Callable, Tuple
+
+try:
+    import numpy as np  # type: ignore
+
+    HAVE_NUMPY = True
+except ImportError:  # NumPy は任意依存
+    np = None
+    HAVE_NUMPY = False
 
 from .audio_io import FRAME_BYTES, FRAME_MS
+from .frame_analysis import analyze_frame
+from .log import get_logger
+from .ring import FrameRing
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+CONCEAL_MODES = ("off", "repeat", "noise")
+_LITTLE = sys.byteorder == "little"
+_log = get_logger("jitter")
+
+
+class ArrivalJitterEstimator:
+    """チャンク到着時刻から「遅れ」のばらつき（ジッター）を推定し、目標バッファ量を決める。
+
+    transit = 到着時刻 - 音声上の時刻（チャンク長の累積）。発話（スパート）内で最も小さい
+    transit を「最速で届いた場合」とみなし、それとの差を各チャンクの遅れ（late）とする。
+    サーバが実時間より速くまとめて送ってくる場合は遅れ 0 になるので、余計に深くならない。
+
+    - jitter_ms: 遅れの平滑化平均（RFC 3550 と同じく 1/16 で追従）。
+    - late_peak_ms: 遅れの最大値（すぐ上がり、ゆっくり下がる）。
+    - target_ms: late_peak_ms + margin_ms を [min_ms, max_ms] に収めた値（フレーム単位に切り上げ）。
+    """
+
+    def __init__(self, min_ms: int = 40, max_ms: int = 400, margin_ms: int = FRAME_MS, spurt_gap_s: float = 0.5):
+        self.min_ms = min_ms
+        self.max_ms = max(min_ms, max_ms)
+        self.margin_ms = margin_ms
+        self.spurt_gap_s = spurt_gap_s
+        self.jitter_ms = 0.0
+        self.late_peak_ms = 0.0
+        self.target_ms = min_ms
+        self.increases = 0
+        self.decreases = 0
+        self._base_transit: Optional[float] = None
+        self._media_s = 0.0
+        self._last_arrival: Optional[float] = None
+
+    def on_chunk(self, arrival: float, duration_s: float, sent_at: Optional[float] = None):
+        """sent_at: 送り手の時計での送出（生成）時刻（音声ヘッダの ts）。あればチャンク長の累積の代わりに使う。"""
+        if self._last_arrival is None or arrival - self._last_arrival > self.spurt_gap_s + duration_s:
+            # 新しい発話（しばらく届いていなかった）→ 基準を取り直す
+            self._base_transit = None
+            self._media_s = 0.0
+        self._last_arrival = arrival
+        transit = arrival - (self._media_s if sent_at is None else sent_at)
+        self._media_s += duration_s
+        if self._base_transit is None or transit < self._base_transit:
+            self._base_transit = transit
+        late_ms = (transit - self._base_transit) * 1000.0
+        self.jitter_ms += (late_ms - self.jitter_ms) / 16.0
+        # ピークは即座に上げ、チャンクごとに 2% ずつ下げる
+        self.late_peak_ms = max(late_ms, self.late_peak_ms * 0.98)
+        self._retarget()
+
+    def _retarget(self):
+        want = self.late_peak_ms + self.margin_ms
+        want = int(math.ceil(want / FRAME_MS)) * FRAME_MS
+        want = max(self.min_ms, min(self.max_ms, want))
+        if want > self.target_ms:
+            self.increases += 1
+        elif want < self.target_ms:
+            self.decreases += 1
+        self.target_ms = want
+
+
+class Concealer:
+    """パケット損失の補間（PLC: Packet Loss Concealment）。返答の途中でバッファが空になったとき、
+    max_ms の間だけ代わりのフレームを作って再生を続ける（プリバッファからのやり直しと音切れを防ぐ）。
+
+    - "repeat": 直前のフレームを繰り返しながら無音へフェードアウトする。
+      繰り返しは「逆再生 → 順再生 → …」と交互にするので、フレームの境目で波形が飛ばない。
+    - "noise": 直前のフレームを1フレームでフェードアウトし、以降は小さなコンフォートノイズ
+      （noise_rms、0.0〜1.0）を流す。
+    データが戻れば実フレームの再生に戻る（concealments に数える）。max_ms を超えても戻らなければ
+    返答の終わりとみなして補間をやめる。concealed_frames は作ったフレームの総数。
+    返答が終わったと分かっている（tts_done を受け取った）ときは end() を呼び、補間しない。
+    """
+
+    def __init__(self, frame_bytes: int, mode: str = "repeat", max_ms: int = 80, noise_rms: float = 0.0005):
+        if mode not in CONCEAL_MODES:
+            raise ValueError(f"補間方式は {CONCEAL_MODES} のいずれかを指定してください: {mode!r}")
+        self.mode = mode
+        self.max_frames = max(1, max_ms // FRAME_MS)
+        self.samples = frame_bytes // 2
+        self._last = bytearray(frame_bytes)
+        self._have_last = False
+        self._out = bytearray(frame_bytes)
+        self._out_view = memoryview(self._out)
+        self._run = 0  # 連続で補間しているフレーム数
+        self._noise_pos = 0
+        self._noise = self._make_noise(noise_rms) if mode == "noise" else None
+        self.concealed_frames = 0
+        self.concealments = 0
+
+    def _make_noise(self, rms: float):
+        # 1秒分（50フレーム）を起動時に一度だけ作り、位置をずらしながら使い回す
+        n = self.samples * 50
+        rng = random.Random(0)
+        level = rms * 32768.0
+        vals = [max(-32768, min(32767, int(rng.gauss(0.0, level)))) for _ in range(n)]
+        if HAVE_NUMPY:
+            return np.array(vals, dtype=np.float64)
+        return vals
+
+    def on_frame(self, frame):
+        """実フレームを再生に回すたびに呼ぶ（補間の元として覚えておく）。"""
+        self._last[:] = frame
+        self._have_last = True
+        if self._run:
+            self.concealments += 1
+            self._run = 0
+
+    def end(self):
+        """返答が終わった: 次の返答は補間なしで始める。"""
+        self._have_last = False
+        self._run = 0
+
+    def next(self) -> Optional[memoryview]:
+        """補間フレームを返す（内部バッファを指す memoryview）。補間しない場合は None。"""
+        if self.mode == "off" or not self._have_last:
+            return None
+        if self._run >= self.max_frames:
+            self.end()
+            return None
+        k = self._run
+        self._run += 1
+        self.concealed_frames += 1
+        if self.mode == "repeat":
+            g0 = 1.0 - k / self.max_frames
+            g1 = 1.0 - (k + 1) / self.max_frames
+            self._render(reverse=k % 2 == 0, g0=g0, g1=g1, noise=False)
+        else:
+            self._render(reverse=True, g0=1.0 if k == 0 else 0.0, g1=0.0, noise=True)
+        return self._out_view
+
+    def _render(self, reverse: bool, g0: float, g1: float, noise: bool):
+        n = self.samples
+        if HAVE_NUMPY:
+            src = np.frombuffer(self._last, dtype="<i2", count=n).astype(np.float64)
+            if reverse:
+                src = src[::-1]
+            y = src * np.linspace(g0, g1, n, endpoint=False) if (g0 or g1) else np.zeros(n)
+            if noise:
+                y += self._noise_slice()
+            np.frombuffer(self._out, dtype="<i2")[:] = np.clip(y, -32768, 32767).astype("<i2")
+            return
+        src = array.array("h")
+        src.frombytes(self._last)
+        if not _LITTLE:
+            src.byteswap()
+        if reverse:
+            src.reverse()
+        step = (g1 - g0) / n
+        out = array.array("h", (int(v * (g0 + step * i)) for i, v in enumerate(src)))
+        if noise:
+            out = array.array("h", (max(-32768, min(32767, a + b)) for a, b in zip(out, self._noise_slice())))
+        if not _LITTLE:
+            out.byteswap()
+        self._out[:] = out.tobytes()
+
+    def _noise_slice(self):
+        n = self.samples
+        pos = self._noise_pos
+        self._noise_pos = (pos + n) % (len(self._noise) - n)
+        return self._noise[pos : pos + n]
 
 
 class JitterBuffer:
@@ -14,89 +190,426 @@ class JitterBuffer:
     いったん溜めて順序よく一定間隔で取り出すための小さな貯蔵庫のこと。
 
     - prebuffer_ms: 出力を安定させるため、まずこの時間分を貯めてから再生開始。
-      （バッファ=一時的な保存場所）
-    - max_buffer_ms: ここを超えるほど溜まったら古いフレームから捨てる（遅延を抑えるため）。
+      （バッファ=一時的な保存場所）空になったら再びプリバッファからやり直す。
+    - max_buffer_ms: バッファの容量（上限）。起動時に一度だけ確保する。
+    - overflow: 容量を超えたときの動作。
+      - "block": 空きができるまで push_chunk が待つ（音を捨てない。既定）。
+      - "drop_oldest": 古いフレームから捨てる（遅延を抑える）。
+      - "drop_newest": 入ってきたフレームを捨てる。
+    - adaptive: True なら到着ジッターを測ってプリバッファ量（目標の深さ）を
+      min_prebuffer_ms〜max_prebuffer_ms の範囲で上下させる（prebuffer_ms は初期値）。
+      目標より深く溜まったときは、無音のフレームを捨てて追いつく（遅延を縮める）。
+    - frame_bytes: 1フレーム(20ms)のバイト数。再生デバイスのレートが RATE と異なるときに指定する。
+    - reorder_window: 音声ヘッダ（framing）の連番付きで push したとき、抜けた番号を待つ間に
+      先に届いたチャンクを何個まで保留するか。超えたら（またはバッファが空なら）抜けを損失とみなす。
+      番号が既に過ぎたチャンク・終わった発話のチャンクは古いデータとして捨てる。
+      数は stats() の received_chunks / lost_chunks / stale_chunks / reordered_chunks。
+    - conceal / conceal_ms: 再生中にバッファが空になったときの補間（Concealer）。"off"（既定）/
+      "repeat" / "noise"。補間中はプリバッファからやり直さない。数は stats() の concealed_frames など。
+      end_utterance()（tts_done）の後に空になったのは返答の終わりなので補間しない。
+
+    中身は事前確保したリングバッファ（FrameRing）。push_chunk（受信タスク）と
+    pop_frame（再生ループ）はそれぞれ1つだけなので、フレームごとのロックは不要。
+    pop_frame が返すのはリング内を指す memoryview（コピーなし）で、
+    release() するか次の pop_frame を呼ぶまで上書きされない。
+
+    threaded=True のときは読み出し側が別スレッド（PortAudio のコールバック）になる前提で、
+    read_into() で読み出す。読み出し側がイベントループを起こすのは、push_chunk が
+    空き待ち（overflow="block"）をしているときだけ（call_soon_threadsafe）。
+    この場合、書き込み側が古いフレームを捨てると競合するため drop_oldest は使えない。
     """
 
-    def __init__(self, prebuffer_ms: int = 200, max_buffer_ms: int = 600):
-        self.queue: Deque[bytes] = deque()
+    # 追いつき時に「無音」とみなす RMS
+    SILENCE_RMS = 0.003
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({
+        "dropped_frames", "target_increases", "target_decreases", "catchup_dropped",
+        "concealed_frames", "concealments", "received_chunks", "lost_chunks", "stale_chunks", "reordered_chunks",
+    })
+
+    def __init__(
+        self,
+        prebuffer_ms: int = 200,
+        max_buffer_ms: int = 600,
+        overflow: str = "block",
+        adaptive: bool = False,
+        min_prebuffer_ms: int = 40,
+        max_prebuffer_ms: int = 400,
+        threaded: bool = False,
+        frame_bytes: int = FRAME_BYTES,
+        reorder_window: int = 1,
+        conceal: str = "off",
+        conceal_ms: int = 80,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow は {OVERFLOW_POLICIES} のいずれかを指定してください: {overflow!r}")
+        if threaded and overflow == "drop_oldest":
+            raise ValueError("threaded=True では overflow='drop_oldest' は使えません（block か drop_newest）")
+        self.threaded = threaded
+        self.frame_bytes = frame_bytes
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._space_waiting = False
+        self._last_push = 0.0
         self.prebuffer_frames = max(0, prebuffer_ms // FRAME_MS)
-        # max_frames はもう使いませんが、互換性のために残しておきます
-        self.max_frames = max(1, max_buffer_ms // FRAME_MS)
-        self._lock = asyncio.Lock()
+        self.estimator: Optional[ArrivalJitterEstimator] = None
+        if adaptive:
+            self.estimator = ArrivalJitterEstimator(min_ms=min_prebuffer_ms, max_ms=max_prebuffer_ms)
+            self.estimator.target_ms = max(min_prebuffer_ms, min(max_prebuffer_ms, prebuffer_ms))
+            max_buffer_ms = max(max_buffer_ms, max_prebuffer_ms)
+        self.max_frames = max(1, max_buffer_ms // FRAME_MS, self.prebuffer_frames)
+        self.overflow = overflow
+        # +1 は再生ループが書き込み中（保持中）のフレーム用
+        self._ring = FrameRing(frame_bytes, self.max_frames + 1)
+        self._held = False
+        self._started = False
+        self._space = asyncio.Event()
+        self._data = asyncio.Event()
+        self.dropped_frames = 0
+        self.catchup_dropped = 0
+        # 連番（音声ヘッダ）付きの場合の並べ替え・損失検出
+        self.reorder_window = max(0, reorder_window)
+        self._utter: Optional[int] = None
+        self._past_utters: collections.deque = collections.deque(maxlen=8)
+        self._next_seq = 0
+        self._pending: Dict[int, Tuple[bytes, Optional[float]]] = {}
+        self.received_chunks = 0
+        self.lost_chunks = 0
+        self.stale_chunks = 0
+        self.reordered_chunks = 0
+        self.concealer: Optional[Concealer] = Concealer(frame_bytes, conceal, conceal_ms) if conceal != "off" else None
+        self._ended = False  # 今の返答の終わり（tts_done）を受け取った。次の push で戻す
+
+    def __len__(self) -> int:
+        """再生待ちのフレーム数（保持中のフレームは含まない）。"""
+        return len(self._ring) - self._held
+
+    async def push_chunk(
+        self, chunk: bytes, seq: Optional[int] = None, utter_id: Optional[int] = None, sent_at: Optional[float] = None
+    ):
+        """
+        大きな音声チャンクを受け取り、20msのフレームに分割してリングへ書き込む。
+        最後の短いフレームは無音で埋める（パディング）。
 
-    # ★★★ 修正済みの push_chunk (クラスの内側) ★★★
-    async def push_chunk(self, chunk: bytes):
+        seq / utter_id / sent_at は音声ヘッダ（framing.AudioHeader）の値。seq を渡すと
+        番号順に並べ替え、抜け・古いデータを検出する。
         """
-        大きな音声チャンクを受け取り、20msのフレームに分割して
-        キュー（self.queue）に追加する。
+        if seq is None:
+            await self._push(chunk, sent_at)
+            return
+        for data, ts in self._order(chunk, seq, utter_id, sent_at):
+            await self._push(data, ts)
+
+    def end_utterance(self, utter_id: Optional[int] = None):
+        """返答の終わり（tts_done）を伝える。残りを再生し終えたら補間せずに止まる。
+
+        utter_id が今の発話（音声ヘッダの発話ID）と違えば、終わった発話の遅い通知なので無視する。
         """
-        for i in range(0, len(chunk), FRAME_BYTES):
-            frame = chunk[i : i + FRAME_BYTES]
-
-            if len(frame) == 0:
-                continue # 空のフレームは無視
-            
-            # フレームが FRAME_BYTES (640) より短い場合、
-            # 足りない分を無音 (b'\x00') で埋める (パディング)
-            if len(frame) < FRAME_BYTES:
-                padding_needed = FRAME_BYTES - len(frame)
-                frame += b"\x00" * padding_needed
-            
-            async with self._lock:
-                self.queue.append(frame)
-                
-                # ★ オーバーフロー処理は削除済み ★
-                # (サーバーが再生完了を待つため、クライアント側で
-                #  フレームを捨てる必要がなくなった)
-
-
-    # ★★★ pop_frame (クラスの内側・変更なし) ★★★
-    async def pop_frame(self) -> Optional[bytes]:
-        async with self._lock:
-            if not self.queue:
-                return None
+        if utter_id is not None and self._utter is not None and utter_id != self._utter:
+            return
+        self._ended = True
+
+    def _order(self, chunk, seq: int, utter_id: Optional[int], sent_at: Optional[float]) -> List[Tuple[object, Optional[float]]]:
+        """連番を見て、今リングへ書いてよいチャンクを順に返す。"""
+        self.received_chunks += 1
+        if utter_id != self._utter:
+            if utter_id in self._past_utters:
+                self.stale_chunks += 1  # 終わった発話の遅着
+                return []
+            if self._utter is not None:
+                self._past_utters.append(self._utter)
+                self.lost_chunks += len(self._pending)  # 前の発話で抜けを待っていた分は届かなかった
+            self._utter = utter_id
+            self._next_seq = seq
+            self._pending.clear()
+        if seq < self._next_seq or seq in self._pending:
+            self.stale_chunks += 1  # 再生済み・損失扱い済み・重複
+            return []
+        if seq > self._next_seq:
+            self._pending[seq] = (bytes(chunk), sent_at)
+            if len(self._pending) <= self.reorder_window and len(self) > 0:
+                return []  # 抜けた番号が遅れて届くのを待つ
+            # 待ちきれない（保留が多い・バッファが空）→ 抜けを損失として先へ進む
+            first = min(self._pending)
+            self.lost_chunks += first - self._next_seq
+            self._next_seq = first
+            out: List[Tuple[object, Optional[float]]] = []
+        else:
+            if self._pending:
+                self.reordered_chunks += 1  # 抜けが後から届いた
+            out = [(chunk, sent_at)]
+            self._next_seq += 1
+        while self._next_seq in self._pending:
+            out.append(self._pending.pop(self._next_seq))
+            self._next_seq += 1
+        return out
+
+    async def _push(self, chunk, sent_at: Optional[float] = None):
+        mv = memoryview(chunk)
+        fb = self.frame_bytes
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._last_push = time.monotonic()
+        if mv:
+            self._ended = False
+        if self.estimator is not None and mv:
+            self.estimator.on_chunk(self._last_push, len(mv) / fb * FRAME_MS / 1000.0, sent_at)
+            self.prebuffer_frames = self.estimator.target_ms // FRAME_MS
+        for i in range(0, len(mv), fb):
+            frame = mv[i : i + fb]
+            while len(self) >= self.max_frames:
+                if self.overflow == "drop_oldest" and not self._held:
+                    self._ring.advance()
+                    self.dropped_frames += 1
+                elif self.overflow == "block":
+                    self._space_waiting = True
+                    self._space.clear()
+                    # 読み出し側が別スレッドの場合、フラグを立ててから再確認（起こし損ね防止）
+                    if len(self) >= self.max_frames:
+                        await self._space.wait()
+                    self._space_waiting = False
+                else:
+                    # drop_newest（または保持中で古いフレームを捨てられない場合）
+                    frame = None
+                    self.dropped_frames += 1
+                    break
+            if frame is not None:
+                self._ring.write(frame)
+                self._data.set()
+
+    def release(self):
+        """pop_frame で受け取ったフレームの書き込みが終わったら呼ぶ（スロットを解放）。"""
+        if self._held:
+            self._ring.advance()
+            self._held = False
+            self._notify_space()
+
+    def _notify_space(self):
+        if not self.threaded:
+            self._space.set()
+        elif self._space_waiting and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._space.set)
+
+    def pop_frame_nowait(self) -> Optional[memoryview]:
+        self.release()
+        depth = len(self._ring)
+        if depth == 0:
+            if self._started and self.concealer is not None:
+                if self._ended:
+                    self.concealer.end()  # 返答の終わり: 補間しない
+                else:
+                    # 返答の途中で空になった → しばらくは補間フレームでつなぐ
+                    frame = self.concealer.next()
+                    if frame is not None:
+                        return frame
+            # 再生が追いついた（空）→ 次はプリバッファからやり直し
+            self._started = False
+            return None
+        if not self._started:
             # プリバッファが溜まるまで待つ
-            if len(self.queue) < self.prebuffer_frames:
+            if depth < self.prebuffer_frames:
                 return None
-            return self.queue.popleft()
+            self._started = True
+        elif self.estimator is not None:
+            self._catch_up()
+        self._held = True
+        frame = self._ring.peek()
+        if self.concealer is not None:
+            self.concealer.on_frame(frame)
+        return frame
+
+    def _catch_up(self):
+        """目標より深く溜まっていれば、先頭の無音フレームを捨てて遅延を縮める。"""
+        target = self.prebuffer_frames
+        high = target + max(1, target // 2)
+        while len(self._ring) > high:
+            frame = self._ring.peek()
+            if analyze_frame(frame).rms >= self.SILENCE_RMS:
+                break
+            self._ring.advance()
+            self.catchup_dropped += 1
+        self._notify_space()
+
+    def read_into(self, out) -> bool:
+        """（threaded 用）次のフレームを out へコピーする。出せるフレームが無ければ False。
+
+        PortAudio のコールバックから呼ぶ。プリバッファ量に届かないまま
+        prebuffer 時間以上 push が無ければ、溜まっている分で再生を始める。
+        """
+        frame = self.pop_frame_nowait()
+        if frame is None:
+            if len(self._ring) and time.monotonic() - self._last_push >= self.prebuffer_frames * FRAME_MS / 1000.0:
+                self._started = True
+                frame = self.pop_frame_nowait()
+            if frame is None:
+                return False
+        out[: len(frame)] = frame
+        self.release()
+        return True
+
+    async def pop_frame(self) -> Optional[memoryview]:
+        return self.pop_frame_nowait()
+
+    async def wait_data(self, timeout: Optional[float] = None) -> bool:
+        """次に push されるまで待つ。timeout 秒以内に届けば True。"""
+        self._data.clear()
+        try:
+            await asyncio.wait_for(self._data.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def flush_prebuffer(self):
+        """プリバッファ量に届いていなくても、溜まっている分で再生を始める。"""
+        if len(self._ring) > 0:
+            self._started = True
+
+    def stats(self) -> dict:
+        st = {
+            "depth_frames": len(self),
+            "capacity_frames": self.max_frames,
+            "dropped_frames": self.dropped_frames,
+            "overflow": self.overflow,
+        }
+        if self.estimator is not None:
+            est = self.estimator
+            st.update(
+                {
+                    "target_ms": est.target_ms,
+                    "jitter_ms": round(est.jitter_ms, 1),
+                    "late_peak_ms": round(est.late_peak_ms, 1),
+                    "target_increases": est.increases,
+                    "target_decreases": est.decreases,
+                    "catchup_dropped": self.catchup_dropped,
+                }
+            )
+        if self.concealer is not None:
+            st["concealed_frames"] = self.concealer.concealed_frames
+            st["concealments"] = self.concealer.concealments
+        if self.received_chunks:
+            st.update(
+                {
+                    "received_chunks": self.received_chunks,
+                    "lost_chunks": self.lost_chunks,
+                    "stale_chunks": self.stale_chunks,
+                    "reordered_chunks": self.reordered_chunks,
+                    "loss_pct": round(100.0 * self.lost_chunks / (self.received_chunks + self.lost_chunks), 2),
+                }
+            )
+        return st
+
+
+class PlaybackStats:
+    """再生スケジューラの統計（標準出力へは出さず、ここに数える）。
 
+    - frames: デバイスへ渡したフレーム数
+    - late_frames: 締め切り（deadline）より 1 フレーム以上遅れて渡したフレーム数
+    - worst_late_ms: 最大の遅れ
+    - underruns: 再生中にバッファが空になり、その後すぐデータが来た回数（=音切れ）
+    - underrun_ms: 音切れの合計時間
+    - resyncs: 大きく遅れたため締め切りを現在時刻に取り直した回数（イベントループの停止など）
+    """
+
+    __slots__ = ("frames", "late_frames", "worst_late_ms", "underruns", "underrun_ms", "resyncs")
+    # as_dict() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"frames", "late_frames", "underruns", "underrun_ms", "resyncs"})
+
+    def __init__(self):
+        self.frames = 0
+        self.late_frames = 0
+        self.worst_late_ms = 0.0
+        self.underruns = 0
+        self.underrun_ms = 0.0
+        self.resyncs = 0
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def stream_clock(stream, fallback: Optional[Callable[[], float]] = None) -> Callable[[], float]:
+    """sounddevice のストリーム時刻（サウンドカードの時計）を返す関数を作る。
+
+    stream.time が取れない（0 や例外）環境では fallback（既定は time.monotonic）を使う。
+    """
+    fallback = fallback or time.monotonic
 
-# ★★★ playback_loop (クラスの外側・変更なし) ★★★
-# jitter.py の playback_loop 関数を以下に置き換えてください
+    def now() -> float:
+        try:
+            t = stream.time
+        except Exception:
+            return fallback()
+        return t if t else fallback()
 
-async def playback_loop(jb: JitterBuffer, write_frame: Callable[[bytes], asyncio.Future]):
+    return now
+
+
+async def playback_loop(
+    jb: JitterBuffer,
+    write_frame: Callable[[bytes], asyncio.Future],
+    clock: Optional[Callable[[], float]] = None,
+    stats: Optional[PlaybackStats] = None,
+    max_burst: int = 2,
+    underrun_gap_s: float = 0.5,
+    on_frame: Optional[Callable[[], None]] = None,
+):
     """
     20msごとにフレームを取り出し、出力関数に渡す。
-    （★ 再生間隔を正確に保つように修正済み）
+
+    毎回「前回からの経過」ではなく、再生開始時刻 + n×20ms という絶対的な締め切りで
+    スケジュールするため、誤差が積み重ならない（ドリフトしない）。
+    - clock: 時刻の取得関数（秒）。stream_clock(stream) を渡すとサウンドカードの時計に合わせる。
+      既定はイベントループの時計。
+    - max_burst: 遅れを取り戻すとき連続で書き込む最大フレーム数。これ以上遅れていたら
+      締め切りを現在時刻に取り直す（まとめ書きで音が詰まらないように）。
+    - バッファが空のときは固定時間眠らず、次のデータが来るまで待つ。
+    - on_frame: フレームを書き込むたびに呼ぶ（trace.TurnTracer.on_frame_out など）。
+    - 大きく遅れて刻み直したときだけ WARNING のログを出す（別スレッドで書き出し、回数制限あり）。
     """
-    
-    # audio_io から FRAME_MS をインポート
-    # (jitter.py の先頭に `from .audio_io import FRAME_MS` があるか確認してください)
-    from .audio_io import FRAME_MS
-    
-    while True:
-        # ループの開始時間を記録
-        loop_start_time = asyncio.get_event_loop().time()
+    period = FRAME_MS / 1000.0
+    clock = clock or asyncio.get_running_loop().time
+    stats = stats if stats is not None else PlaybackStats()
+    deadline: Optional[float] = None  # 次のフレームを渡す時刻（None=停止中）
+    dry_since: Optional[float] = None  # 再生中にバッファが空になった時刻
 
-        frame = await jb.pop_frame()
+    while True:
+        frame = jb.pop_frame_nowait()
         if frame is None:
-            # プリバッファ中か、再生が追いついた
-            await asyncio.sleep(FRAME_MS / 1000.0)
+            if deadline is not None:
+                # 再生中に空になった（返答の終わりか、音切れか）
+                dry_since = clock()
+                deadline = None
+            # プリバッファ中 / 空: データが届くまで待つ。短い返答でプリバッファに届かないまま
+            # 止まらないよう、しばらく何も来なければ溜まっている分だけで再生を始める。
+            timeout = (jb.prebuffer_frames * period or period) if len(jb) else None
+            if not await jb.wait_data(timeout=timeout):
+                jb.flush_prebuffer()
             continue
-        
-        # 音声フレームを書き込む
+
+        now = clock()
+        if deadline is None:
+            if dry_since is not None and now - dry_since < underrun_gap_s:
+                stats.underruns += 1
+                stats.underrun_ms += (now - dry_since) * 1000.0
+            dry_since = None
+            deadline = now
+        else:
+            late = now - deadline
+            if late >= period:
+                stats.late_frames += 1
+                stats.worst_late_ms = max(stats.worst_late_ms, late * 1000.0)
+                if late > max_burst * period:
+                    # イベントループが止まっていた等: 借りを捨てて今から刻み直す
+                    stats.resyncs += 1
+                    deadline = now
+                    _log.warning("⚠️ [playback_loop] 再生が %.0fms 遅延したため刻み直します", late * 1000.0)
+
+        # 音声フレームを書き込む（書き終わったらリングのスロットを解放）
         await write_frame(frame)
-        
-        # 処理にかかった時間（フレーム取得＋書き込み）を計算
-        time_taken = asyncio.get_event_loop().time() - loop_start_time
-        
-        # 20ms から 処理にかかった時間を引いた分だけスリープする
-        sleep_duration = (FRAME_MS / 1000.0) - time_taken
-        
-        if sleep_duration < 0:
-            # 処理が20msを超えた場合 (PCがビジー)
-            sleep_duration = 0 
-            print("⚠️ [playback_loop] 再生が遅延しています！")
-        
-        await asyncio.sleep(sleep_duration)
\ No newline at end of file
+        jb.release()
+        stats.frames += 1
+        if on_frame is not None:
+            on_frame()
+
+        deadline += period
+        delay = deadline - clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,183 @@
+"""イベントループを止めないログ（レベルでの絞り込み・メッセージごとの回数制限・別スレッドでの書き出し）。
+
+print はイベントループの上で端末への書き込みが終わるまで待つ。SSH 越しや遅い端末では
+1回の print が数十 ms かかることがあり、音声の遅れを知らせる print がさらに遅れを生む。
+Logger は次のようにしてログの負担を音声の経路から外す。
+
+- レベル（DEBUG / INFO / WARNING / ERROR）: LOG_LEVEL（既定 INFO）より低いものは、文字列を
+  組み立てる前に比較1回で捨てる。引数は "%" 書式で渡し、書き出すときだけ整形する。
+  引数の計算自体が重いときは `if log.debug_enabled:` で囲む。
+- 回数制限: 同じ書式（呼び出し場所）ごとに1秒あたり LOG_RATE_PER_S 件（既定 5）まで。
+  超えた分は数えておき、次に出すときに「（+N 件省略）」と付ける。
+- 書き出し: キュー（LOG_QUEUE、既定 1000 件）に積むだけで、端末への書き込みは別スレッドが行う。
+  キューがあふれたら捨てて数える（dropped）。
+- LOG_FORMAT=json で1行1 JSON（t / level / logger / msg と、キーワード引数で渡した項目）。
+"""
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "WARN": WARNING, "ERROR": ERROR}
+_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+class _Writer:
+    """キューからログを取り出して書き出すスレッド（最初のログを積んだときに起動する）。"""
+
+    def __init__(self, capacity: int = 1000, stream=None):
+        self._queue: queue.Queue = queue.Queue(maxsize=capacity)
+        self._stream = stream
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def set_capacity(self, capacity: int):
+        self._queue.maxsize = capacity
+
+    def put(self, line: str):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            stream = self._stream or sys.stdout
+            try:
+                stream.write(line + "\n")
+                # 溜まっている分はまとめて書いてから flush する
+                while not self._queue.empty():
+                    stream.write(self._queue.get_nowait() + "\n")
+                    self._queue.task_done()
+                stream.flush()
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: float = 1.0):
+        """積んである分を書き終えるまで待つ（終了時用。timeout 秒で諦める）。"""
+        deadline = time.monotonic() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+_writer = _Writer(capacity=int(os.getenv("LOG_QUEUE", "1000")))
+
+
+class Logger:
+    def __init__(self, name: str, level: int = INFO, rate_per_s: float = 5.0, json_format: bool = False):
+        self.name = name
+        self.json_format = json_format
+        self.rate_per_s = rate_per_s
+        self.suppressed = 0  # 回数制限で省いた合計
+        # 書式 → [この1秒の始まり, この1秒に出した件数, 省いた件数]
+        self._windows: Dict[str, list] = {}
+        self.set_level(level)
+
+    def set_level(self, level: int):
+        self.level = level
+        self.debug_enabled = level <= DEBUG
+
+    def debug(self, msg: str, *args, **fields):
+        if self.level <= DEBUG:
+            self._log(DEBUG, msg, args, fields)
+
+    def info(self, msg: str, *args, **fields):
+        if self.level <= INFO:
+            self._log(INFO, msg, args, fields)
+
+    def warning(self, msg: str, *args, **fields):
+        if self.level <= WARNING:
+            self._log(WARNING, msg, args, fields)
+
+    def error(self, msg: str, *args, **fields):
+        if self.level <= ERROR:
+            self._log(ERROR, msg, args, fields)
+
+    def _log(self, level: int, msg: str, args: tuple, fields: dict):
+        skipped = 0
+        if self.rate_per_s > 0:
+            now = time.monotonic()
+            window = self._windows.get(msg)
+            if window is None or now - window[0] >= 1.0:
+                skipped = window[2] if window is not None else 0
+                window = self._windows[msg] = [now, 0, 0]
+            if window[1] >= self.rate_per_s:
+                window[2] += 1
+                self.suppressed += 1
+                return
+            window[1] += 1
+        text = msg % args if args else msg
+        if skipped:
+            text += f"（+{skipped} 件省略）"
+        if self.json_format:
+            line = json.dumps(
+                {"t": round(time.time(), 3), "level": _LEVEL_NAMES[level], "logger": self.name, "msg": text, **fields},
+                ensure_ascii=False,
+                default=str,
+            )
+        else:
+            line = text + "".join(f" {k}={v}" for k, v in fields.items())
+        _writer.put(line)
+
+
+_loggers: Dict[str, Logger] = {}
+
+
+def _settings() -> dict:
+    return {
+        "level": LEVELS.get(os.getenv("LOG_LEVEL", "INFO").upper(), INFO),
+        "rate_per_s": float(os.getenv("LOG_RATE_PER_S", "5")),
+        "json_format": os.getenv("LOG_FORMAT", "text") == "json",
+    }
+
+
+def get_logger(name: str) -> Logger:
+    """名前ごとに1つの Logger を返す（LOG_LEVEL / LOG_RATE_PER_S / LOG_FORMAT を読む）。"""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = Logger(name, **_settings())
+    return logger
+
+
+def configure():
+    """環境変数を読み直し、作成済みの Logger にも反映する（.env を読み込んだ後に呼ぶ）。"""
+    settings = _settings()
+    for logger in _loggers.values():
+        logger.set_level(settings["level"])
+        logger.rate_per_s = settings["rate_per_s"]
+        logger.json_format = settings["json_format"]
+    _writer.set_capacity(int(os.getenv("LOG_QUEUE", "1000")))
+
+
+# stats() はどちらも増えるだけの値
+STATS_COUNTERS = frozenset({"dropped", "suppressed"})
+
+
+def stats() -> dict:
+    return {
+        "dropped": _writer.dropped,
+        "suppressed": sum(logger.suppressed for logger in _loggers.values()),
+    }
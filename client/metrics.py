@@ -0,0 +1,219 @@
+"""クライアントの計測値の集約と書き出し（Prometheus のテキスト形式）。
+
+各部品はすでに統計を持っている（SendQueue.stats()、JitterBuffer.stats()、PlaybackStats、
+RecoveryStats、Heartbeat.stats() など）。Registry はそれらを書き出すときにだけ読みに行く
+（add_stats）ので、音声の経路には手を入れない。統計を持たない所（受信バイト数など）は
+Counter / Gauge を使う（値を足すだけ）。
+
+書き出し先（start_exporters() がタスクとして動かす。ポートが使用中などで止まってもログに残すだけで、
+音声の処理には影響しない）:
+- METRICS_PORT（例: 9101）: http://METRICS_HOST:METRICS_PORT/metrics で返す（既定 127.0.0.1 だけで待つ）。
+- METRICS_FILE（例: /run/kokushimen/client.prom）: METRICS_INTERVAL_S（既定 10）秒ごとに書き出す。
+  一時ファイルに書いてから置き換えるので、node_exporter の textfile collector からそのまま読める。
+どちらかを設定すると、イベントループの遅れも計測する（watchdog.LoopWatchdog）。
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Tuple
+
+from .log import get_logger
+
+_log = get_logger("metrics")
+
+PREFIX = "kokushimen"
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """増えるだけの値（バイト数・メッセージ数など）。"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Gauge:
+    """上下する値（深さ・遅れなど）。"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+def _name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(p for p in parts if p))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _flatten(stats: dict, prefix: str = ""):
+    """{"a": 1, "b": {"c": 2}} → ("a", 1), ("b_c", 2)。数値でない値（文字列・None）は飛ばす。"""
+    for key, value in stats.items():
+        name = f"{prefix}_{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+class Registry:
+    def __init__(self):
+        self._counters: Dict[Tuple[str, _Labels], Counter] = {}
+        self._gauges: Dict[Tuple[str, _Labels], Gauge] = {}
+        self._help: Dict[str, str] = {}
+        # (接頭辞, ラベル) → (統計を返す関数, counter として書き出すキー)。同じ組で登録し直すと置き換える（再接続・作り直し）
+        self._stats: Dict[Tuple[str, _Labels], Tuple[Callable[[], dict], FrozenSet[str]]] = {}
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        key = (_name(PREFIX, name), tuple(sorted((k, str(v)) for k, v in labels.items())))
+        if help:
+            self._help.setdefault(key[0], help)
+        return self._counters.setdefault(key, Counter())
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        key = (_name(PREFIX, name), tuple(sorted((k, str(v)) for k, v in labels.items())))
+        if help:
+            self._help.setdefault(key[0], help)
+        return self._gauges.setdefault(key, Gauge())
+
+    def add_stats(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = (), **labels):
+        """stats()（dict を返す関数）の数値を、書き出すときに prefix_キー名 の gauge として読む。
+
+        counters に挙げたキー（増えるだけの値。各部品の COUNTERS）は prefix_キー名_total の counter にする
+        （rate() / increase() が作り直しでの 0 戻りを正しく扱える）。入れ子の dict は _ でつないだキー名で指定する。
+        """
+        key = (prefix, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self._stats[key] = (stats, frozenset(counters))
+
+    def samples(self) -> List[Tuple[str, str, _Labels, float]]:
+        """(名前, 種類, ラベル, 値) の一覧。"""
+        out = [(name, "counter", labels, c.value) for (name, labels), c in self._counters.items()]
+        out += [(name, "gauge", labels, g.value) for (name, labels), g in self._gauges.items()]
+        for (prefix, labels), (stats, counters) in list(self._stats.items()):
+            try:
+                values = stats()
+            except Exception:
+                continue  # 閉じたデバイスなど。次の書き出しでまた読む
+            for key, value in _flatten(values):
+                if key in counters:
+                    out.append((_name(PREFIX, prefix, key, "total"), "counter", labels, value))
+                else:
+                    out.append((_name(PREFIX, prefix, key), "gauge", labels, value))
+        return out
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式（version 0.0.4）。"""
+        by_name: Dict[str, list] = {}
+        for name, kind, labels, value in self.samples():
+            by_name.setdefault(name, [kind]).append((labels, value))
+        lines = []
+        for name in sorted(by_name):
+            kind, *rows = by_name[name]
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in rows:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# プロセスで1つ（送信・再生タスク、出力、入力デバイスが登録する）
+REGISTRY = Registry()
+
+
+async def serve_http(registry: Registry = REGISTRY, port: int = 9101, host: str = "127.0.0.1"):
+    """GET /metrics に Prometheus のテキスト形式で答える小さな HTTP サーバ（追加の依存なし）。"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass  # ヘッダは読み捨てる
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                body = registry.render().encode()
+                head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            else:
+                body = b"not found\n"
+                head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def write_snapshots(path: str, registry: Registry = REGISTRY, interval_s: float = 10.0):
+    """interval_s ごとに path へ書き出す（一時ファイルに書いてから置き換える。SD カードへの書き込みは1回/周期）。"""
+    tmp = f"{path}.tmp"
+    loop = asyncio.get_running_loop()
+    while True:
+        text = registry.render() + f"# snapshot_unix_time {time.time():.0f}\n"
+
+        def write():
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+
+        try:
+            await loop.run_in_executor(None, write)
+        except OSError as e:
+            _log.warning("[metrics] %s に書き出せませんでした（%s）", path, e)
+        await asyncio.sleep(interval_s)
+
+
+def exporters(registry: Registry = REGISTRY) -> list:
+    """環境変数（METRICS_PORT / METRICS_HOST / METRICS_FILE / METRICS_INTERVAL_S）から書き出しのコルーチンを作る。"""
+    coros = []
+    port = os.getenv("METRICS_PORT")
+    if port:
+        coros.append(serve_http(registry, int(port), os.getenv("METRICS_HOST", "127.0.0.1")))
+    path = os.getenv("METRICS_FILE")
+    if path:
+        coros.append(write_snapshots(path, registry, float(os.getenv("METRICS_INTERVAL_S", "10"))))
+    return coros
+
+
+async def _logged(coro, what: str):
+    try:
+        await coro
+    except Exception as e:
+        _log.error("[metrics] %s を止めました（%s）。音声の処理は続けます。", what, e)
+
+
+def start_exporters(registry: Registry = REGISTRY) -> List[asyncio.Task]:
+    """exporters() をタスクとして動かす（イベントループの中から呼ぶ。終了時に cancel する）。
+
+    書き出しの失敗（METRICS_PORT が使用中など）はログに出してそのタスクだけ終わる。
+    """
+    return [
+        asyncio.create_task(_logged(coro, coro.__name__), name=f"metrics-{coro.__name__}")
+        for coro in exporters(registry)
+    ]
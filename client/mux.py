@@ -0,0 +1,157 @@
+"""1本の WebSocket に端末の全ストリームを束ねる（多重化）。
+
+従来は端末ごとに self 送信 / other 送信 / self 再生の3本を別々に接続していた。
+多重化では1本の接続の上で、各メッセージの先頭に2バイトのヘッダを付けて区別する。
+
+  1バイト目: チャンネル番号（CHANNEL_IDS: ストリーム名と役割の組）
+  2バイト目: 種類（KIND_AUDIO=音声バイナリ / KIND_CONTROL=JSON テキストを UTF-8 で）
+  以降: 本体
+
+WebSocket 上はすべてバイナリメッセージになる。各チャンネルは websockets の接続と同じ
+send()/recv() を持つ MuxChannel として見えるので、sender_task / playback_task は
+connect 引数を差し替えるだけで使える（hello・stop などの JSON もそのまま通る）。
+"""
+
+import asyncio
+import contextlib
+from typing import Dict, Optional, Tuple
+
+KIND_AUDIO = 0
+KIND_CONTROL = 1
+
+CHANNEL_IDS: Dict[Tuple[str, str], int] = {
+    ("self", "sender"): 0,
+    ("other", "sender"): 1,
+    ("self", "playback"): 2,
+    ("other", "playback"): 3,
+}
+CHANNEL_NAMES: Dict[int, Tuple[str, str]] = {v: k for k, v in CHANNEL_IDS.items()}
+
+_CLOSED = object()
+
+
+def channel_id(stream_id: str, role: str) -> int:
+    try:
+        return CHANNEL_IDS[(stream_id, role)]
+    except KeyError:
+        raise ValueError(f"多重化できないストリームです: {stream_id}/{role}") from None
+
+
+def pack(channel: int, data) -> bytes:
+    """str は KIND_CONTROL、bytes は KIND_AUDIO としてヘッダを付ける。"""
+    if isinstance(data, str):
+        return bytes((channel, KIND_CONTROL)) + data.encode("utf-8")
+    return bytes((channel, KIND_AUDIO)) + bytes(data)
+
+
+def unpack(message) -> Optional[Tuple[int, object]]:
+    """(チャンネル番号, 本体) を返す。本体は KIND_CONTROL なら str、KIND_AUDIO なら bytes。
+
+    ヘッダが壊れている・テキストメッセージなどは None。
+    """
+    if not isinstance(message, (bytes, bytearray)) or len(message) < 2:
+        return None
+    channel, kind = message[0], message[1]
+    body = bytes(message[2:])
+    if kind == KIND_CONTROL:
+        try:
+            return channel, body.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    if kind == KIND_AUDIO:
+        return channel, body
+    return None
+
+
+class MuxChannel:
+    """多重化接続上の1チャンネル（websockets の接続と同じ send/recv を持つ）。"""
+
+    def __init__(self, ws, channel: int, queue: asyncio.Queue):
+        self._ws = ws
+        self.channel = channel
+        self._queue = queue
+
+    async def send(self, data):
+        await self._ws.send(pack(self.channel, data))
+
+    async def recv(self):
+        item = await self._queue.get()
+        if item is _CLOSED:
+            raise ConnectionError("多重化接続が切れました")
+        return item
+
+
+class MuxClient:
+    """端末で共有する多重化接続。
+
+    最初の channel() で接続し、最後のチャンネルが閉じたら切断する。接続が切れると
+    全チャンネルの recv()/send() が例外になるので、各タスクの再接続ループ（backoff）が
+    channel() を呼び直し、そこで新しい接続が張られる。
+    """
+
+    def __init__(self, uri: str, token: str, ping_interval: float = 30):
+        self.uri = uri
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.ping_interval = ping_interval
+        self.connects = 0
+        self._ws = None
+        self._reader: Optional[asyncio.Task] = None
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._users = 0
+        self._lock = asyncio.Lock()
+
+    async def _ensure(self):
+        async with self._lock:
+            if self._ws is not None and self._reader is not None and not self._reader.done():
+                return self._ws
+            import websockets
+
+            self._ws = await websockets.connect(
+                self.uri, additional_headers=self.headers, ping_interval=self.ping_interval, max_size=None
+            )
+            self.connects += 1
+            self._reader = asyncio.create_task(self._read_loop(self._ws))
+            return self._ws
+
+    async def _read_loop(self, ws):
+        try:
+            async for message in ws:
+                item = unpack(message)
+                if item is None:
+                    continue
+                queue = self._queues.get(item[0])
+                if queue is not None:
+                    queue.put_nowait(item[1])
+        except Exception:
+            pass
+        finally:
+            for queue in self._queues.values():
+                queue.put_nowait(_CLOSED)
+
+    @contextlib.asynccontextmanager
+    async def channel(self, stream_id: str, role: str):
+        """`async with mux.channel("self", "sender") as ws:` の形で、接続の代わりに使う。"""
+        cid = channel_id(stream_id, role)
+        ws = await self._ensure()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._queues[cid] = queue
+        self._users += 1
+        try:
+            yield MuxChannel(ws, cid, queue)
+        finally:
+            if self._queues.get(cid) is queue:
+                del self._queues[cid]
+            self._users -= 1
+            if self._users == 0:
+                await self.close()
+
+    async def close(self):
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            with contextlib.suppress(Exception):
+                await ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._reader
+            self._reader = None
@@ -0,0 +1,155 @@
+"""上り（マイク→サーバ）音声のパケット化（複数フレームを1メッセージにまとめる）。
+
+20ms ごとに1メッセージ送ると、マイク1本あたり毎秒50メッセージになり、そのたびに
+WebSocket のフレーム化・マスク処理・システムコールの負担がかかる。
+Packetizer は 20/40/60/100ms 単位でフレームをまとめて1メッセージにする。
+
+- packet_ms: 1メッセージの長さ（FRAME_MS の倍数に切り上げ）。
+- adaptive: True なら送信にかかる時間（ws.send の待ち時間）を見て、遅くなってきたら
+  まとめる量を段階的に増やし、速くなったら戻す（max_packet_ms まで）。
+- 発話終了（stop）の直前には flush() で溜まっている分をすぐ送る。
+
+SendStats にメッセージ数・バイト数・WebSocket のヘッダ分（推定）・送信時間を数える。
+WebSocket 1メッセージ ≒ 1回の send システムコールなので、messages がそのまま目安になる。
+"""
+
+from typing import Optional
+
+from .audio_io import FRAME_MS
+
+
+PACKET_STEPS_MS = (20, 40, 60, 100)
+
+
+def ws_frame_overhead(payload_len: int) -> int:
+    """クライアント→サーバの WebSocket フレームのヘッダ長（マスクキー4バイト込み）。"""
+    if payload_len < 126:
+        return 2 + 4
+    if payload_len < 65536:
+        return 4 + 4
+    return 10 + 4
+
+
+class SendStats:
+    __slots__ = ("messages", "frames", "payload_bytes", "overhead_bytes", "send_s", "max_send_ms", "flushes")
+    # as_dict() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"messages", "frames", "payload_bytes", "overhead_bytes", "send_s", "flushes"})
+
+    def __init__(self):
+        self.messages = 0
+        self.frames = 0
+        self.payload_bytes = 0
+        self.overhead_bytes = 0
+        self.send_s = 0.0
+        self.max_send_ms = 0.0
+        self.flushes = 0  # stop 前などで途中のまま送った回数
+
+    def record(self, payload_len: int, frames: int, elapsed_s: float):
+        self.messages += 1
+        self.frames += frames
+        self.payload_bytes += payload_len
+        self.overhead_bytes += ws_frame_overhead(payload_len)
+        self.send_s += elapsed_s
+        self.max_send_ms = max(self.max_send_ms, elapsed_s * 1000.0)
+
+    def as_dict(self) -> dict:
+        d = {k: getattr(self, k) for k in self.__slots__}
+        d["send_s"] = round(self.send_s, 4)
+        d["avg_send_ms"] = round(self.send_s / self.messages * 1000.0, 3) if self.messages else 0.0
+        d["overhead_pct"] = round(100.0 * self.overhead_bytes / self.payload_bytes, 2) if self.payload_bytes else 0.0
+        return d
+
+
+class Packetizer:
+    def __init__(
+        self,
+        packet_ms: int = FRAME_MS,
+        adaptive: bool = False,
+        max_packet_ms: int = 100,
+        high_latency_ms: float = 15.0,
+        low_latency_ms: float = 3.0,
+    ):
+        self.min_frames = max(1, -(-packet_ms // FRAME_MS))
+        self.max_frames = max(self.min_frames, max_packet_ms // FRAME_MS)
+        self.adaptive = adaptive
+        self.high_latency_ms = high_latency_ms
+        self.low_latency_ms = low_latency_ms
+        self.target_frames = self.min_frames
+        self.stats = SendStats()
+        self._buf = bytearray()
+        self._frames = 0
+        self._taken_frames = 0  # 直前に返したパケットのフレーム数（レートによらず数えるため）
+        self._latency_ms = 0.0
+
+    @property
+    def packet_ms(self) -> int:
+        return self.target_frames * FRAME_MS
+
+    @property
+    def taken_frames(self) -> int:
+        """直前に add() / flush() が返したパケットのフレーム数。"""
+        return self._taken_frames
+
+    @property
+    def pending_frames(self) -> int:
+        """溜まっていてまだパケットになっていないフレーム数。"""
+        return self._frames
+
+    def add(self, frame) -> Optional[bytes]:
+        """フレームを追加。1パケット分たまったらそのパケットを返す（送るのは呼び出し側）。"""
+        if self.target_frames == 1 and not self._frames:
+            self._frames = 1
+            return self._take(frame)
+        self._buf += frame
+        self._frames += 1
+        if self._frames >= self.target_frames:
+            return self._take(self._buf)
+        return None
+
+    def flush(self) -> Optional[bytes]:
+        """途中まで溜まっている分を返す（無ければ None）。"""
+        if not self._frames:
+            return None
+        self.stats.flushes += 1
+        return self._take(self._buf)
+
+    def discard(self) -> int:
+        """途中まで溜まっている分を送らずに捨てる（送信の統計には数えない）。捨てたフレーム数を返す。"""
+        dropped = self._frames
+        self._buf.clear()
+        self._frames = 0
+        return dropped
+
+    def _take(self, data) -> bytes:
+        packet = bytes(data)
+        self._taken_frames = self._frames
+        self._buf.clear()
+        self._frames = 0
+        return packet
+
+    def on_sent(self, packet: bytes, elapsed_s: float, wire_bytes: Optional[int] = None, frames: Optional[int] = None):
+        """送信が終わったら呼ぶ（統計と、adaptive の場合のまとめ量の調整）。
+
+        wire_bytes: コーデックで圧縮した場合の実際の送信バイト数（省略時は packet の長さ）。
+        frames: packet のフレーム数（省略時は直前に返したパケットの分。送信キューを挟む場合は渡す）。
+        """
+        payload = len(packet) if wire_bytes is None else wire_bytes
+        self.stats.record(payload, max(1, frames or self._taken_frames), elapsed_s)
+        if not self.adaptive:
+            return
+        ms = elapsed_s * 1000.0
+        self._latency_ms += (ms - self._latency_ms) / 8.0
+        cur = self.target_frames * FRAME_MS
+        if self._latency_ms > self.high_latency_ms:
+            bigger = [s for s in PACKET_STEPS_MS if s > cur and s // FRAME_MS <= self.max_frames]
+            if bigger:
+                self.target_frames = bigger[0] // FRAME_MS
+                self._settle()
+        elif self._latency_ms < self.low_latency_ms and self.target_frames > self.min_frames:
+            smaller = [s for s in PACKET_STEPS_MS if s < cur and s // FRAME_MS >= self.min_frames]
+            self.target_frames = smaller[-1] // FRAME_MS if smaller else self.min_frames
+            self._settle()
+
+    def _settle(self):
+        # 切り替え直後は中間値から測り直す（すぐに戻らないように）
+        self._latency_ms = (self.high_latency_ms + self.low_latency_ms) / 2.0
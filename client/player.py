@@ -1,12 +1,14 @@
 import asyncio
+import time
 from typing import Optional, Callable
 
-from .audio_io import FRAME_BYTES, FRAME_MS, RATE, CHANNELS
-from .jitter import JitterBuffer, playback_loop
+from .audio_io import FRAME_MS, RATE, CHANNELS, frame_bytes_at
+from .jitter import JitterBuffer, PlaybackStats, playback_loop
+from .resample import RateAdapter
 
 
 class NullPlayer:
-    async def play(self, chunk: bytes):
+    async def play(self, chunk: bytes, header=None):
         # 200ms/チャンク想定。実時間と同じ速度で進めるために sleep（待ち時間）する。
         await asyncio.sleep(0.2)
 
@@ -20,9 +22,35 @@ class SoundDevicePlayer:
     出力デバイス指定:
     - 環境変数 `SD_OUTPUT_DEVICE` で指定可能（数値インデックス or 名称の部分一致）。
     - `SD_LIST_DEVICES=1` で入出力デバイス一覧を表示。
+
+    出力方式（mode）:
+    - "write": play() / stream.write で書き込む（同期 I/O をスレッドで実行）。JitteredOutput と組み合わせる。
+    - "callback": PortAudio のコールバック（音声スレッド）がジッターバッファ（self.jb）から
+      直接 20ms ずつ取り出す。データが無ければ無音で埋める。イベントループ側は play() で
+      バッファに積むだけなので、フレームごとのスレッド受け渡しが無くなる。
+      JitteredOutput は不要。統計は self.stats（PlaybackStats）と self.jb.stats()。
+
+    rate: 出力デバイスを開くサンプリングレート（既定 RATE。デバイス本来のレートにすると
+    PortAudio/ALSA 側の変換が不要になる）。play() に渡す音声のレートは set_input_rate() で伝え、
+    異なれば resample.Resampler で rate に変換する。
+
+    on_frame: callback 方式で、データのフレームをデバイスに渡すたびに音声スレッドから呼ぶ
+    （trace.TurnTracer.on_frame_out など。すぐ戻る関数にすること）。
     """
 
-    def __init__(self, device: Optional[int | str] = None):
+    def __init__(
+        self,
+        device: Optional[int | str] = None,
+        mode: str = "write",
+        prebuffer_ms: int = 200,
+        max_buffer_ms: int = 600,
+        overflow: str = "block",
+        adaptive: bool = False,
+        rate: int = RATE,
+        conceal: str = "off",
+        conceal_ms: int = 80,
+        on_frame: Optional[Callable[[], None]] = None,
+    ):
         import os
         import sounddevice as sd  # type: ignore
 
@@ -80,15 +108,79 @@ class SoundDevicePlayer:
                 "SD_OUTPUT_DEVICE の指定に一致する出力デバイスが見つかりません（既定デバイスへはフォールバックしません）。"
             )
 
+        if mode not in ("write", "callback"):
+            raise ValueError(f"mode は 'write' か 'callback' を指定してください: {mode!r}")
+        self.mode = mode
+        self.rate = rate
+        self.frame_bytes = frame_bytes_at(rate)
+        self._rate = RateAdapter(RATE, rate)
+        self.jb: Optional[JitterBuffer] = None
+        self.stats = PlaybackStats()
+        self.on_frame = on_frame
+        if mode == "callback":
+            self.jb = JitterBuffer(
+                prebuffer_ms=prebuffer_ms,
+                max_buffer_ms=max_buffer_ms,
+                overflow=overflow,
+                adaptive=adaptive,
+                threaded=True,
+                frame_bytes=self.frame_bytes,
+                conceal=conceal,
+                conceal_ms=conceal_ms,
+            )
         self._stream = None
 
+    def _make_callback(self):
+        jb = self.jb
+        stats = self.stats
+        fb = self.frame_bytes
+        on_frame = self.on_frame
+        zeros = bytes(fb)
+        scratch = memoryview(bytearray(fb))  # ブロック長が20msと異なる場合の繰り越し用
+        state = {"pos": fb, "playing": False, "dry_since": None}
+
+        def next_frame(out) -> None:
+            if jb.read_into(out):
+                stats.frames += 1
+                if on_frame is not None:
+                    on_frame()
+                if not state["playing"]:
+                    dry = state["dry_since"]
+                    if dry is not None and time.monotonic() - dry < 0.5:
+                        stats.underruns += 1
+                        stats.underrun_ms += (time.monotonic() - dry) * 1000.0
+                    state["playing"] = True
+            else:
+                out[:fb] = zeros
+                if state["playing"]:
+                    state["playing"] = False
+                    state["dry_since"] = time.monotonic()
+
+        def callback(outdata, frames, time_info, status):  # PortAudio の音声スレッドで呼ばれる
+            n = len(outdata)
+            if n == fb and state["pos"] >= fb:
+                next_frame(outdata)
+                return
+            filled = 0
+            while filled < n:
+                if state["pos"] >= fb:
+                    next_frame(scratch)
+                    state["pos"] = 0
+                k = min(n - filled, fb - state["pos"])
+                outdata[filled : filled + k] = scratch[state["pos"] : state["pos"] + k]
+                filled += k
+                state["pos"] += k
+
+        return callback
+
     async def __aenter__(self):
         self._stream = self.sd.RawOutputStream(
-            samplerate=RATE,
+            samplerate=self.rate,
             dtype="int16",
             channels=CHANNELS,
-            blocksize=int(RATE * (FRAME_MS / 1000.0)),
+            blocksize=int(self.rate * (FRAME_MS / 1000.0)),
             device=self.device,
+            callback=self._make_callback() if self.mode == "callback" else None,
         )
         self._stream.start()
         return self
@@ -99,7 +191,22 @@ class SoundDevicePlayer:
             self._stream.close()
             self._stream = None
 
-    async def play(self, chunk: bytes):
+    def set_input_rate(self, rate: int):
+        """play() に渡す音声のサンプリングレート（hello で決まった下りのレート）を設定する。"""
+        self._rate.set_input_rate(rate)
+
+    def end_utterance(self, utter_id=None):
+        """返答の終わり（tts_done）。callback 方式ではバッファが残りを再生し終えたら補間せずに止まる。"""
+        if self.jb is not None:
+            self.jb.end_utterance(utter_id)
+
+    async def play(self, chunk: bytes, header=None):
+        """header: 音声ヘッダ（framing.AudioHeader）。callback 方式ではバッファの並べ替え・損失検出に使う。"""
+        chunk = self._rate.process(chunk)
+        if self.jb is not None:
+            # callback 方式: バッファに積むだけ（取り出しは音声スレッド）
+            await _push(self.jb, chunk, header)
+            return
         # 受信は 200ms チャンク想定。stream.write は同期 I/O（終わるまで待つ処理）なのでスレッドで実行。
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(None, self._stream.write, chunk)
@@ -110,11 +217,40 @@ class JitteredOutput:
 
     整流: バラバラの到着タイミングを一定の間隔（20ms）に揃えること。
     ラッパ: ある機能を包んで扱いやすくする小さな部品。
+
+    in_rate（受信する音声のレート。set_input_rate() で後から変更可）と out_rate（writer に渡す
+    デバイスのレート）が異なる場合は、バッファに積む前に resample.Resampler で変換する。
+    on_frame: フレームを writer に渡すたびに呼ぶ（playback_loop の on_frame）。
     """
 
-    def __init__(self, writer: Callable[[bytes], None], prebuffer_ms: int = 200, max_buffer_ms: int = 600):
-        self.jb = JitterBuffer(prebuffer_ms=prebuffer_ms, max_buffer_ms=max_buffer_ms)
+    def __init__(
+        self,
+        writer: Callable[[bytes], None],
+        prebuffer_ms: int = 200,
+        max_buffer_ms: int = 600,
+        overflow: str = "block",
+        adaptive: bool = False,
+        clock: Optional[Callable[[], float]] = None,
+        in_rate: int = RATE,
+        out_rate: int = RATE,
+        conceal: str = "off",
+        conceal_ms: int = 80,
+        on_frame: Optional[Callable[[], None]] = None,
+    ):
+        self.jb = JitterBuffer(
+            prebuffer_ms=prebuffer_ms,
+            max_buffer_ms=max_buffer_ms,
+            overflow=overflow,
+            adaptive=adaptive,
+            frame_bytes=frame_bytes_at(out_rate),
+            conceal=conceal,
+            conceal_ms=conceal_ms,
+        )
+        self._rate = RateAdapter(in_rate, out_rate)
+        self.stats = PlaybackStats()
+        self._clock = clock
         self._writer_sync = writer
+        self._on_frame = on_frame
         self._task = None
 
     async def __aenter__(self):
@@ -123,7 +259,7 @@ class JitteredOutput:
             loop = asyncio.get_running_loop()
             await loop.run_in_executor(None, self._writer_sync, frame)
 
-        self._task = asyncio.create_task(playback_loop(self.jb, write_frame))
+        self._task = asyncio.create_task(playback_loop(self.jb, write_frame, clock=self._clock, stats=self.stats, on_frame=self._on_frame))
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -131,9 +267,24 @@ class JitteredOutput:
             self._task.cancel()
             try:
                 await self._task
-            except Exception:
+            except (asyncio.CancelledError, Exception):
                 pass
             self._task = None
 
-    async def on_chunk(self, chunk: bytes):
-        await self.jb.push_chunk(chunk)
+    def set_input_rate(self, rate: int):
+        self._rate.set_input_rate(rate)
+
+    def end_utterance(self, utter_id=None):
+        """返答の終わり（tts_done）を伝える（残りを再生し終えたら補間せずに止まる）。"""
+        self.jb.end_utterance(utter_id)
+
+    async def on_chunk(self, chunk: bytes, header=None):
+        """header: 音声ヘッダ（framing.AudioHeader）。あればバッファが並べ替え・損失検出を行う。"""
+        await _push(self.jb, self._rate.process(chunk), header)
+
+
+async def _push(jb: JitterBuffer, chunk: bytes, header) -> None:
+    if header is None:
+        await jb.push_chunk(chunk)
+    else:
+        await jb.push_chunk(chunk, seq=header.seq, utter_id=header.utter_id, sent_at=header.ts_s)
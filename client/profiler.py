@@ -0,0 +1,162 @@
+"""実機で使える軽いサンプリングプロファイラ（flamegraph 用の folded 形式で書き出す）。
+
+別スレッドが interval_s（既定 5ms）ごとにイベントループのスレッドのスタック
+（sys._current_frames）を覗き、同じスタックが何回見えたかを数える。計測される側には
+何も仕掛けないので、cProfile と違って音声の処理を遅くしない。
+
+書き出しは1行1スタックの folded 形式（"根;…;葉 回数"）で、flamegraph.pl や speedscope で
+そのまま読める。根には、そのとき動いていたタスクの名前（asyncio.current_task）を置く。
+
+起動のしかた（install() が設定する）:
+- PROFILE_S=30: 起動してから30秒間だけ計測して書き出す。
+- PROFILE_SIGNAL=1: SIGUSR1 を受けるたびに計測の開始 / 停止（停止時に書き出す）を切り替える。
+  例: kill -USR1 <pid> で開始、もう一度で停止。
+書き出し先は PROFILE_DIR（既定: 一時ディレクトリ）の kokushimen-<pid>-<時刻（ミリ秒まで）>.folded。
+"""
+
+import asyncio
+import collections
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from .log import get_logger
+
+_log = get_logger("profile")
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval_s: float = 0.005, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.interval_s = interval_s
+        self._loop = loop
+        self._thread_id: Optional[int] = None
+        self._stop: Optional[threading.Event] = None
+        self._thread: Optional[threading.Thread] = None
+        self.counts: collections.Counter = collections.Counter()
+        self.started_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def samples(self) -> int:
+        return sum(self.counts.values())
+
+    def start(self):
+        """呼んだスレッド（イベントループのスレッド）を計測し始める。"""
+        if self.running:
+            return
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        # 計測ごとに新しい Counter にする（止めた分の書き出し中に次を始めても混ざらない）
+        self.counts = collections.Counter()
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, args=(self._stop, self.counts), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> Optional[threading.Thread]:
+        """止める合図だけ出す（イベントループを待たせない）。止まるのを待つなら返したスレッドを join する。"""
+        if not self.running:
+            return None
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        return thread
+
+    def _sample(self, stop: threading.Event, counts: collections.Counter):
+        cache = {}  # code → 名前（同じ関数を何度も文字列にしない）
+        while not stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = cache.get(code)
+                if name is None:
+                    name = cache[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            task = asyncio.current_task(self._loop)
+            stack.append(f"[{task.get_name()}]" if task is not None else "[loop]")
+            counts[";".join(reversed(stack))] += 1
+
+    def dump(self, path: str, counts: Optional[collections.Counter] = None):
+        counts = self.counts if counts is None else counts
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _default_path() -> str:
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{int(now * 1000) % 1000:03d}"  # 続けて止めても別名
+    return os.path.join(os.getenv("PROFILE_DIR") or tempfile.gettempdir(), f"kokushimen-{os.getpid()}-{stamp}.folded")
+
+
+def _finish(profiler: SamplingProfiler, loop: asyncio.AbstractEventLoop):
+    """計測を止めて書き出す。スレッドの join とファイルへの書き込みは executor で行う
+    （イベントループの上でやると、それ自体がウォッチドッグの報告する停止になる）。"""
+    thread = profiler.stop()
+    if thread is None:
+        return
+    counts = profiler.counts
+    path = _default_path()
+
+    def write() -> int:
+        thread.join()
+        profiler.dump(path, counts)
+        return sum(counts.values())
+
+    def report(future: asyncio.Future):
+        try:
+            samples = future.result()
+        except OSError as e:
+            _log.error("[profile] 書き出せませんでした（%s）", e)
+        else:
+            _log.info("[profile] %d サンプルを %s に書き出しました", samples, path)
+
+    loop.run_in_executor(None, write).add_done_callback(report)
+
+
+def install(loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[SamplingProfiler]:
+    """環境変数（PROFILE_S / PROFILE_SIGNAL / PROFILE_INTERVAL_MS）に従ってプロファイラを仕掛ける。
+
+    イベントループの中から呼ぶ。どちらも設定されていなければ何もしない（None を返す）。
+    """
+    seconds = float(os.getenv("PROFILE_S", "0"))
+    use_signal = os.getenv("PROFILE_SIGNAL", "0") == "1"
+    if seconds <= 0 and not use_signal:
+        return None
+    loop = loop or asyncio.get_running_loop()
+    profiler = SamplingProfiler(interval_s=int(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0, loop=loop)
+
+    if use_signal:
+        def toggle():
+            if profiler.running:
+                _finish(profiler, loop)
+            else:
+                _log.info("[profile] 計測を開始します（もう一度 SIGUSR1 で停止・書き出し）")
+                profiler.start()
+
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, toggle)
+        except (NotImplementedError, AttributeError):
+            _log.warning("[profile] この環境ではシグナルで切り替えられません（PROFILE_S を使ってください）")
+
+    if seconds > 0:
+        profiler.start()
+        loop.call_later(seconds, _finish, profiler, loop)
+    return profiler
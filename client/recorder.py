@@ -0,0 +1,371 @@
+"""セッションの記録と再生（現場で起きたことを手元で再現する）。
+
+SessionRecorder は、クライアントが見たもの（ストリームごとのマイクのフレーム、受け取った TTS の
+チャンク、送受信した JSON）を単調時計の時刻付きで1つのファイルに追記していく。
+
+ファイルの形式（リトルエンディアン）:
+  先頭 4 バイト: MAGIC（b"KSR1"）
+  以降はレコードの並び: <QBBI>（記録開始からの時刻[µs], 種類, ストリーム番号, 本体の長さ）+ 本体
+    KIND_STREAM   ストリーム番号の定義（本体は JSON: {"name": ..., "rate": ...}。最初に使う前に書く）
+    KIND_META     記録の情報（JSON: 開始時の壁時計など）
+    KIND_MIC      マイクのフレーム（frame_iter が返した PCM。取り込みレートのまま）
+    KIND_TTS      on_pcm_chunk に渡した PCM（音声ヘッダ付きの場合は framing.pack_audio の形）
+    KIND_FORMAT   下りのレートの変更（<I）
+    KIND_CONTROL_IN / KIND_CONTROL_OUT  受け取った / 送った JSON（UTF-8）
+追記だけなので、途中で電源が落ちても最後の不完全なレコードを除いて読める。
+
+SD カードへの書き込みは、buffer_bytes（RECORD_BUFFER_KB、既定 256KB）ごと、または flush_s
+（RECORD_FLUSH_S、既定 5 秒）ごとにまとめて、別スレッドが行う（イベントループは待たない）。
+PCM のままなので 16kHz のマイク2本と TTS で1時間あたり 400MB ほどになる。1つのファイルが max_bytes
+（RECORD_MAX_MB、既定 64MB）を超えたら次のファイル（session-<時刻>-1.ksr, -2, ...）に移り、
+keep（RECORD_KEEP、既定 8）より古いものは消す（SD カードを使い切らないように）。
+どのファイルも先頭に MAGIC・KIND_META・使っているストリームの定義を持つので、単独で読める。
+
+SessionReplay は記録を sender_task（frame_iter()）と出力（on_pcm_chunk）へ流し直す。
+realtime=True なら記録した時刻どおり（speed 倍速）、False ならできるだけ速く流す。
+レコードはファイルから順に読みながら流す（メモリに持つのはストリームの定義・件数・JSON だけ）。
+"""
+
+import asyncio
+import collections
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .framing import now_us, pack_audio, unpack_audio
+
+MAGIC = b"KSR1"
+_RECORD = struct.Struct("<QBBI")
+_RATE = struct.Struct("<I")
+
+KIND_STREAM = 0
+KIND_META = 1
+KIND_MIC = 2
+KIND_TTS = 3
+KIND_TTS_FRAMED = 4
+KIND_FORMAT = 5
+KIND_CONTROL_IN = 6
+KIND_CONTROL_OUT = 7
+
+Record = collections.namedtuple("Record", "t_us kind stream payload")
+
+
+class SessionRecorder:
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"records", "recorded_bytes", "dropped_bytes", "removed_parts"})
+
+    def __init__(
+        self,
+        path: str,
+        buffer_bytes: int = 256 * 1024,
+        flush_s: float = 5.0,
+        max_pending: int = 64,
+        max_bytes: int = 0,
+        keep: int = 0,
+    ):
+        self.path = path  # 書き込み中のファイル（ローテーションで変わる）
+        self.buffer_bytes = buffer_bytes
+        self.flush_s = flush_s
+        self.max_bytes = max_bytes  # 0 ならローテーションしない
+        self.keep = keep  # 残すファイル数（0 なら消さない）
+        self.records = 0
+        self.recorded_bytes = 0
+        self.dropped_bytes = 0  # 書き込みが追いつかず捨てた分
+        self.parts = 1
+        self.removed_parts = 0
+        self._base = path
+        self._t0 = now_us()
+        self._streams: Dict[str, int] = {}
+        self._stream_defs: Dict[int, bytes] = {}  # 新しいファイルの先頭に書き直す
+        self._buf = bytearray()
+        self._last_handoff = time.monotonic()
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._write_loop, name="session-recorder", daemon=True)
+        self._thread.start()
+
+    # ---- 記録（イベントループから呼ぶ） ----
+    def _stream(self, name: str, rate: Optional[int] = None) -> int:
+        index = self._streams.get(name)
+        if index is None:
+            index = self._streams[name] = len(self._streams)
+            info = {"name": name}
+            if rate is not None:
+                info["rate"] = rate
+            payload = self._stream_defs[index] = json.dumps(info).encode()
+            self._append(KIND_STREAM, index, payload)
+        return index
+
+    def _append(self, kind: int, stream: int, payload):
+        if self._closed:
+            return
+        self._buf += _RECORD.pack(now_us() - self._t0, kind, stream, len(payload))
+        self._buf += payload
+        self.records += 1
+        self.recorded_bytes += _RECORD.size + len(payload)
+        if len(self._buf) >= self.buffer_bytes or time.monotonic() - self._last_handoff >= self.flush_s:
+            self._handoff()
+
+    def _handoff(self):
+        self._last_handoff = time.monotonic()
+        if not self._buf:
+            return
+        try:
+            self._pending.put_nowait(bytes(self._buf))
+        except queue.Full:
+            self.dropped_bytes += len(self._buf)
+        self._buf.clear()
+
+    def record_mic(self, stream: str, frame, rate: Optional[int] = None):
+        self._append(KIND_MIC, self._stream(stream, rate), frame)
+
+    def record_tts(self, pcm, header=None, stream: str = "playback"):
+        if header is None:
+            self._append(KIND_TTS, self._stream(stream), pcm)
+        else:
+            self._append(KIND_TTS_FRAMED, self._stream(stream), pack_audio(header.seq, header.utter_id, header.ts_us, pcm))
+
+    def record_format(self, rate: int, stream: str = "playback"):
+        self._append(KIND_FORMAT, self._stream(stream), _RATE.pack(rate))
+
+    def record_control(self, stream: str, text: str, outgoing: bool = False):
+        self._append(KIND_CONTROL_OUT if outgoing else KIND_CONTROL_IN, self._stream(stream), text.encode())
+
+    # ---- 書き込み（別スレッド） ----
+    def _part_path(self, part: int) -> str:
+        if part == 0:
+            return self._base
+        root, ext = os.path.splitext(self._base)
+        return f"{root}-{part}{ext}"
+
+    def _header(self, part: int) -> bytes:
+        """ファイルの先頭（MAGIC・記録の情報・それまでに定義したストリーム）。"""
+        t_us = now_us() - self._t0
+        out = bytearray(MAGIC)
+        meta = json.dumps({"version": 1, "wall_time": time.time(), "part": part}).encode()
+        out += _RECORD.pack(t_us, KIND_META, 0, len(meta)) + meta
+        for index, info in list(self._stream_defs.items()):
+            out += _RECORD.pack(t_us, KIND_STREAM, index, len(info)) + info
+        return bytes(out)
+
+    def _write_loop(self):
+        # まとめた塊はレコードの境目で切れているので、塊の間で次のファイルに移ってよい
+        part = 0
+        written: collections.deque = collections.deque()
+        f = open(self.path, "ab")
+        try:
+            size = f.write(self._header(part))
+            written.append(self.path)
+            while True:
+                chunk = self._pending.get()
+                if chunk is None:
+                    break
+                if self.max_bytes and size >= self.max_bytes:
+                    os.fsync(f.fileno())
+                    f.close()
+                    part += 1
+                    self.path = self._part_path(part)
+                    f = open(self.path, "ab")
+                    size = f.write(self._header(part))
+                    written.append(self.path)
+                    self.parts = part + 1
+                    while self.keep and len(written) > self.keep:
+                        try:
+                            os.remove(written.popleft())
+                            self.removed_parts += 1
+                        except OSError:
+                            pass
+                size += f.write(chunk)
+                f.flush()
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def close(self):
+        """残りを書き出してファイルを閉じる（書き終わるまで待つ）。"""
+        if self._closed:
+            return
+        self._handoff()
+        self._closed = True
+        self._pending.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "recorded_bytes": self.recorded_bytes,
+            "dropped_bytes": self.dropped_bytes,
+            "parts": self.parts,
+            "removed_parts": self.removed_parts,
+        }
+
+
+def read_trace(path: str) -> Iterator[Record]:
+    """記録を先頭から1レコードずつ読む（ストリーム番号は名前に直す。末尾の不完全なレコードは無視する）。"""
+    names: Dict[int, str] = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"セッションの記録ではありません: {path}")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            t_us, kind, stream, length = _RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if kind == KIND_STREAM:
+                names[stream] = json.loads(payload)["name"]
+            yield Record(t_us, kind, names.get(stream, str(stream)), payload)
+
+
+class SessionReplay:
+    def __init__(self, path: str, realtime: bool = True, speed: float = 1.0):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.streams: Dict[str, dict] = {}
+        self.meta: dict = {}
+        # 最初に一度だけ読み通して、定義・件数・JSON（小さい）だけ控える。音声は流すときに読み直す
+        self.counts: Dict[Tuple[int, str], int] = collections.Counter()
+        self._controls: List[Record] = []
+        self._first_us: Optional[int] = None
+        self._last_us = 0
+        for r in read_trace(path):
+            # 先頭の定義は書き込みスレッドが後から付けるので、時刻の順とは限らない
+            self._first_us = r.t_us if self._first_us is None else min(self._first_us, r.t_us)
+            self._last_us = max(self._last_us, r.t_us)
+            self.counts[(r.kind, r.stream)] += 1
+            if r.kind == KIND_STREAM:
+                info = json.loads(r.payload)
+                self.streams[info["name"]] = info
+            elif r.kind == KIND_META:
+                if not self.meta:
+                    self.meta = json.loads(r.payload)
+            elif r.kind in (KIND_CONTROL_IN, KIND_CONTROL_OUT):
+                self._controls.append(r)
+        self.position_us: Dict[str, int] = {}  # ストリームごとに、最後に流したレコードの時刻
+        self.done: Dict[str, asyncio.Event] = {}
+        self._start: Optional[float] = None
+
+    @property
+    def duration_s(self) -> float:
+        return (self._last_us - self._first_us) / 1e6 if self._first_us is not None else 0.0
+
+    def count(self, kinds: Union[int, Iterable[int]], stream: Optional[str] = None) -> int:
+        """種類（とストリーム）ごとのレコード数。"""
+        kinds = (kinds,) if isinstance(kinds, int) else tuple(kinds)
+        return sum(n for (kind, name), n in self.counts.items() if kind in kinds and (stream is None or name == stream))
+
+    def read(self, kinds: Union[int, Iterable[int]], stream: Optional[str] = None) -> Iterator[Record]:
+        """ファイルから該当するレコードだけを順に読む（全体はメモリに載せない）。"""
+        kinds = (kinds,) if isinstance(kinds, int) else tuple(kinds)
+        for r in read_trace(self.path):
+            if r.kind in kinds and (stream is None or r.stream == stream):
+                yield r
+
+    def mic_streams(self) -> List[str]:
+        return [name for name in self.streams if self.counts[(KIND_MIC, name)]]
+
+    def rate_of(self, stream: str, default: int) -> int:
+        return int(self.streams.get(stream, {}).get("rate") or default)
+
+    async def _wait_until(self, t_us: int):
+        if not self.realtime:
+            await asyncio.sleep(0)  # 他のタスクにも順番を回す
+            return
+        loop = asyncio.get_running_loop()
+        if self._start is None:
+            self._start = loop.time() - t_us / 1e6 / self.speed
+        delay = self._start + t_us / 1e6 / self.speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _event(self, stream: str) -> asyncio.Event:
+        return self.done.setdefault(stream, asyncio.Event())
+
+    def frame_iter(self, stream: str) -> Callable:
+        """sender_task の frame_iter として渡す関数を返す。
+
+        再接続で呼び直されたら続きから流す。流し終えたら done[stream] を立て、そのまま待ち続ける
+        （実デバイスと同じく終わらない。呼び出し側が done を見てタスクを止める）。
+        """
+        frames = self.read(KIND_MIC, stream)
+        state = {"next": None}  # 読んだがまだ渡していないレコード（待っている間に切れたとき用）
+        done = self._event(stream)
+
+        async def gen():
+            while True:
+                r = state["next"] or next(frames, None)
+                if r is None:
+                    break
+                state["next"] = r
+                await self._wait_until(r.t_us)
+                state["next"] = None
+                self.position_us[stream] = r.t_us
+                yield r.payload
+            done.set()
+            await asyncio.Future()
+
+        return gen
+
+    async def play_tts(
+        self,
+        on_pcm_chunk: Callable[..., Awaitable[None]],
+        on_format: Optional[Callable[[int], None]] = None,
+        stream: str = "playback",
+        on_tts_done: Optional[Callable[[Optional[int]], None]] = None,
+    ):
+        """記録した TTS チャンクを on_pcm_chunk(pcm, header) へ、下りのレートの変更を on_format へ、
+        受け取った tts_done を on_tts_done(utter_id) へ流す。"""
+        done = self._event(stream)
+        for r in self.read((KIND_TTS, KIND_TTS_FRAMED, KIND_FORMAT, KIND_CONTROL_IN), stream):
+            if r.kind == KIND_CONTROL_IN:
+                if on_tts_done is None:
+                    continue
+                try:
+                    data = json.loads(r.payload)
+                except ValueError:
+                    continue
+                if data.get("type") == "tts_done":
+                    await self._wait_until(r.t_us)
+                    utter = data.get("utter_id")
+                    on_tts_done(utter if isinstance(utter, int) else None)
+                continue
+            await self._wait_until(r.t_us)
+            self.position_us[stream] = r.t_us
+            if r.kind == KIND_FORMAT:
+                if on_format is not None:
+                    on_format(_RATE.unpack(r.payload)[0])
+            elif r.kind == KIND_TTS_FRAMED:
+                header, body = unpack_audio(r.payload)
+                await on_pcm_chunk(bytes(body), header)
+            else:
+                await on_pcm_chunk(r.payload, None)
+        done.set()
+
+    def controls(self, outgoing: bool, stream: Optional[str] = None) -> List[Record]:
+        kind = KIND_CONTROL_OUT if outgoing else KIND_CONTROL_IN
+        return [r for r in self._controls if r.kind == kind and (stream is None or r.stream == stream)]
+
+
+def make_recorder() -> Optional[SessionRecorder]:
+    """環境変数から作る（RECORD=1 で有効。RECORD_DIR（既定: カレント）に session-<時刻>.ksr を作る。
+    RECORD_MAX_MB（既定 64、0 で無制限）ごとに次のファイルへ移り、RECORD_KEEP（既定 8、0 で全部）個だけ残す）。"""
+    if os.getenv("RECORD", "0") != "1":
+        return None
+    directory = os.getenv("RECORD_DIR", ".")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"session-{time.strftime('%Y%m%d-%H%M%S')}.ksr")
+    return SessionRecorder(
+        path,
+        buffer_bytes=int(os.getenv("RECORD_BUFFER_KB", "256")) * 1024,
+        flush_s=float(os.getenv("RECORD_FLUSH_S", "5")),
+        max_bytes=int(float(os.getenv("RECORD_MAX_MB", "64")) * 1024 * 1024),
+        keep=int(os.getenv("RECORD_KEEP", "8")),
+    )
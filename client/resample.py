@@ -0,0 +1,186 @@
+"""ストリーミング用のサンプリングレート変換（ポリフェーズ・窓付き sinc フィルタ）。
+
+リサンプリング: 例えば 48kHz のマイク音声を 16kHz に変える（間引く）、16kHz の受信音声を
+24kHz のスピーカーに合わせる（補間する）こと。比 L/M（出力/入力を約分したもの）の
+有理数変換として、L 倍に補間 → 低域通過フィルタ → 1/M に間引く処理を、
+必要な出力サンプルだけ計算するポリフェーズ形式で行う。
+
+- 前のチャンクの末尾を履歴として保持するので、20ms や 200ms ごとに区切って入れても途切れない。
+- NumPy があればチャンク単位でまとめて計算し、なければ純 Python（sum/map）で計算する。
+- 入出力は int16 PCM（リトルエンディアン・モノラル）の bytes。
+"""
+
+import array
+import math
+import operator
+import sys
+from math import gcd
+from typing import Iterable, List, Optional
+
+try:
+    import numpy as np  # type: ignore
+
+    HAVE_NUMPY = True
+except ImportError:  # NumPy は任意依存
+    np = None
+    HAVE_NUMPY = False
+
+
+_LITTLE = sys.byteorder == "little"
+
+# hello で提示・選択できるサンプリングレートとサンプル形式（チャンネルはモノラルのみ）
+SUPPORTED_RATES = (8000, 16000, 24000, 48000)
+FORMATS = ("s16le",)
+
+
+def _design(L: int, M: int, taps_per_phase: int) -> List[List[float]]:
+    """ポリフェーズ分解したフィルタ係数 phases[p][j] = h[p + L*j] を作る（Blackman 窓）。"""
+    n = taps_per_phase * L
+    fc = 0.5 / max(L, M) * 0.92  # 補間後のレート基準の遮断周波数（折り返し防止に少し低め）
+    center = (n - 1) / 2.0
+    h = []
+    for i in range(n):
+        x = i - center
+        sinc = 2 * fc if x == 0 else math.sin(2 * math.pi * fc * x) / (math.pi * x)
+        w = 0.42 - 0.5 * math.cos(2 * math.pi * i / (n - 1)) + 0.08 * math.cos(4 * math.pi * i / (n - 1))
+        h.append(sinc * w * L)  # 補間で振幅が 1/L になる分を戻す
+    return [h[p::L] for p in range(L)]
+
+
+class Resampler:
+    """in_rate → out_rate の変換器（1ストリームにつき1つ。状態を持つ）。"""
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 16):
+        if in_rate <= 0 or out_rate <= 0:
+            raise ValueError("サンプリングレートは正の値を指定してください")
+        g = gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.L = out_rate // g
+        self.M = in_rate // g
+        if self.M > self.L:
+            # 間引きでは遮断周波数が低くなる分だけタップを増やす（入力サンプル換算の長さを保つ）
+            taps_per_phase *= -(-self.M // self.L)
+        self.taps = taps_per_phase
+        self.passthrough = self.L == self.M
+        phases = _design(self.L, self.M, taps_per_phase) if not self.passthrough else []
+        # 畳み込みしやすいよう、各位相の係数を逆順（古いサンプル→新しいサンプル）に並べておく
+        self._phases = [p[::-1] for p in phases]
+        self._hist_len = taps_per_phase - 1
+        self._t = self._hist_len * self.L  # 次の出力の位置（補間後のサンプル単位・履歴の先頭基準）
+        if HAVE_NUMPY and not self.passthrough:
+            self._np_phases = np.array(self._phases, dtype=np.float64)
+            self._np_hist = np.zeros(self._hist_len, dtype=np.float64)
+        else:
+            self._hist = [0.0] * self._hist_len
+
+    def reset(self):
+        self._t = self._hist_len * self.L
+        if HAVE_NUMPY and not self.passthrough:
+            self._np_hist[:] = 0.0
+        else:
+            self._hist = [0.0] * self._hist_len
+
+    def process(self, pcm) -> bytes:
+        """int16 PCM を変換して返す（出力長は入力長×比に対して ±1 サンプル程度ずれることがある）。"""
+        if self.passthrough:
+            return bytes(pcm)
+        if HAVE_NUMPY:
+            return self._process_numpy(pcm)
+        return self._process_pure(pcm)
+
+    def _outputs(self, n_ext: int):
+        """履歴込みの長さ n_ext の入力で計算できる出力の (開始位置, 個数)。"""
+        L, M = self.L, self.M
+        last = n_ext * L  # base = t // L が n_ext 未満の間だけ出力できる
+        if self._t >= last:
+            return self._t, 0
+        count = (last - self._t + M - 1) // M
+        return self._t, count
+
+    def _process_numpy(self, pcm) -> bytes:
+        x = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2).astype(np.float64)
+        ext = np.concatenate((self._np_hist, x))
+        t0, count = self._outputs(len(ext))
+        if count:
+            k = t0 + self.M * np.arange(count)
+            base = k // self.L
+            phase = k % self.L
+            idx = base[:, None] - (self._hist_len - np.arange(self.taps))[None, :]
+            y = np.einsum("ij,ij->i", ext[idx], self._np_phases[phase])
+            out = np.clip(np.rint(y), -32768, 32767).astype("<i2").tobytes()
+        else:
+            out = b""
+        self._advance(len(ext), t0 + self.M * count)
+        self._np_hist = ext[len(ext) - self._hist_len :].copy()
+        return out
+
+    def _process_pure(self, pcm) -> bytes:
+        x = array.array("h")
+        x.frombytes(bytes(pcm[: len(pcm) // 2 * 2]))
+        if not _LITTLE:
+            x.byteswap()
+        ext = self._hist + list(x)
+        t0, count = self._outputs(len(ext))
+        L, M, T1 = self.L, self.M, self._hist_len
+        phases = self._phases
+        mul = operator.mul
+        out = array.array("h", bytes(2 * count))
+        k = t0
+        for i in range(count):
+            base = k // L
+            v = sum(map(mul, phases[k % L], ext[base - T1 : base + 1]))
+            out[i] = -32768 if v < -32768 else 32767 if v > 32767 else int(round(v))
+            k += M
+        self._advance(len(ext), k)
+        self._hist = ext[len(ext) - T1 :]
+        if not _LITTLE:
+            out.byteswap()
+        return out.tobytes()
+
+    def _advance(self, n_ext: int, t_next: int):
+        # 次のチャンクでは履歴（T-1 サンプル）が先頭に来るので、その分だけ位置をずらす
+        self._t = t_next - (n_ext - self._hist_len) * self.L
+
+
+class RateAdapter:
+    """受信側のレートが後から決まる（hello の返答など）場合のための薄いラッパ。
+
+    set_input_rate() でレートが変わったら変換器を作り直す。同じレートなら何もしない（素通し）。
+    """
+
+    def __init__(self, in_rate: int, out_rate: int):
+        self.out_rate = out_rate
+        self.in_rate = in_rate
+        self._rs: Optional[Resampler] = None
+        self.set_input_rate(in_rate)
+
+    def set_input_rate(self, rate: int):
+        self.in_rate = rate
+        self._rs = None if rate == self.out_rate else Resampler(rate, self.out_rate)
+
+    def process(self, pcm) -> bytes:
+        return pcm if self._rs is None else self._rs.process(pcm)
+
+
+def negotiate_rate(offered: Optional[Iterable[int]], supported: Iterable[int] = SUPPORTED_RATES, default: int = 24000) -> int:
+    """相手が挙げた順（希望順）に、こちらも対応しているレートを選ぶ。無ければ default。"""
+    supported = set(supported)
+    for rate in offered or ():
+        try:
+            rate = int(rate)
+        except (TypeError, ValueError):
+            continue
+        if rate in supported:
+            return rate
+    return default
+
+
+def parse_rate_list(value: Optional[str]) -> List[int]:
+    """"16000,24000" のようなカンマ区切りを整数のリストにする。"""
+    out = []
+    for v in (value or "").split(","):
+        v = v.strip()
+        if v:
+            out.append(int(v))
+    return out
@@ -0,0 +1,249 @@
+"""固定長フレームのリングバッファ（事前確保・SPSC）。
+
+リングバッファ: 決まった大きさの保存領域を輪のように使い回すバッファ。
+起動時に1回だけ bytearray を確保し、以後はフレームごとの bytes 生成をしない。
+
+SPSC（Single Producer / Single Consumer）: 書き込み側と読み出し側がそれぞれ1つだけの前提。
+- 書き込み側だけが `_head`（書き込んだ累積フレーム数）を進める。
+- 読み出し側だけが `_tail`（読み出した累積フレーム数）を進める。
+データを書き終えてからカウンタを1回の代入で進めるので、片方がイベントループ、
+もう片方が PortAudio などのスレッドでもロックなしで使える（CPython の GIL 前提）。
+"""
+
+from typing import Optional
+
+
+class FrameRing:
+    def __init__(self, frame_bytes: int, capacity_frames: int):
+        if frame_bytes <= 0 or capacity_frames <= 0:
+            raise ValueError("frame_bytes と capacity_frames は 1 以上を指定してください")
+        self.frame_bytes = frame_bytes
+        self.capacity = capacity_frames
+        self._buf = bytearray(frame_bytes * capacity_frames)
+        self._view = memoryview(self._buf)
+        self._zeros = memoryview(bytes(frame_bytes))  # 短いフレームのパディング用（無音）
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self) -> int:
+        return self._head - self._tail
+
+    def free(self) -> int:
+        return self.capacity - (self._head - self._tail)
+
+    def _slot(self, index: int) -> memoryview:
+        off = (index % self.capacity) * self.frame_bytes
+        return self._view[off : off + self.frame_bytes]
+
+    # ---- 書き込み側 ----
+    def write(self, data) -> bool:
+        """1フレーム書き込む。短ければ無音で埋める。満杯なら False（何もしない）。"""
+        if self._head - self._tail >= self.capacity:
+            return False
+        slot = self._slot(self._head)
+        n = min(len(data), self.frame_bytes)
+        slot[:n] = data if len(data) == n else memoryview(data)[:n]
+        if n < self.frame_bytes:
+            slot[n:] = self._zeros[: self.frame_bytes - n]
+        self._head += 1
+        return True
+
+    def reserve(self) -> Optional[memoryview]:
+        """次に書き込むスロットを直接返す（commit() で確定）。満杯なら None。
+
+        コールバックから channel 分離などで直接書き込むときに使う（中間コピーなし）。
+        """
+        if self._head - self._tail >= self.capacity:
+            return None
+        return self._slot(self._head)
+
+    def commit(self):
+        self._head += 1
+
+    # ---- 読み出し側 ----
+    def peek(self, offset: int = 0) -> Optional[memoryview]:
+        """先頭から offset 番目のフレームを参照（コピーなし）。無ければ None。
+
+        返した memoryview は advance() するまで書き換えられない。
+        """
+        if offset >= self._head - self._tail:
+            return None
+        return self._slot(self._tail + offset)
+
+    def advance(self, n: int = 1):
+        n = min(n, self._head - self._tail)
+        self._tail += n
+
+    def read_into(self, out) -> bool:
+        """先頭フレームを out へコピーして進める。無ければ False。"""
+        if self._head == self._tail:
+            return False
+        out[: self.frame_bytes] = self._slot(self._tail)
+        self._tail += 1
+        return True
+
+    def clear(self):
+        """読み出し側から呼ぶ（溜まっているフレームを全て捨てる）。"""
+        self._tail = self._head
+
+
+class CaptureRing:
+    """音声スレッド（書き込み）→ イベントループ（読み出し）のフレーム受け渡し。
+
+    - 書き込み側（PortAudio のコールバックや読み取りスレッド）は write() を呼ぶだけ。
+      事前確保したリングへ直接コピーするので、ブロックごとの bytes 生成は無い。
+    - 読み出し側が待っているときだけ、batch_frames 個たまった時点で
+      call_soon_threadsafe で1回だけイベントループを起こす（起こす予約は重ねない）。
+    - 満杯のときは入ってきたフレームを捨て、dropped_frames / overflows に数える
+      （SPSC なので書き込み側から古いフレームは捨てない）。
+    - 書き込み側が続けられなくなったら fail(exc) を呼ぶ。get() は溜まっている分を返した後に exc を送出する。
+    """
+
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"frames_in", "dropped_frames", "overflows", "wakeups"})
+
+    def __init__(self, frame_bytes: int, capacity_frames: int = 50, batch_frames: int = 1):
+        self.ring = FrameRing(frame_bytes, capacity_frames)
+        self.frame_bytes = frame_bytes
+        self.batch_frames = max(1, batch_frames)
+        self.frames_in = 0
+        self.dropped_frames = 0
+        self.overflows = 0  # 満杯で捨てた write() 呼び出しの回数
+        self.wakeups = 0
+        self._fill = 0  # 書きかけスロットの埋まり具合（ブロック長が1フレームと異なる場合）
+        self._loop = None
+        self._event = None
+        self._waiting = False
+        self._wake_pending = False
+        self._error: Optional[BaseException] = None
+
+    def attach(self, loop):
+        """読み出し側のイベントループを登録する（書き込み開始前に呼ぶ。前回の fail() は忘れる）。"""
+        import asyncio
+
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._error = None
+
+    # ---- 書き込み側（別スレッド） ----
+    def write(self, data) -> int:
+        """任意長のバイト列を書き込む。確定したフレーム数を返す。"""
+        mv = memoryview(data).cast("B") if not isinstance(data, (bytes, bytearray)) else memoryview(data)
+        fb = self.frame_bytes
+        if self._fill == 0 and len(mv) == fb:
+            committed = self._write_frame(mv)
+        else:
+            committed = 0
+            pos = 0
+            while pos < len(mv):
+                slot = self.ring.reserve()
+                if slot is None:
+                    self._fill = 0
+                    self.dropped_frames += (len(mv) - pos + fb - 1) // fb
+                    self.overflows += 1
+                    break
+                k = min(fb - self._fill, len(mv) - pos)
+                slot[self._fill : self._fill + k] = mv[pos : pos + k]
+                self._fill += k
+                pos += k
+                if self._fill == fb:
+                    self._fill = 0
+                    self.ring.commit()
+                    committed += 1
+            self.frames_in += committed
+        if committed:
+            self._maybe_wake()
+        return committed
+
+    def _write_frame(self, mv) -> int:
+        if not self.ring.write(mv):
+            self.dropped_frames += 1
+            self.overflows += 1
+            return 0
+        self.frames_in += 1
+        return 1
+
+    def commit_reserved(self):
+        """reserve() したスロットへ直接書いた後に呼ぶ（チャンネル分離などで使う）。"""
+        self.ring.commit()
+        self.frames_in += 1
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if self._waiting and not self._wake_pending and len(self.ring) >= self.batch_frames and self._loop is not None:
+            self._wake_pending = True
+            self.wakeups += 1
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:  # ループ終了後
+                pass
+
+    def _wake(self):
+        self._wake_pending = False
+        self._event.set()
+
+    def fail(self, exc: BaseException):
+        """書き込み側の失敗を読み出し側へ伝える（別スレッドから呼んでよい）。"""
+        self._error = exc
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:  # ループ終了後
+                pass
+
+    # ---- 読み出し側（イベントループ） ----
+    async def get(self) -> bytes:
+        """次のフレームを bytes で返す（溜まっていなければ待つ）。"""
+        ring = self.ring
+        while len(ring) == 0:
+            if self._error is not None:
+                raise self._error
+            self._event.clear()
+            self._waiting = True
+            # フラグを立ててから再確認（起こし損ね防止）
+            if len(ring) == 0 and self._error is None:
+                await self._event.wait()
+            self._waiting = False
+        frame = bytes(ring.peek())
+        ring.advance()
+        return frame
+
+    def stats(self) -> dict:
+        return {
+            "depth_frames": len(self.ring),
+            "capacity_frames": self.ring.capacity,
+            "frames_in": self.frames_in,
+            "dropped_frames": self.dropped_frames,
+            "overflows": self.overflows,
+            "wakeups": self.wakeups,
+        }
+
+
+class PreRollRing:
+    """直近 capacity_frames 個のフレームだけを覚えておくリング（発話開始前の音の保持用）。
+
+    満杯なら最も古いフレームを上書きする。書き込みと読み出しは同じタスク（sender_task）から行う。
+    """
+
+    def __init__(self, frame_bytes: int, capacity_frames: int):
+        self.ring = FrameRing(frame_bytes, capacity_frames)
+        self.flushed_frames = 0  # 発話開始時に先頭へ足したフレームの累計
+
+    def __len__(self) -> int:
+        return len(self.ring)
+
+    def push(self, frame):
+        if not self.ring.free():
+            self.ring.advance()
+        self.ring.write(frame)
+
+    def pop(self) -> Optional[memoryview]:
+        """最も古いフレームを参照して取り除く（次の push() まで有効）。無ければ None。"""
+        frame = self.ring.peek()
+        if frame is not None:
+            self.ring.advance()
+            self.flushed_frames += 1
+        return frame
+
+    def clear(self):
+        self.ring.clear()
@@ -1,13 +1,20 @@
 import asyncio
+import contextlib
 import os
 from typing import Callable
 from pathlib import Path
 
-from .audio_io import ToneGeneratorSource, AlsaaudioSource, SoundDeviceSource
+from .audio_io import CAPTURE_COUNTERS, RATE, ToneGeneratorSource, AlsaaudioSource, SoundDeviceSource, MultiChannelSource, reopening_frames
 from .player import NullPlayer, SoundDevicePlayer, JitteredOutput
+from .jitter import stream_clock
 from . import ws_client
 from .mute import MuteController
+from .mux import MuxClient
 from .emotion_led import EmotionLED
+from .trace import make_tracer
+from . import log, metrics, profiler
+from .watchdog import make_watchdog
+from .recorder import SessionReplay, make_recorder
 
 
 # .envファイルから環境変数を読み込む
@@ -30,7 +37,22 @@ SERVER_BASE_URL = f"ws://{SERVER_IP}:{SERVER_PORT}/ws"
 AUTH_TOKEN = os.getenv("SERVER_AUTH_TOKEN", "dev-token")
 
 
+async def _run_all(coros):
+    """全部をタスクとして動かす。どれかが例外で終わったら残りを止めてから例外を伝える
+    （NullPlayer へのフォールバックで、前の送信・再生タスクが残らないように）。"""
+    tasks = [asyncio.create_task(c) for c in coros]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def main():
+    # LOG_LEVEL / LOG_RATE_PER_S / LOG_FORMAT を .env の内容で読み直す（モジュールの import は .env より先）
+    log.configure()
+    metrics.REGISTRY.add_stats("log", log.stats, log.STATS_COUNTERS)
     # 接続先の確認ログ（トラブルシューティング用）
     print(f"[client] Connecting to server at {SERVER_BASE_URL}/{{mic_id}}")
 
@@ -40,23 +62,60 @@ async def main():
     # - tone: 実マイクなし。プログラム内で作った音を使う（疎通確認に最適）
     # - sounddevice: PCのマイク入力（sounddevice ライブラリが必要）
     # - alsa: LinuxのALSA経由の入力（軽量）
+    # - replay: RECORD=1 で記録したセッション（REPLAY_FILE）のマイク入力を流し直す（REPLAY_FAST=1 でできるだけ速く）
     input_backend = os.getenv("INPUT_BACKEND", "sounddevice")  # 既定は sounddevice
+    # CAPTURE_RATE: マイクを開くレート（デバイス本来のレート、例 48000）。送信レートへの変換は sender_task が行う
+    capture_rate = int(os.getenv("CAPTURE_RATE", str(RATE)))
     sd_self = None
     sd_other = None
+    multi = None
+    replay = None
+    if input_backend == "replay":
+        replay = SessionReplay(os.environ["REPLAY_FILE"], realtime=os.getenv("REPLAY_FAST", "0") != "1")
+        capture_rate = replay.rate_of("self", RATE)  # 記録したときの取り込みレート
 
-    if input_backend == "sounddevice":
+    # CAPTURE_MULTICHANNEL=1: self/other の2本のマイクを1つの多チャンネルデバイスとして開き、チャンネルで分ける
+    if input_backend in ("sounddevice", "alsa") and os.getenv("CAPTURE_MULTICHANNEL", "0") == "1":
+        try:
+            multi = MultiChannelSource(
+                backend=input_backend,
+                device=os.getenv("CAPTURE_DEVICE") or os.getenv("SD_INPUT_DEVICE_SELF") or os.getenv("SD_INPUT_DEVICE"),
+                channels=int(os.getenv("CAPTURE_CHANNELS", "2")),
+                mapping={
+                    "self": int(os.getenv("CAPTURE_CHANNEL_SELF", "0")),
+                    "other": int(os.getenv("CAPTURE_CHANNEL_OTHER", "1")),
+                },
+                rate=capture_rate,
+            )
+        except Exception as e:
+            print(f"[client] 多チャンネル入力を初期化できませんでした（{e}）。tone にフォールバックします。")
+            input_backend = "tone"
+
+    if multi is None and input_backend == "sounddevice":
         # デバイス指定（self/other 別々に）。
         dev_self = os.getenv("SD_INPUT_DEVICE_SELF") or os.getenv("SD_INPUT_DEVICE")
         dev_other = os.getenv("SD_INPUT_DEVICE_OTHER")
         try:
-            sd_self = SoundDeviceSource(device=dev_self)
+            sd_self = SoundDeviceSource(device=dev_self, rate=capture_rate)
             if dev_other:
-                sd_other = SoundDeviceSource(device=dev_other)
+                sd_other = SoundDeviceSource(device=dev_other, rate=capture_rate)
         except Exception as e:
             print(f"[client] sounddevice 入力を初期化できませんでした（{e}）。tone にフォールバックします。")
             input_backend = "tone" # Fallback to tone
 
-    if input_backend == "sounddevice" and sd_self is not None:
+    # 取り込みリングの統計（深さ・捨てたフレーム数）を METRICS_PORT / METRICS_FILE で書き出す
+    if multi is not None:
+        for name in ("self", "other"):
+            metrics.REGISTRY.add_stats("capture", lambda name=name: multi.capture_stats()[name], CAPTURE_COUNTERS, stream=name)
+    elif input_backend == "sounddevice" and sd_self is not None:
+        metrics.REGISTRY.add_stats("capture", sd_self.capture_stats, CAPTURE_COUNTERS, stream="self")
+        if sd_other is not None:
+            metrics.REGISTRY.add_stats("capture", sd_other.capture_stats, CAPTURE_COUNTERS, stream="other")
+
+    if multi is not None:
+        frames_self = lambda: reopening_frames(multi, "self")
+        frames_other = lambda: reopening_frames(multi, "other")
+    elif input_backend == "sounddevice" and sd_self is not None:
         async def frames_self():
             async with sd_self as s:
                 async for f in s.frames(): yield f
@@ -66,17 +125,19 @@ async def main():
                     async for f in s.frames(): yield f
             else: # 無限に待機するジェネレータ
                 while True: await asyncio.sleep(3600)
+    elif replay is not None:
+        frames_self = replay.frame_iter("self")
+        frames_other = replay.frame_iter("other")
     elif input_backend == "alsa":
         # (ALSAのロジックは変更なし)
-        alsa_self = AlsaaudioSource()
-        alsa_other = AlsaaudioSource()
-        async def frames_self():
-            async with alsa_self as s:
-                async for f in s.frames(): yield f
-        async def frames_other():
-            async with alsa_other as s:
-                async for f in s.frames(): yield f
+        alsa_self = AlsaaudioSource(rate=capture_rate)
+        alsa_other = AlsaaudioSource(rate=capture_rate)
+        metrics.REGISTRY.add_stats("capture", alsa_self.capture_stats, CAPTURE_COUNTERS, stream="self")
+        metrics.REGISTRY.add_stats("capture", alsa_other.capture_stats, CAPTURE_COUNTERS, stream="other")
+        frames_self = lambda: reopening_frames(alsa_self)
+        frames_other = lambda: reopening_frames(alsa_other)
     else: # "tone" or fallback
+        capture_rate = RATE  # トーンは RATE で生成する
         gen_self = ToneGeneratorSource(freq=440.0)
         gen_other = ToneGeneratorSource(freq=660.0)
         async def frames_self():
@@ -84,6 +145,9 @@ async def main():
         async def frames_other():
             async for f in gen_other.frames(): yield f
 
+    # 2つ目のマイク（other）の送信タスクを動かすか
+    has_other = multi is not None or (input_backend == "sounddevice" and sd_other) or input_backend != "sounddevice"
+
     # ------------------------------------------------------------------
     # 出力先の準備 (スピーカー or NullPlayer)
     # ------------------------------------------------------------------
@@ -93,52 +157,117 @@ async def main():
     # LED制御の初期化
     led = EmotionLED()
     
-    # 実行するタスクのリスト
-    tasks = []
+    # TRACE=1: 発話ごとに、話し終わりから返答の音が出るまでの区間を計測する（全タスクで共有）
+    tracer = make_tracer()
+    on_frame = tracer.on_frame_out if tracer is not None else None
+    if tracer is not None:
+        metrics.REGISTRY.add_stats("trace", tracer.stats, tracer.COUNTERS)
+    # RECORD=1: マイク入力・受け取った TTS・送受信した JSON をセッションの記録に追記する（client/recorder.py）
+    recorder = make_recorder()
+    if recorder is not None:
+        print(f"[client] セッションを記録します: {recorder.path}")
+        metrics.REGISTRY.add_stats("recorder", recorder.stats, recorder.COUNTERS)
+
+    # PROFILE_S / PROFILE_SIGNAL: サンプリングプロファイラ（flamegraph 用の folded 形式。client/profiler.py）
+    profiler.install()
+
+    # 音声とは別に動かすタスク（METRICS_PORT / METRICS_FILE を設定すると、計測値を Prometheus の
+    # テキスト形式で書き出す。client/metrics.py）。失敗しても音声のタスクは止めない
+    background = metrics.start_exporters()
+    # LOOP_WATCHDOG=1: イベントループを止めたタスクと場所を表示する（client/watchdog.py）
+    watchdog = make_watchdog()
+    if watchdog is not None:
+        background.append(asyncio.create_task(watchdog.run(), name="loop-watchdog"))
     # 接続先URLを動的に生成
     ws_uri_self_sender = f"{SERVER_BASE_URL}/self?role=sender"
     ws_uri_self_playback = f"{SERVER_BASE_URL}/self?role=playback"
     ws_uri_other_sender = f"{SERVER_BASE_URL}/other?role=sender"
 
+    # WS_MUX=1: 3本の接続の代わりに、1本の WebSocket（/ws/mux）へ全ストリームを多重化する
+    mux = MuxClient(os.getenv("WS_MUX_URI", f"{SERVER_BASE_URL}/mux"), AUTH_TOKEN) if os.getenv("WS_MUX", "0") == "1" else None
+
+    def conn(stream_id: str, role: str) -> dict:
+        # 多重化では同じチャンネルを2つ持てないので、予備の接続（WS_STANDBY）は使わない
+        return {"connect": lambda: mux.channel(stream_id, role), "standby": False} if mux is not None else {}
+
     # メインの処理（再生デバイスの有無で分岐）
     try:
         if use_sounddevice:
             out_dev = os.getenv("SD_OUTPUT_DEVICE") or os.getenv("SD_INPUT_DEVICE_SELF")
             try:
-                async with SoundDevicePlayer(device=out_dev) as player:
-                    jot = JitteredOutput(player._stream.write)
-                    async with jot:
-                        async def on_pcm_chunk(chunk: bytes):
-                            await jot.on_chunk(chunk)
+                jb_opts = dict(
+                    max_buffer_ms=int(os.getenv("JB_MAX_MS", "600")),
+                    overflow=os.getenv("JB_OVERFLOW", "block"),
+                    adaptive=os.getenv("JB_ADAPTIVE", "0") == "1",
+                    # JB_PLC: 再生中にバッファが空になったときの補間（off / repeat / noise）
+                    conceal=os.getenv("JB_PLC", "off"),
+                    conceal_ms=int(os.getenv("JB_PLC_MS", "80")),
+                )
+                # SD_OUTPUT_MODE=callback: 音声スレッドがジッターバッファから直接取り出す
+                output_mode = os.getenv("SD_OUTPUT_MODE", "write")
+                player_opts = dict(jb_opts, on_frame=on_frame) if output_mode == "callback" else {}
+                # PLAYBACK_RATE: スピーカーを開くレート（デバイス本来のレート）。受信音声はこのレートへ変換する
+                playback_rate = int(os.getenv("PLAYBACK_RATE", str(RATE)))
+                async with SoundDevicePlayer(device=out_dev, mode=output_mode, rate=playback_rate, **player_opts) as player:
+                    if output_mode == "callback":
+                        output = contextlib.nullcontext()
+                        on_chunk = player.play
+                        on_format = player.set_input_rate
+                        on_tts_done = player.end_utterance
+                        metrics.REGISTRY.add_stats("jitter", player.jb.stats, player.jb.COUNTERS)
+                        metrics.REGISTRY.add_stats("playback", player.stats.as_dict, player.stats.COUNTERS)
+                    else:
+                        output = JitteredOutput(
+                            player._stream.write,
+                            **jb_opts,
+                            # PLAYBACK_CLOCK=device: サウンドカードの時計に合わせて20msを刻む
+                            clock=stream_clock(player._stream) if os.getenv("PLAYBACK_CLOCK", "loop") == "device" else None,
+                            out_rate=playback_rate,
+                            on_frame=on_frame,
+                        )
+                        on_chunk = output.on_chunk
+                        on_format = output.set_input_rate
+                        on_tts_done = output.end_utterance
+                        metrics.REGISTRY.add_stats("jitter", output.jb.stats, output.jb.COUNTERS)
+                        metrics.REGISTRY.add_stats("playback", output.stats.as_dict, output.stats.COUNTERS)
+                    async with output:
+                        async def on_pcm_chunk(chunk: bytes, header=None):
+                            await on_chunk(chunk, header)
 
                         # タスクを定義
-                        tasks.append(ws_client.sender_task(ws_uri_self_sender, AUTH_TOKEN, "self", frames_self, mute=mute))
-                        tasks.append(ws_client.playback_task(ws_uri_self_playback, AUTH_TOKEN, on_pcm_chunk, mute=mute, led=led))
+                        tasks = []
+                        tasks.append(ws_client.sender_task(ws_uri_self_sender, AUTH_TOKEN, "self", frames_self, mute=mute, capture_rate=capture_rate, tracer=tracer, recorder=recorder, **conn("self", "sender")))
+                        tasks.append(ws_client.playback_task(ws_uri_self_playback, AUTH_TOKEN, on_pcm_chunk, mute=mute, led=led, on_format=on_format, on_tts_done=on_tts_done, tracer=tracer, recorder=recorder, **conn("self", "playback")))
                         # 2つ目のマイクが有効なら送信タスクを追加
-                        if (input_backend == "sounddevice" and sd_other) or input_backend != "sounddevice":
-                            tasks.append(ws_client.sender_task(ws_uri_other_sender, AUTH_TOKEN, "other", frames_other, mute=mute))
+                        if has_other:
+                            tasks.append(ws_client.sender_task(ws_uri_other_sender, AUTH_TOKEN, "other", frames_other, mute=mute, capture_rate=capture_rate, tracer=tracer, recorder=recorder, **conn("other", "sender")))
                         
-                        await asyncio.gather(*tasks)
+                        await _run_all(tasks)
             except Exception as e:
                 print(f"[client] sounddevice 出力を初期化できませんでした（{e}）。NullPlayer にフォールバックします。")
                 use_sounddevice = False # Set flag to false and drop into the 'else' block below.
         
         if not use_sounddevice: # This block will now be used for both default and fallback cases.
             player = NullPlayer()
-            async def on_pcm_chunk(chunk: bytes):
-                await player.play(chunk)
+            async def on_pcm_chunk(chunk: bytes, header=None):
+                await player.play(chunk, header)
 
             # タスクを定義
-            tasks.append(ws_client.sender_task(ws_uri_self_sender, AUTH_TOKEN, "self", frames_self, mute=mute))
-            tasks.append(ws_client.playback_task(ws_uri_self_playback, AUTH_TOKEN, on_pcm_chunk, mute=mute, led=led))
+            tasks = []
+            tasks.append(ws_client.sender_task(ws_uri_self_sender, AUTH_TOKEN, "self", frames_self, mute=mute, capture_rate=capture_rate, tracer=tracer, recorder=recorder, **conn("self", "sender")))
+            tasks.append(ws_client.playback_task(ws_uri_self_playback, AUTH_TOKEN, on_pcm_chunk, mute=mute, led=led, tracer=tracer, recorder=recorder, **conn("self", "playback")))
             # 2つ目のマイクが有効なら送信タスクを追加
-            if (input_backend == "sounddevice" and sd_other) or input_backend != "sounddevice":
-                tasks.append(ws_client.sender_task(ws_uri_other_sender, AUTH_TOKEN, "other", frames_other, mute=mute))
+            if has_other:
+                tasks.append(ws_client.sender_task(ws_uri_other_sender, AUTH_TOKEN, "other", frames_other, mute=mute, capture_rate=capture_rate, tracer=tracer, recorder=recorder, **conn("other", "sender")))
 
-            await asyncio.gather(*tasks)
+            await _run_all(tasks)
     finally:
+        for task in background:
+            task.cancel()
         # 終了時にLEDをクリーンアップ
         led.cleanup()
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+"""上り送信キュー（取り込みと送信の切り離し）。
+
+従来は `async for frame in frame_iter()` の中で ws.send を待っていたため、ネットワークが
+詰まると取り込みも止まり、デバイス側のキューで黙ってフレームが落ちていた。
+SendQueue は取り込み側（sender_task のループ）が put() したメッセージを、接続ごとの
+送信タスク（run()）が順に ws.send する。キューの長さは音声のフレーム数で制限し、
+満杯のときの振る舞いを policy で選ぶ。
+
+- "block"（既定）: 空きができるまで put() が待つ（従来と同じく取り込みが待たされるが、
+  送信の一時的な詰まりは容量分だけ吸収する）。
+- "drop_oldest": 最も古い音声メッセージを捨てて入れる。
+- "drop_silence": 無音（発話終わりのハングオーバーやプリロールなど、声でないフレームだけの
+  メッセージ）のうち最も古いものを先に捨てる。無ければ最も古い音声メッセージを捨てる。
+JSON（stop など）は捨てず、容量にも数えない。
+
+音声はコーデックで圧縮・音声ヘッダを付けた後の形で積むので、捨てた分は受信側では
+連番の抜け（損失）として見える。統計は stats()（キューの深さ・捨てたフレーム数・
+put から送信完了までの時間の p50/p95/p99）。
+"""
+
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable, Optional
+
+from .audio_io import FRAME_MS
+
+SEND_POLICIES = ("block", "drop_oldest", "drop_silence")
+
+
+class _Item:
+    __slots__ = ("payload", "frames", "silent", "queued_at", "packet", "on_sent")
+
+    def __init__(self, payload, frames: int, silent: bool, packet=None, on_sent=None):
+        self.payload = payload
+        self.frames = frames  # 音声のフレーム数（JSON は 0）
+        self.silent = silent
+        self.queued_at = time.perf_counter()
+        self.packet = packet  # 圧縮前の PCM（Packetizer.on_sent 用）
+        self.on_sent = on_sent  # JSON を送り終えたら呼ぶ関数
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class SendQueue:
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({
+        "enqueued_messages", "sent_messages", "sent_frames", "sent_bytes",
+        "dropped_frames", "dropped_silence_frames", "discarded_frames", "blocked_s",
+    })
+
+    def __init__(self, capacity_ms: int = 1000, policy: str = "block", history: int = 500):
+        if policy not in SEND_POLICIES:
+            raise ValueError(f"policy は {SEND_POLICIES} のいずれかを指定してください: {policy!r}")
+        self.capacity_frames = max(1, capacity_ms // FRAME_MS)
+        self.policy = policy
+        self._items: collections.deque = collections.deque()
+        self._frames = 0
+        self._ready = asyncio.Event()  # 送る物がある
+        self._space = asyncio.Event()  # 空きがある（block 用）
+        self._space.set()
+        self._closed = False
+        # 統計
+        self.enqueued_messages = 0
+        self.sent_messages = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_silence_frames = 0
+        self.discarded_frames = 0  # 切断で送れなかった分
+        self.blocked_s = 0.0  # block で put() が待った合計時間
+        self.max_depth_frames = 0
+        self._latency_ms: collections.deque = collections.deque(maxlen=history)
+        self._send_ms: collections.deque = collections.deque(maxlen=history)
+
+    @property
+    def depth_frames(self) -> int:
+        return self._frames
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    # ---- 取り込み側 ----
+    async def put_audio(self, payload, frames: int, silent: bool = False, packet=None):
+        """音声メッセージを積む。満杯なら policy に従う。送信タスクが止まっていれば ConnectionError。"""
+        if self._closed:
+            raise ConnectionError("送信キューが閉じています")
+        frames = max(1, frames)
+        while self._frames + frames > self.capacity_frames and self._frames > 0:
+            if self.policy == "block":
+                self._space.clear()
+                t0 = time.perf_counter()
+                await self._space.wait()
+                self.blocked_s += time.perf_counter() - t0
+                if self._closed:
+                    raise ConnectionError("送信キューが閉じています")
+                continue
+            self._drop_one()
+        self._append(_Item(payload, frames, silent, packet))
+
+    def put_control(self, text: str, on_sent: Optional[Callable[[], None]] = None):
+        """JSON（stop など）を積む。捨てず、容量にも数えない。on_sent は送り終えたときに呼ぶ。"""
+        if self._closed:
+            raise ConnectionError("送信キューが閉じています")
+        self._append(_Item(text, 0, False, on_sent=on_sent))
+
+    def _append(self, item: _Item):
+        self._items.append(item)
+        self._frames += item.frames
+        self.enqueued_messages += 1
+        self.max_depth_frames = max(self.max_depth_frames, self._frames)
+        self._ready.set()
+
+    def _drop_one(self):
+        victim = None
+        if self.policy == "drop_silence":
+            victim = next((it for it in self._items if it.frames and it.silent), None)
+        if victim is None:
+            victim = next((it for it in self._items if it.frames), None)
+        if victim is None:
+            return
+        self._items.remove(victim)
+        self._frames -= victim.frames
+        self.dropped_frames += victim.frames
+        if victim.silent:
+            self.dropped_silence_frames += victim.frames
+
+    async def join(self):
+        """積んだ分を送り終えるまで待つ（送信タスクが止まったら ConnectionError）。"""
+        while self._items:
+            if self._closed:
+                raise ConnectionError("送信キューが閉じています")
+            self._space.clear()
+            await self._space.wait()
+
+    # ---- 送信側 ----
+    async def run(self, send: Callable[[object], Awaitable[None]], on_sent: Optional[Callable] = None):
+        """接続ごとの送信タスク。send が例外を出したらキューを閉じてその例外を出す。
+
+        on_sent(item_packet, elapsed_s, wire_bytes, frames): 音声メッセージを送るたびに呼ぶ（Packetizer 用）。
+        """
+        self._closed = False
+        try:
+            while True:
+                if not self._items:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                # 取り出してから送る（送信中のメッセージは捨てる対象にならない）
+                item = self._items.popleft()
+                self._frames -= item.frames
+                t0 = time.perf_counter()
+                await send(item.payload)
+                done = time.perf_counter()
+                self.sent_messages += 1
+                self.sent_bytes += len(item.payload)
+                self._send_ms.append((done - t0) * 1000.0)
+                if item.frames:
+                    self.sent_frames += item.frames
+                    self._latency_ms.append((done - item.queued_at) * 1000.0)
+                    if on_sent is not None:
+                        on_sent(item.packet, done - t0, len(item.payload), item.frames)
+                elif item.on_sent is not None:
+                    item.on_sent()
+                self._space.set()
+        finally:
+            self._closed = True
+            self._space.set()
+
+    def reset(self):
+        """切断時に呼ぶ（送れなかった分は捨てる。連番・コーデックの状態が接続ごとのため）。"""
+        self.discarded_frames += self._frames
+        self._items.clear()
+        self._frames = 0
+        self._closed = False
+        self._space.set()
+
+    def stats(self) -> dict:
+        lat = sorted(self._latency_ms)
+        send = sorted(self._send_ms)
+        return {
+            "policy": self.policy,
+            "depth_frames": self._frames,
+            "max_depth_frames": self.max_depth_frames,
+            "capacity_frames": self.capacity_frames,
+            "enqueued_messages": self.enqueued_messages,
+            "sent_messages": self.sent_messages,
+            "sent_frames": self.sent_frames,
+            "sent_bytes": self.sent_bytes,
+            "dropped_frames": self.dropped_frames,
+            "dropped_silence_frames": self.dropped_silence_frames,
+            "discarded_frames": self.discarded_frames,
+            "blocked_s": round(self.blocked_s, 3),
+            "latency_p50_ms": round(_percentile(lat, 0.50), 2),
+            "latency_p95_ms": round(_percentile(lat, 0.95), 2),
+            "latency_p99_ms": round(_percentile(lat, 0.99), 2),
+            "send_p95_ms": round(_percentile(send, 0.95), 2),
+        }
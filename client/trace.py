@@ -0,0 +1,187 @@
+"""発話ごとの区間計測（話し終わりから返答の音が出るまでのどこで時間がかかっているか）。
+
+各段階の時刻（framing.now_us、µs）を発話IDごとに記録し、発話が終わった（tts_done）時点で
+区間の長さを計算してヒストグラム（直近 history 件）に積む。
+
+  speech_end       最後に声と判定したフレームの取り込み時刻（音声ヘッダの ts_us と同じ値）
+  endpoint         sender_task で VAD が発話終了を検出した
+  stop_sent        stop を送り終えた
+  tts_sent         サーバが最初の TTS チャンクを送った（音声ヘッダの ts_us。ハートビートで
+                   時計のずれが分かっているときだけ、こちらの時計に直して記録する）
+  first_tts_byte   playback_task が最初の TTS チャンクを受け取った
+  first_frame_out  playback_loop / 音声コールバックが最初のフレームをデバイスに渡した
+  tts_done         tts_done を受け取った
+
+発話IDは sender_task の utter_id（stop・音声ヘッダで送り、サーバが返す）。TTS 側で発話IDが
+分からない（ヘッダなし・サーバが別の ID を返す）ときは、stop を送ったが TTS がまだ来ていない
+最も古い発話に結び付ける。最初のフレームの出力はプリバッファの後なので、tts_done の方が先に
+届いたときは出力を待ってから区間を計算する。統計は stats()（区間ごとの p50/p95/p99）。TRACE=1 で有効。
+"""
+
+import asyncio
+import collections
+import os
+from typing import Dict, Optional
+
+from .framing import now_us
+from .log import get_logger
+
+STAGES = ("speech_end", "endpoint", "stop_sent", "tts_sent", "first_tts_byte", "first_frame_out", "tts_done")
+
+# (区間名, 始まりの段階, 終わりの段階)
+SPANS = (
+    ("hangover", "speech_end", "endpoint"),
+    ("stop_queue", "endpoint", "stop_sent"),
+    ("server", "stop_sent", "tts_sent"),
+    ("downlink", "tts_sent", "first_tts_byte"),
+    ("response", "stop_sent", "first_tts_byte"),
+    ("buffering", "first_tts_byte", "first_frame_out"),
+    ("tts_stream", "first_tts_byte", "tts_done"),
+    ("turn", "speech_end", "first_frame_out"),
+)
+
+_log = get_logger("trace")
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class TurnTracer:
+    # stats() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"turns", "abandoned"})
+
+    def __init__(self, history: int = 200, max_open: int = 32, log: bool = False, summary_every: int = 10):
+        self.max_open = max_open
+        self.log = log  # 発話ごとに区間を表示する
+        self.summary_every = summary_every  # この件数ごとに stats() を表示する（0 で表示しない）
+        self.turns = 0  # 区間を計算し終えた発話の数
+        self.abandoned = 0  # TTS が来ないまま古くなって捨てた発話の数
+        self._open: "collections.OrderedDict[int, Dict[str, int]]" = collections.OrderedDict()
+        self._hist: Dict[str, collections.deque] = {name: collections.deque(maxlen=history) for name, _, _ in SPANS}
+        self._playing: Optional[int] = None  # いま TTS を受け取っている発話
+        self._done: list = []  # tts_done を受け取り、最初のフレームの出力を待っている発話
+        # 音声スレッドからはこの2つだけを書く（辞書はイベントループ側でだけ触る）
+        self._frame_pending: Optional[int] = None  # 最初のフレームの出力を待っている発話
+        self._frame_out: Optional[tuple] = None  # (発話ID, 出力した時刻)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def mark(self, utter_id: int, stage: str, t_us: Optional[int] = None):
+        """段階の時刻を記録する（同じ発話・段階は最初の1回だけ）。イベントループから呼ぶ。"""
+        marks = self._open.get(utter_id)
+        if marks is None:
+            marks = self._open[utter_id] = {}
+            while len(self._open) > self.max_open:
+                old, _ = self._open.popitem(last=False)
+                if old in self._done:
+                    self._done.remove(old)
+                self.abandoned += 1
+        marks.setdefault(stage, now_us() if t_us is None else t_us)
+
+    def _oldest_waiting(self) -> Optional[int]:
+        for utter_id, marks in self._open.items():
+            if "stop_sent" in marks and "first_tts_byte" not in marks:
+                return utter_id
+        return None
+
+    def on_tts_chunk(self, utter_id=None, server_us: Optional[int] = None):
+        """TTS チャンクを受け取るたびに呼ぶ。server_us はこちらの時計に直したサーバの送信時刻。"""
+        if self._playing is not None and (utter_id is None or utter_id == self._playing):
+            return
+        self._collect()
+        uid = utter_id if isinstance(utter_id, int) and utter_id in self._open else self._oldest_waiting()
+        if uid is None:
+            return
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._playing = uid
+        if server_us is not None:
+            self.mark(uid, "tts_sent", server_us)
+        self.mark(uid, "first_tts_byte")
+        self._frame_pending = uid
+
+    def on_frame_out(self):
+        """フレームをデバイスに渡すたびに呼ぶ。音声スレッドからも呼べる（待っていなければすぐ戻る）。"""
+        uid = self._frame_pending
+        if uid is None:
+            return
+        self._frame_pending = None
+        self._frame_out = (uid, now_us())
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._collect)
+
+    def on_tts_done(self, utter_id=None):
+        """tts_done で呼ぶ。最初のフレームがまだ出力されていなければ、出力されてから区間を計算する。"""
+        uid = utter_id if isinstance(utter_id, int) and utter_id in self._open else self._playing
+        self._playing = None
+        if uid is None or uid not in self._open:
+            return
+        self.mark(uid, "tts_done")
+        if uid not in self._done:
+            self._done.append(uid)
+        self._collect()
+
+    def on_disconnect(self):
+        """再生の接続が切れたら呼ぶ。受け取り途中の TTS を終わったことにする（tts_done は来ないので、
+        そのままだと以降のヘッダなしのチャンクが全部その発話のものとみなされる）。"""
+        if self._playing is not None and self._playing not in self._done and self._open.pop(self._playing, None) is not None:
+            self.abandoned += 1
+        self._playing = None
+        self._frame_pending = None
+        self._collect()
+
+    def _collect(self):
+        frame_out, self._frame_out = self._frame_out, None
+        if frame_out is not None and frame_out[0] in self._open:
+            self._open[frame_out[0]].setdefault("first_frame_out", frame_out[1])
+        for uid in list(self._done):
+            # 最初のフレームが出力された（または次の発話の TTS が始まって出力されないまま終わった）
+            if self._frame_pending != uid or self._playing not in (None, uid):
+                self._done.remove(uid)
+                if self._frame_pending == uid:
+                    self._frame_pending = None
+                self._finish(uid, self._open.pop(uid, {}))
+
+    def _finish(self, utter_id: int, marks: Dict[str, int]):
+        self.turns += 1
+        spans = {}
+        for name, start, end in SPANS:
+            if start in marks and end in marks:
+                ms = (marks[end] - marks[start]) / 1000.0
+                self._hist[name].append(ms)
+                spans[name] = round(ms, 1)
+        if self.log:
+            _log.info("[trace] utter_id=%s %s", utter_id, spans)
+            if self.summary_every and self.turns % self.summary_every == 0:
+                _log.info("[trace] %s", self.stats())
+
+    def stats(self) -> dict:
+        out = {"turns": self.turns, "abandoned": self.abandoned}
+        for name, _, _ in SPANS:
+            d = sorted(self._hist[name])
+            if not d:
+                continue
+            out[name] = {
+                "n": len(d),
+                "p50_ms": round(_percentile(d, 0.50), 1),
+                "p95_ms": round(_percentile(d, 0.95), 1),
+                "p99_ms": round(_percentile(d, 0.99), 1),
+            }
+        return out
+
+
+def make_tracer() -> Optional[TurnTracer]:
+    """環境変数から作る（TRACE=1 で有効）。
+
+    TRACE_HISTORY: 直近何件から分位点を出すか（既定 200）。TRACE_SUMMARY_EVERY: 何件ごとに
+    stats() を表示するか（既定 10、0 で表示しない）。発話ごとの区間も表示する。
+    """
+    if os.getenv("TRACE", "0") != "1":
+        return None
+    return TurnTracer(
+        history=int(os.getenv("TRACE_HISTORY", "200")),
+        log=True,
+        summary_every=int(os.getenv("TRACE_SUMMARY_EVERY", "10")),
+    )
@@ -0,0 +1,363 @@
+"""発話区間の検出（エンドポインタ）。
+
+エンドポインタ: フレームを1つずつ見て「発話が始まった（START）」「発話が終わった（END）」を決める部品。
+sender_task は END のときに {"type":"stop"} を送るので、終わりの判定の遅れ（ハングオーバー）が
+そのまま応答の遅れになる。
+
+- FrameEndpointer: フレームごとの「声か／声でないか」をバックエンド（VadBackend）に任せ、
+  声が来たら開始、VAD_MIN_SIL_MS 続けて声でなければ終了。バックエンドは
+  RmsBackend（従来の固定閾値。VAD_MODE=fixed）/ EnergyZcrBackend（エネルギー＋ゼロ交差率。zcr）/
+  WebRtcBackend（webrtcvad。任意依存。webrtc）。
+- FixedEndpointer: 従来どおり。固定の閾値（VAD_THRESHOLD）を超えたら開始、
+  VAD_MIN_SIL_MS 続けて下回ったら終了（RmsBackend を使う FrameEndpointer）。
+- AdaptiveEndpointer: 雑音の大きさ（ノイズフロア）を追いかけ、開始・終了の閾値をそれに合わせて決める。
+  開始の閾値 > 終了の閾値（ヒステリシス）なので、語尾の弱い音で途切れにくい。
+  early_stop=True なら、雑音レベルまできれいに下がった終わり方のときだけ短いハングオーバーで終了する。
+
+どれも update(frame, features) が START / END / None を返し、終了ごとの
+ハングオーバー（最後に声と判定したフレームから END まで待った音声時間）を stats に記録する。
+これは設定（VAD_MIN_SIL_MS）と early_stop の効き具合を示すだけで、本当の発話の終わりからの遅れ
+（語尾を声でないと判定した分なども含む）ではない。そちらはラベル付きの音声で bench/vad.py が測る。
+last_voiced は直前のフレームが声と判定されたか（送信キューが無音のメッセージから捨てるのに使う）。
+"""
+
+import collections
+import math
+import os
+from typing import Dict, Optional
+
+from .audio_io import FRAME_MS
+from .frame_analysis import FrameFeatures, analyze_frame
+
+START = "start"
+END = "end"
+VAD_MODES = ("fixed", "adaptive", "zcr", "webrtc")
+
+
+class EndpointStats:
+    """発話ごとのハングオーバー（ms。最後に声と判定したフレームから END まで）。直近 history 件から中央値などを出す。"""
+
+    # as_dict() のうち増えるだけの値（metrics では _total の counter として書き出す）
+    COUNTERS = frozenset({"utterances", "early_stops"})
+
+    def __init__(self, history: int = 100):
+        self.utterances = 0
+        self.last_hangover_ms = 0
+        self.early_stops = 0
+        self._hangovers: collections.deque = collections.deque(maxlen=history)
+
+    def record(self, hangover_ms: int, early: bool = False):
+        self.utterances += 1
+        self.last_hangover_ms = hangover_ms
+        self.early_stops += early
+        self._hangovers.append(hangover_ms)
+
+    def as_dict(self) -> dict:
+        d = sorted(self._hangovers)
+        pick = lambda q: d[min(len(d) - 1, int(q * len(d)))] if d else 0
+        return {
+            "utterances": self.utterances,
+            "early_stops": self.early_stops,
+            "last_hangover_ms": self.last_hangover_ms,
+            "mean_hangover_ms": round(sum(d) / len(d), 1) if d else 0.0,
+            "p50_hangover_ms": pick(0.5),
+            "p95_hangover_ms": pick(0.95),
+        }
+
+
+class VadBackend:
+    """フレーム単位の判定（声か／声でないか）の共通インタフェース。
+
+    is_speech(frame, features) は1フレーム（20ms の int16 PCM）と、あれば解析済みの特徴量を受け取る。
+    発話の開始・終了（ハングオーバー）は FrameEndpointer 側で決めるので、バックエンドは状態を持たなくてよい。
+    threshold はデバッグ表示用のエネルギー閾値（使わないバックエンドは 0.0）。
+    """
+
+    name = "base"
+    threshold = 0.0
+
+    def is_speech(self, frame, features: Optional[FrameFeatures] = None) -> bool:
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+
+class RmsBackend(VadBackend):
+    """RMS が固定の閾値以上なら声（従来の固定閾値の判定）。"""
+
+    name = "rms"
+
+    def __init__(self, threshold: float = 0.02):
+        self.threshold = threshold
+
+    def is_speech(self, frame, features: Optional[FrameFeatures] = None) -> bool:
+        feats = features if features is not None else analyze_frame(frame)
+        return feats.rms >= self.threshold
+
+
+class EnergyZcrBackend(VadBackend):
+    """エネルギー（RMS）とゼロ交差率（ZCR）の組み合わせ。
+
+    - RMS が threshold 以上で、ゼロ交差の頻度（ZCR × レート / 2 [Hz]）が min_hz〜max_hz なら声。
+      極端に低いもの（電源ハム・低い唸り）と高いもの（ヒスノイズ・空調の風切り音）を除ける。
+      レートはフレーム長から求めるので、送信レートが変わっても同じ設定でよい。
+    - RMS が threshold * strong_ratio 以上なら ZCR に関係なく声（強い摩擦音など）。
+    どちらも analyze_frame の結果をそのまま使うので、RMS だけの判定と CPU 時間はほぼ変わらない。
+    """
+
+    name = "zcr"
+
+    def __init__(self, threshold: float = 0.02, min_hz: float = 80.0, max_hz: float = 3500.0, strong_ratio: float = 4.0):
+        self.threshold = threshold
+        self.min_hz = min_hz
+        self.max_hz = max_hz
+        self.strong = threshold * strong_ratio
+
+    def is_speech(self, frame, features: Optional[FrameFeatures] = None) -> bool:
+        feats = features if features is not None else analyze_frame(frame)
+        if feats.rms >= self.strong:
+            return True
+        if feats.rms < self.threshold:
+            return False
+        # 1秒あたりのゼロ交差 / 2 = 主な周波数の目安（samples / FRAME_MS = 1ms あたりのサンプル数）
+        hz = feats.zcr * feats.samples * 500.0 / FRAME_MS
+        return self.min_hz <= hz <= self.max_hz
+
+
+class WebRtcBackend(VadBackend):
+    """webrtcvad（任意依存）による判定。import は遅延し、使うときだけ依存する。
+
+    webrtcvad は 8/16/32/48kHz しか受け付けないので、フレーム長から求めたレートが
+    それ以外（24kHz など）なら resample.Resampler で 16kHz に変換してから渡す。
+    aggressiveness: 0（声を逃しにくい）〜3（雑音を声と誤りにくい）。
+    """
+
+    name = "webrtc"
+    RATES = (8000, 16000, 32000, 48000)
+
+    def __init__(self, aggressiveness: int = 2):
+        import webrtcvad  # type: ignore
+
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.aggressiveness = aggressiveness
+        self._resamplers: Dict[int, object] = {}
+
+    def is_speech(self, frame, features: Optional[FrameFeatures] = None) -> bool:
+        rate = len(frame) // 2 * 1000 // FRAME_MS
+        if rate not in self.RATES:
+            resampler = self._resamplers.get(rate)
+            if resampler is None:
+                from .resample import Resampler
+
+                resampler = self._resamplers[rate] = Resampler(rate, 16000)
+            frame = resampler.process(frame)
+            rate = 16000
+            # 変換の遅延で長さが揃わないときは 20ms 分に合わせる
+            need = rate * FRAME_MS // 1000 * 2
+            if len(frame) != need:
+                frame = bytes(frame[:need]).ljust(need, b"\0")
+        return self.vad.is_speech(bytes(frame), rate)
+
+    def reset(self):
+        for resampler in self._resamplers.values():
+            resampler.reset()
+
+
+class FrameEndpointer:
+    """バックエンドのフレーム判定から発話の開始・終了を決める。
+
+    - 開始: 声のフレームが start_frames 回続いたら START。
+    - 終了: 声でないフレームが min_silence_ms 続いたら END。
+    """
+
+    def __init__(self, backend: VadBackend, min_silence_ms: int = 400, start_frames: int = 1):
+        self.backend = backend
+        self.hangover_frames = max(1, min_silence_ms // FRAME_MS)
+        self.start_frames = max(1, start_frames)
+        self.speaking = False
+        self.last_voiced = False
+        self.stats = EndpointStats()
+        self._loud_run = 0
+        self._quiet_run = 0
+
+    @property
+    def threshold(self) -> float:
+        return self.backend.threshold
+
+    def reset(self):
+        self.speaking = False
+        self._loud_run = 0
+        self._quiet_run = 0
+        self.backend.reset()
+
+    def update(self, frame, features: Optional[FrameFeatures] = None) -> Optional[str]:
+        voiced = self.last_voiced = self.backend.is_speech(frame, features)
+        if not self.speaking:
+            self._loud_run = self._loud_run + 1 if voiced else 0
+            if self._loud_run >= self.start_frames:
+                self.speaking = True
+                self._loud_run = 0
+                self._quiet_run = 0
+                return START
+            return None
+        if voiced:
+            self._quiet_run = 0
+            return None
+        self._quiet_run += 1
+        if self._quiet_run >= self.hangover_frames:
+            self.stats.record(self._quiet_run * FRAME_MS)
+            self.speaking = False
+            self._quiet_run = 0
+            return END
+        return None
+
+
+class FixedEndpointer(FrameEndpointer):
+    """従来の固定閾値による判定（RmsBackend）。"""
+
+    def __init__(self, threshold: float = 0.02, min_silence_ms: int = 400):
+        super().__init__(RmsBackend(threshold), min_silence_ms=min_silence_ms)
+
+
+def _db(db: float) -> float:
+    return math.pow(10.0, db / 20.0)
+
+
+class AdaptiveEndpointer:
+    """ノイズフロア追従・ヒステリシス付きの判定。
+
+    - ノイズフロア: 直近 window_ms の RMS の最小値（最小値統計。0.5 秒ごとの最小値を window_ms 分覚えておく）。
+      発話中も更新するので、部屋がうるさくなっても window_ms 以内に閾値が追いつく
+      （言葉の切れ目で雑音レベルまで下がるため、発話の音量には引っ張られにくい）。
+    - 開始: RMS がノイズフロア + start_db（かつ min_threshold 以上）を start_frames 回続けて超えたら START。
+    - 終了: RMS がノイズフロア + stop_db を下回るフレームが hangover_ms 続いたら END。
+      early_stop=True なら、ノイズフロア + floor_db 以内まで下がった（きれいに終わった）フレームが
+      early_hangover_ms 続いた時点で END（語尾が弱く続いている間は通常のハングオーバー）。
+    """
+
+    def __init__(
+        self,
+        start_db: float = 9.0,
+        stop_db: float = 5.0,
+        floor_db: float = 3.0,
+        min_threshold: float = 0.005,
+        hangover_ms: int = 400,
+        early_stop: bool = False,
+        early_hangover_ms: int = 200,
+        start_frames: int = 1,
+        window_ms: int = 3000,
+    ):
+        self.start_ratio = _db(start_db)
+        self.stop_ratio = _db(stop_db)
+        self.floor_ratio = _db(floor_db)
+        self.min_threshold = min_threshold
+        self.hangover_frames = max(1, hangover_ms // FRAME_MS)
+        self.early_stop = early_stop
+        self.early_frames = max(1, min(early_hangover_ms, hangover_ms) // FRAME_MS)
+        self.start_frames = max(1, start_frames)
+        self._block_frames = 500 // FRAME_MS
+        self._blocks: collections.deque = collections.deque(maxlen=max(1, window_ms // 500))
+        self._block_min = math.inf
+        self._block_n = 0
+        self.noise_floor = 0.0
+        self.speaking = False
+        self.last_voiced = False
+        self.stats = EndpointStats()
+        self._loud_run = 0
+        self._quiet_run = 0
+        self._clean_run = 0
+
+    @property
+    def threshold(self) -> float:
+        """開始の閾値（デバッグ表示用）。"""
+        return max(self.min_threshold, self.noise_floor * self.start_ratio)
+
+    @property
+    def stop_threshold(self) -> float:
+        # 下限も開始の閾値と同じ比（ヒステリシス）を保つ
+        return max(self.min_threshold / self.start_ratio * self.stop_ratio, self.noise_floor * self.stop_ratio)
+
+    def reset(self):
+        """発話状態だけを戻す（ノイズフロアは覚えておく）。"""
+        self.speaking = False
+        self._loud_run = 0
+        self._quiet_run = 0
+        self._clean_run = 0
+
+    def _track_floor(self, rms: float):
+        if rms < self._block_min:
+            self._block_min = rms
+        self._block_n += 1
+        if self._block_n >= self._block_frames:
+            self._blocks.append(self._block_min)
+            self._block_min = math.inf
+            self._block_n = 0
+        self.noise_floor = min(self._block_min, min(self._blocks, default=math.inf))
+
+    def update(self, frame, features: Optional[FrameFeatures] = None) -> Optional[str]:
+        rms = (features if features is not None else analyze_frame(frame)).rms
+        self._track_floor(rms)
+        self.last_voiced = rms >= (self.stop_threshold if self.speaking else self.threshold)
+        if not self.speaking:
+            if rms >= self.threshold:
+                self._loud_run += 1
+                if self._loud_run >= self.start_frames:
+                    self.speaking = True
+                    self._loud_run = 0
+                    self._quiet_run = 0
+                    self._clean_run = 0
+                    return START
+                return None
+            self._loud_run = 0
+            return None
+
+        if rms >= self.stop_threshold:
+            self._quiet_run = 0
+            self._clean_run = 0
+            return None
+        self._quiet_run += 1
+        self._clean_run = self._clean_run + 1 if rms <= self.noise_floor * self.floor_ratio else 0
+        early = self.early_stop and self._clean_run >= self.early_frames
+        if early or self._quiet_run >= self.hangover_frames:
+            self.stats.record(self._quiet_run * FRAME_MS, early=early and self._quiet_run < self.hangover_frames)
+            self.reset()
+            return END
+        return None
+
+
+def make_endpointer(mode: Optional[str] = None):
+    """環境変数から発話区間の判定器を作る（VAD_MODE=fixed（既定）/ adaptive / zcr / webrtc）。"""
+    mode = mode or os.getenv("VAD_MODE", "fixed")
+    if mode not in VAD_MODES:
+        raise ValueError(f"VAD_MODE は {VAD_MODES} のいずれかを指定してください: {mode!r}")
+    try:
+        thr = float(os.getenv("VAD_THRESHOLD", "0.02"))
+    except ValueError:
+        thr = 0.02
+    try:
+        min_ms = int(os.getenv("VAD_MIN_SIL_MS", "400"))
+    except ValueError:
+        min_ms = 400
+    start_frames = int(os.getenv("VAD_START_FRAMES", "1"))
+    if mode == "fixed":
+        return FixedEndpointer(threshold=thr, min_silence_ms=min_ms)
+    if mode == "zcr":
+        backend = EnergyZcrBackend(
+            threshold=thr,
+            min_hz=float(os.getenv("VAD_ZCR_MIN_HZ", "80")),
+            max_hz=float(os.getenv("VAD_ZCR_MAX_HZ", "3500")),
+        )
+        return FrameEndpointer(backend, min_silence_ms=min_ms, start_frames=start_frames)
+    if mode == "webrtc":
+        backend = WebRtcBackend(aggressiveness=int(os.getenv("VAD_WEBRTC_MODE", "2")))
+        return FrameEndpointer(backend, min_silence_ms=min_ms, start_frames=start_frames)
+    return AdaptiveEndpointer(
+        start_db=float(os.getenv("VAD_START_DB", "9")),
+        stop_db=float(os.getenv("VAD_STOP_DB", "5")),
+        min_threshold=float(os.getenv("VAD_MIN_THRESHOLD", "0.005")),
+        hangover_ms=min_ms,
+        early_stop=os.getenv("VAD_EARLY_STOP", "0") == "1",
+        early_hangover_ms=int(os.getenv("VAD_EARLY_HANGOVER_MS", "200")),
+        start_frames=start_frames,
+    )
@@ -0,0 +1,117 @@
+"""イベントループの停止の検出（どのタスクのどこで止まったか）。
+
+送信タスク2本・再生タスク・再生ループは1つのイベントループで動くので、どこか1か所で
+同期的に待つ処理（ALSA の pcm.read、gpiozero、端末が遅いときの print など）があると、全部の
+音声が止まる。LoopWatchdog は次の2つで見張る。
+
+- イベントループ側: interval_s ごとに眠って起き、予定より遅れた時間（ループの遅れ）を
+  metrics.REGISTRY の loop_lag_ms / loop_lag_max_ms / loop_stalls_total に記録する。
+- 見張りスレッド: ループ側が最後に起きてから stall_ms 以上経ったら、その瞬間にループのスレッドで
+  動いているタスク（asyncio.current_task）とスタック（sys._current_frames）を控える。
+  ループが戻ったら、止まっていた時間とともに表示し（report=True）、stalls に残す。
+asyncio のデバッグモード（slow_callback_duration）と違い、止まっている最中の場所が分かり、
+普段の負担もほぼない（ループ側は interval_s ごとに1回起きるだけ）。
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+from .log import get_logger
+from .metrics import REGISTRY, Registry
+
+_log = get_logger("watchdog")
+
+
+def describe_frame(frame, depth: int = 3) -> str:
+    """スタックの内側から depth 個を "ファイル:行 関数" で並べる（内側が先）。"""
+    where = []
+    while frame is not None and len(where) < depth:
+        code = frame.f_code
+        where.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return " < ".join(where)
+
+
+def describe_task(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "(タスク外のコールバック)"
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", None) or type(coro).__name__
+    return f"{task.get_name()} ({name})"
+
+
+class LoopWatchdog:
+    def __init__(
+        self,
+        stall_ms: float = 100.0,
+        interval_s: float = 0.02,
+        report: bool = True,
+        registry: Registry = REGISTRY,
+        history: int = 50,
+    ):
+        self.stall_ms = stall_ms
+        self.interval_s = interval_s
+        self.report = report
+        # 直近の停止: {"ms": 止まっていた時間, "task": タスク, "where": スタック}
+        self.stalls: collections.deque = collections.deque(maxlen=history)
+        self._lag = registry.gauge("loop_lag_ms", "イベントループの遅れ（直近）")
+        self._peak = registry.gauge("loop_lag_max_ms", "イベントループの遅れ（最大）")
+        self._count = registry.counter("loop_stalls_total", f"イベントループが {stall_ms:.0f}ms 以上止まった回数")
+        self._tick = time.monotonic()
+        self._caught: Optional[dict] = None  # 見張りスレッドが控えた停止（ループ側で取り出す）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+
+    def _watch(self, stop: threading.Event):
+        limit = self.stall_ms / 1000.0
+        while not stop.wait(self.interval_s):
+            if self._caught is not None or time.monotonic() - self._tick < limit:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            self._caught = {
+                "task": describe_task(asyncio.current_task(self._loop)),
+                "where": describe_frame(frame),
+            }
+
+    async def run(self):
+        self._loop = loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._watch, args=(stop,), name="loop-watchdog", daemon=True)
+        self._tick = time.monotonic()
+        thread.start()
+        try:
+            while True:
+                t0 = loop.time()
+                await asyncio.sleep(self.interval_s)
+                self._tick = time.monotonic()
+                lag_ms = max(0.0, (loop.time() - t0 - self.interval_s) * 1000.0)
+                self._lag.set(round(lag_ms, 2))
+                if lag_ms > self._peak.value:
+                    self._peak.set(round(lag_ms, 2))
+                caught, self._caught = self._caught, None
+                if lag_ms >= self.stall_ms:
+                    self._count.inc()
+                    stall = dict(caught or {"task": "(不明)", "where": ""}, ms=round(lag_ms, 1))
+                    self.stalls.append(stall)
+                    if self.report:
+                        _log.warning("[watchdog] イベントループが %.0fms 止まりました: %s %s", stall["ms"], stall["task"], stall["where"])
+        finally:
+            stop.set()
+
+
+def make_watchdog() -> Optional[LoopWatchdog]:
+    """環境変数から作る。
+
+    LOOP_WATCHDOG=1 で停止を表示する（LOOP_STALL_MS、既定 100）。表示しなくても、METRICS_PORT /
+    METRICS_FILE を設定していればループの遅れを計測するために動かす。
+    """
+    report = os.getenv("LOOP_WATCHDOG", "0") == "1"
+    if not report and not (os.getenv("METRICS_PORT") or os.getenv("METRICS_FILE")):
+        return None
+    return LoopWatchdog(stall_ms=float(os.getenv("LOOP_STALL_MS", "100")), report=report)
@@ -1,15 +1,313 @@
 import asyncio
+import collections
+import contextlib
+import itertools
 import json
-from typing import Optional, Callable
+from typing import AsyncContextManager, Optional, Callable
 
 import websockets
 import os
 
-from .audio_io import FRAME_BYTES, FRAME_MS, SilenceDetector, rms_int16
+from .audio_io import FRAME_MS, RATE, frame_bytes_at
+from .frame_analysis import analyze_frame
+from .packetizer import Packetizer
+from .ring import PreRollRing
+from .send_queue import SendQueue
+from .connection import ConnectionManager
+from .heartbeat import Heartbeat, make_heartbeat
+from .trace import TurnTracer
+from .metrics import REGISTRY
+from .log import DEBUG, get_logger
+from .recorder import SessionRecorder
+from .codec import PCM, make_codec, parse_codec_list
+from .resample import FORMATS, Resampler, parse_rate_list
+from .framing import HEADER_NAME, now_us, pack_audio, unpack_audio
+from .vad import END, START, make_endpointer
 from .mute import MuteController
 from .emotion_led import EmotionLED
 
 
+_log = get_logger("ws_client")
+# sender_task の VAD・送信のデバッグ表示（LOG_LEVEL=DEBUG か VAD_DEBUG=1 で出す）
+_send_log = get_logger("send")
+
+# 発話ID（送信タスク間で共有。self/other の発話が TTS・区間計測で取り違えられないように）
+_utter_ids = itertools.count(1)
+
+
+def _codec_offer(env_name: str) -> Optional[list]:
+    """AUDIO_CODEC（カンマ区切りの希望順）が設定されていれば hello で提示するリストを返す。"""
+    value = os.getenv(env_name) or os.getenv("AUDIO_CODEC")
+    if not value or value.strip() == PCM:
+        return None
+    return parse_codec_list(value)
+
+
+def _rate_offer(env_name: str, default: Optional[str] = None) -> Optional[list]:
+    """UPLINK_RATE / DOWNLINK_RATES（カンマ区切りの希望順）から hello で提示するレートのリストを作る。
+
+    従来のサーバ向けに、末尾へ RATE（24kHz）を補う。
+    """
+    rates = parse_rate_list(os.getenv(env_name, default))
+    if not rates:
+        return None
+    if RATE not in rates:
+        rates.append(RATE)
+    return rates
+
+
+def _header_offer() -> bool:
+    """AUDIO_HEADER=1 なら音声メッセージに連番・時刻・発話IDのヘッダ（framing）を付けるよう提示する。"""
+    return os.getenv("AUDIO_HEADER", "0") == "1"
+
+
+async def _negotiate_sender(
+    ws,
+    stream_id: str,
+    offer: Optional[list],
+    rate_offer: Optional[list] = None,
+    header: bool = False,
+    heartbeat: bool = False,
+):
+    """送信側の hello。コーデック・レート・ヘッダ・ハートビートのいずれかを提示した場合だけ送り、サーバの返答を待つ。
+
+    (コーデック, 送信レート, ヘッダを付けるか, ハートビートを使うか) を返す。返答が無い・指定が無いサーバでは
+    従来どおり PCM / RATE / ヘッダなし / ハートビートなし。
+    """
+    if offer is None and rate_offer is None and not header and not heartbeat:
+        return make_codec(PCM), RATE, False, False
+    hello = {"type": "hello", "role": "sender", "stream_id": stream_id}
+    if offer is not None:
+        hello["codecs"] = offer
+    if rate_offer is not None:
+        hello["rates"] = rate_offer
+        hello["formats"] = list(FORMATS)
+    if header:
+        hello["header"] = HEADER_NAME
+    if heartbeat:
+        hello["heartbeat"] = True
+    await ws.send(json.dumps(hello))
+    try:
+        reply = json.loads(await asyncio.wait_for(ws.recv(), float(os.getenv("HELLO_TIMEOUT_S", "1.0"))))
+    except (asyncio.TimeoutError, ValueError, TypeError):
+        reply = {}
+    return (
+        make_codec(reply.get("codec") or PCM),
+        int(reply.get("rate") or RATE),
+        reply.get("header") == HEADER_NAME,
+        heartbeat and reply.get("heartbeat") is True,
+    )
+
+
+async def _sender_heartbeat(ws, hb: Heartbeat):
+    """送信側のハートビート。ping を送りながら pong を読む（送信側はほかに受け取る物が無い）。"""
+
+    async def read():
+        while True:
+            msg = await ws.recv()
+            if isinstance(msg, str):
+                try:
+                    data = json.loads(msg)
+                except ValueError:
+                    continue
+                if data.get("type") == "pong":
+                    hb.on_pong(data)
+
+    reader = asyncio.create_task(read())
+    try:
+        await hb.run(ws.send)
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+
+async def _read_ahead(ws, hb: Heartbeat, inbox: asyncio.Queue):
+    """受信を読み続けて inbox に積む。pong はその場で hb に渡す（受信ループは pong を数えるだけ）。
+
+    受信ループが on_pcm_chunk（ジッターバッファの空き待ち）で止まっている間も pong を読むので、
+    実時間より速く届いた返答を再生している最中に、健全な接続を途絶えたと判定しない。
+    切断などの例外も inbox に積んで受信ループへ伝える。
+    """
+    try:
+        while True:
+            msg = await ws.recv()
+            if isinstance(msg, str) and '"pong"' in msg:
+                try:
+                    data = json.loads(msg)
+                except ValueError:
+                    data = {}
+                if data.get("type") == "pong":
+                    hb.on_pong(data)
+            inbox.put_nowait(msg)
+    except Exception as e:
+        inbox.put_nowait(e)
+
+
+# _open_stream が取り決めた1本の接続の送り方（watch はハートビートのタスクか None）
+_Link = collections.namedtuple("_Link", "codec rate framed watch")
+
+
+@contextlib.asynccontextmanager
+async def _open_stream(
+    ws,
+    stream_id: str,
+    packetizer: Packetizer,
+    send_queue: SendQueue,
+    heartbeat: Optional[Heartbeat],
+    codec_offer: Optional[list],
+    rate_offer: Optional[list],
+    header_offer: bool,
+):
+    """接続ごとの送信の準備: hello の取り決め、送信キューを流すタスク、ハートビート。
+
+    前の接続で送り損ねた端数とキューの中身は捨てる（発話は _Utterances.resend で送り直す）。
+    抜けるときに送信タスクを止め、その例外を回収する。
+    """
+    packetizer.discard()
+    send_queue.reset()
+    codec, rate, framed, beating = await _negotiate_sender(
+        ws, stream_id, codec_offer, rate_offer, header_offer, heartbeat is not None
+    )
+    drain = asyncio.create_task(send_queue.run(ws.send, packetizer.on_sent))
+    watch = asyncio.create_task(_sender_heartbeat(ws, heartbeat)) if beating else None
+    if watch is not None:
+        # 途絶えたら送信タスクも止める（put 側で ConnectionError になる）
+        watch.add_done_callback(lambda _: drain.cancel())
+    try:
+        yield _Link(codec, rate, framed, watch)
+    finally:
+        drain.cancel()
+        if watch is not None:
+            watch.cancel()
+        # 送信タスクの例外はここで回収する（このタスク自身のキャンセルは伝える）
+        await asyncio.gather(drain, *([watch] if watch else []), return_exceptions=True)
+
+
+class _Utterances:
+    """sender_task の送る側の状態（接続をまたいで引き継ぐ）。
+
+    発話ID、パケットの符号化とヘッダ付け、送り直し用の spool（今の発話のフレームを送信レート・
+    取り込み時刻・無音か と一緒に覚えておき、stop を送り終えたら空にする）を持つ。
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        packetizer: Packetizer,
+        send_queue: SendQueue,
+        spool_frames: int,
+        tracer: Optional[TurnTracer] = None,
+        recorder: Optional[SessionRecorder] = None,
+    ):
+        self.stream_id = stream_id
+        self.packetizer = packetizer
+        self.send_queue = send_queue
+        self.tracer = tracer
+        self.recorder = recorder
+        self.codec = make_codec(PCM)
+        self.framed = False
+        self.seq = 0
+        self.utter_id = 0
+        self.speaking = False
+        self.stop_pending = False  # stop を積んだがまだ送り終えていない
+        self.spool: collections.deque = collections.deque(maxlen=max(0, spool_frames))
+        self.spool_rate = RATE
+        self.spool_truncated = False
+        self._packet_ts = 0
+        self._packet_silent = False
+
+    def attach(self, link: _Link):
+        """新しい接続で取り決めたコーデック・ヘッダに切り替える（連番は 0 から）。"""
+        self.codec = link.codec
+        self.framed = link.framed
+        self.seq = 0
+
+    async def send_packet(self, packet: Optional[bytes]):
+        if packet is None:
+            return
+        payload = self.codec.encode(packet)
+        if self.framed:
+            payload = pack_audio(self.seq, self.utter_id, self._packet_ts, payload)
+            self.seq += 1
+        # 符号化・ヘッダ付けまで済ませて積む（送信は send_queue.run）
+        await self.send_queue.put_audio(payload, self.packetizer.taken_frames, silent=self._packet_silent, packet=packet)
+
+    async def flush(self):
+        """途中まで溜まっている分をすぐ送る（stop の前）。"""
+        await self.send_packet(self.packetizer.flush())
+
+    async def add_frame(self, frame, ts_us: Optional[int] = None, silent: bool = False, spooled: bool = False):
+        if ts_us is None:
+            ts_us = now_us()
+        if not self.packetizer.pending_frames:
+            self._packet_ts = ts_us  # パケットの先頭フレームの時刻
+            self._packet_silent = silent
+        else:
+            self._packet_silent = self._packet_silent and silent  # 声のフレームが1つでもあれば無音扱いしない
+        if self.spool.maxlen and not spooled:
+            if len(self.spool) == self.spool.maxlen:
+                self.spool_truncated = True
+            self.spool.append((bytes(frame), ts_us, silent))
+        await self.send_packet(self.packetizer.add(frame))
+
+    async def flush_preroll(self, preroll: PreRollRing):
+        # 古い順に送る。取り込み時刻はいまのフレームから FRAME_MS ずつさかのぼった値
+        now = now_us()
+        while len(preroll):
+            age = len(preroll)
+            await self.add_frame(preroll.pop(), now - age * FRAME_MS * 1000, silent=True)
+
+    def put_control(self, text: str, on_sent: Optional[Callable[[], None]] = None):
+        if self.recorder is not None:
+            self.recorder.record_control(self.stream_id, text, outgoing=True)
+        self.send_queue.put_control(text, on_sent=on_sent)
+
+    def begin(self):
+        self.utter_id = next(_utter_ids)
+        self.speaking = True
+        self.spool.clear()
+        self.spool_truncated = False
+        self.stop_pending = False
+
+    def end(self):
+        """stop を積む（送り終えるまでは、切断されたら送り直す）。"""
+        self.speaking = False
+        self.stop_pending = True
+        ended = self.utter_id
+
+        def on_stop_sent():
+            if self.tracer is not None:
+                self.tracer.mark(ended, "stop_sent")
+            if ended == self.utter_id:
+                self.stop_pending = False
+                self.spool.clear()
+
+        self.put_control(json.dumps({"type": "stop", "utter_id": ended}), on_sent=on_stop_sent)
+
+    def cancel(self):
+        """ミュートで発話を打ち切る（stop は送らない）。"""
+        self.speaking = False
+        self.spool.clear()
+
+    async def resend(self, wire_rate: int) -> int:
+        """切断で途切れた発話を新しい接続で送り直す。送ったフレーム数を返す。"""
+        if not self.spool or not (self.speaking or self.stop_pending):
+            return 0
+        if wire_rate != self.spool_rate:
+            self.spool.clear()  # 送信レートが変わった（まれ）。送り直さない
+            return 0
+        self.put_control(json.dumps({
+            "type": "resume", "utter_id": self.utter_id, "frames": len(self.spool), "truncated": self.spool_truncated,
+        }))
+        frames = list(self.spool)
+        for frame, ts, silent in frames:
+            await self.add_frame(frame, ts, silent, spooled=True)
+        if self.stop_pending:
+            await self.flush()
+            self.end()
+        return len(frames)
+
+
 async def sender_task(
     uri: str,
     token: str,
@@ -17,73 +315,146 @@ async def sender_task(
     frame_iter,
     use_vad: bool = True,
     mute: Optional[MuteController] = None,
+    packetizer: Optional[Packetizer] = None,
+    capture_rate: int = RATE,
+    connect: Optional[Callable[[], AsyncContextManager]] = None,
+    send_queue: Optional[SendQueue] = None,
+    standby: Optional[bool] = None,
+    heartbeat: Optional[Heartbeat] = None,
+    tracer: Optional[TurnTracer] = None,
+    recorder: Optional[SessionRecorder] = None,
 ):
     """
-    (★ この関数はオリジナルのまま、変更ありません)
+    送信タスク。frame_iter のフレームを VAD で区切って送り、発話終了で {"type":"stop"} を送る。
+
+    接続ごとの準備は _open_stream、発話と送り直しの状態は _Utterances。設定（PACKET_MS・SEND_QUEUE_*・
+    AUDIO_CODEC・UPLINK_RATE・AUDIO_HEADER・VAD_*・WS_STANDBY・UTTER_SPOOL_MS・HEARTBEAT など）は README を参照。
+    capture_rate: frame_iter のフレームのレート（送信レートと違えば変換してから VAD にかける）。
+    tracer / recorder: 発話終了と stop の送信時刻 / マイクのフレームと送った JSON を記録する。
+    connect: 接続を作る関数（省略時は uri へ websockets.connect）。多重化（mux.MuxClient.channel）用。
     """
     headers = {"Authorization": f"Bearer {token}"}
-    backoff = 0.5
+    if connect is None:
+        connect = lambda: websockets.connect(uri, additional_headers=headers, ping_interval=30)
+    if standby is None:
+        standby = os.getenv("WS_STANDBY", "0") == "1"
+    manager = ConnectionManager(connect, standby=standby)
+    if heartbeat is None:
+        heartbeat = make_heartbeat()
+    if packetizer is None:
+        packetizer = Packetizer(
+            packet_ms=int(os.getenv("PACKET_MS", str(FRAME_MS))),
+            adaptive=os.getenv("PACKET_ADAPTIVE", "0") == "1",
+            max_packet_ms=int(os.getenv("PACKET_MAX_MS", "100")),
+        )
+    if send_queue is None:
+        send_queue = SendQueue(
+            capacity_ms=int(os.getenv("SEND_QUEUE_MS", "1000")),
+            policy=os.getenv("SEND_QUEUE_POLICY", "block"),
+        )
+    offers = (_codec_offer("AUDIO_CODEC_UPLINK"), _rate_offer("UPLINK_RATE"), _header_offer())
+    utt = _Utterances(
+        stream_id, packetizer, send_queue, int(os.getenv("UTTER_SPOOL_MS", "5000")) // FRAME_MS, tracer, recorder
+    )
+    last_voiced_us = 0  # 最後に声と判定したフレームの取り込み時刻（区間計測の speech_end）
+
+    # VAD_MODE=fixed（既定、固定閾値）/ adaptive（ノイズフロア追従・ヒステリシス）。
+    # 再接続してもノイズフロアとハングオーバーの統計（vad.stats）は引き継ぐ。
+    vad = make_endpointer() if use_vad else None
+    if os.getenv("VAD_DEBUG") == "1":
+        _send_log.set_level(DEBUG)
+    debug_every = max(1, int(os.getenv("VAD_DEBUG_EVERY", "20")))
+    frame_count = 0
+
+    preroll_frames = int(os.getenv("VAD_PREROLL_MS", "0")) // FRAME_MS if vad else 0
+
+    labels = {"stream": stream_id, "role": "sender"}
+    REGISTRY.add_stats("send_queue", send_queue.stats, send_queue.COUNTERS, **labels)
+    REGISTRY.add_stats("packets", lambda: packetizer.stats.as_dict(), packetizer.stats.COUNTERS, **labels)
+    REGISTRY.add_stats("connection", manager.stats.as_dict, manager.stats.COUNTERS, **labels)
+    if heartbeat is not None:
+        REGISTRY.add_stats("heartbeat", heartbeat.stats, heartbeat.COUNTERS, **labels)
+    if vad is not None:
+        REGISTRY.add_stats("vad", vad.stats.as_dict, vad.stats.COUNTERS, **labels)
+
     while True:
         try:
-            async with websockets.connect(uri, additional_headers=headers, ping_interval=30) as ws:
-                if use_vad:
-                    try:
-                        thr = float(os.getenv("VAD_THRESHOLD", "0.02"))
-                    except ValueError:
-                        thr = 0.02
-                    try:
-                        min_ms = int(os.getenv("VAD_MIN_SIL_MS", "400"))
-                    except ValueError:
-                        min_ms = 400
-                    vad = SilenceDetector(threshold=thr, min_silence_ms=min_ms)
-                else:
-                    vad = None
-                
-                debug = os.getenv("VAD_DEBUG") == "1"
-                frame_count = 0
-                debug_every = int(os.getenv("VAD_DEBUG_EVERY", "20"))
-
-                speaking = False
+            async with manager.connection() as ws, _open_stream(
+                ws, stream_id, packetizer, send_queue, heartbeat, *offers
+            ) as link:
+                manager.mark_up()
+                utt.attach(link)
+                resampler = Resampler(capture_rate, link.rate) if capture_rate != link.rate else None
+                # 送信レートのフレーム長で確保（接続ごとにレートが変わりうる）
+                preroll = PreRollRing(frame_bytes_at(link.rate), preroll_frames) if preroll_frames > 0 else None
 
+                resent = await utt.resend(link.rate)
+                if resent and _send_log.debug_enabled:
+                    _send_log.debug("[send] %s resumed utter_id=%s (%dms) %s", stream_id, utt.utter_id, resent * FRAME_MS, manager.stats.as_dict())
+                if vad and not utt.speaking:
+                    vad.reset()
+                utt.spool_rate = link.rate
                 async for frame in frame_iter():
+                    if link.watch is not None and link.watch.done():
+                        raise ConnectionError("ハートビートが途絶えました")
                     if not isinstance(frame, (bytes, bytearray)):
                         continue
-                    
+                    frame_count += 1
+                    if recorder is not None:
+                        recorder.record_mic(stream_id, frame, rate=capture_rate)
+                    if resampler is not None:
+                        # ミュート中も変換は続ける（フィルタの履歴を途切れさせない）
+                        frame = resampler.process(frame)
+
                     if mute and mute.is_muted():
-                        speaking = False
+                        utt.cancel()
                         if vad: vad.reset()
+                        if preroll is not None: preroll.clear()
                         continue
 
-                    is_loud_enough = rms_int16(frame) >= vad.threshold if vad else True
+                    # フレームのデコードは1回だけ。特徴量は VAD とデバッグ表示で共有する。
+                    feats = analyze_frame(frame) if vad else None
+                    event = vad.update(frame, feats) if vad else (None if utt.speaking else START)
 
-                    if not speaking:
-                        if is_loud_enough:
-                            speaking = True
-                            if debug: print(f"[VAD] Speech started on {stream_id}.")
-                            await ws.send(frame)
-                        else:
-                            if debug and frame_count % max(1, debug_every) == 0:
-                                print(f"[VAD] Silent... rms={rms_int16(frame):.4f} thr={vad.threshold}")
-                            continue
-                    else:
-                        await ws.send(frame)
-                        if not is_loud_enough:
-                            if vad and vad.update(frame):
-                                if debug: print(f"[VAD] Speech ended on {stream_id}. Sending stop.")
-                                await ws.send(json.dumps({"type": "stop"}))
-                                speaking = False
-                                vad.reset()
-                        else:
-                            if vad: vad.reset()
+                    if event == START:
+                        utt.begin()
+                        _send_log.debug("[VAD] Speech started on %s (pre-roll %dms).", stream_id, len(preroll) * FRAME_MS if preroll is not None else 0)
+                        if preroll is not None:
+                            await utt.flush_preroll(preroll)
+                    if not utt.speaking:
+                        if preroll is not None:
+                            preroll.push(frame)
+                        if _send_log.debug_enabled and frame_count % debug_every == 0:
+                            _send_log.debug("[VAD] Silent... rms=%.4f thr=%.4f", feats.rms, vad.threshold)
+                        continue
 
-                    frame_count += 1
+                    # ハングオーバー中（声でないフレーム）は drop_silence で先に捨ててよい
+                    ts = now_us()
+                    voiced = not vad or vad.last_voiced
+                    if voiced:
+                        last_voiced_us = ts
+                    await utt.add_frame(frame, ts, silent=not voiced)
+                    if event == END:
+                        if tracer is not None:
+                            t = now_us()
+                            tracer.mark(utt.utter_id, "speech_end", last_voiced_us or t)
+                            tracer.mark(utt.utter_id, "endpoint", t)
+                        if _send_log.debug_enabled:
+                            _send_log.debug("[VAD] Speech ended on %s (hangover %sms). Sending stop.", stream_id, vad.stats.last_hangover_ms if vad else 0)
+                        await utt.flush()
+                        utt.end()
+                        if _send_log.debug_enabled:
+                            _send_log.debug("[send] %s packet=%dms %s", stream_id, packetizer.packet_ms, packetizer.stats.as_dict())
+                            _send_log.debug("[send] %s queue %s", stream_id, send_queue.stats())
+                            if vad:
+                                _send_log.debug("[VAD] %s hangover %s", stream_id, vad.stats.as_dict())
 
-                if speaking:
-                    await ws.send(json.dumps({"type": "stop"}))
-                backoff = 0.5
+                await utt.flush()
+                if utt.speaking:
+                    utt.end()
+                await send_queue.join()
         except Exception:
-            await asyncio.sleep(backoff)
-            backoff = min(10.0, backoff * 1.7)
+            await manager.on_failure()
 
 
 async def playback_task(
@@ -91,35 +462,137 @@ async def playback_task(
     token: str, 
     on_pcm_chunk: Callable[[bytes], asyncio.Future], 
     mute: Optional[MuteController] = None,
-    led: Optional[EmotionLED] = None
+    led: Optional[EmotionLED] = None,
+    on_format: Optional[Callable[[int], None]] = None,
+    connect: Optional[Callable[[], AsyncContextManager]] = None,
+    standby: Optional[bool] = None,
+    heartbeat: Optional[Heartbeat] = None,
+    tracer: Optional[TurnTracer] = None,
+    recorder: Optional[SessionRecorder] = None,
+    on_tts_done: Optional[Callable[[Optional[int]], None]] = None,
 ):
     """
     再生タスク（LED制御対応版）
+
+    hello で受け取れるレート（DOWNLINK_RATES、既定 RATE）を提示し、返答の rate を
+    on_format(rate) で出力側（JitteredOutput.set_input_rate など）へ伝える。
+    AUDIO_HEADER=1 で音声ヘッダを取り決めた場合は on_pcm_chunk(pcm, header)（framing.AudioHeader）で呼ぶ。
+    接続は ConnectionManager で管理する（切れたらすぐ張り直す。standby は sender_task と同じ）。
+    heartbeat も sender_task と同じ（pong も TTS と同じ接続で受け取る）。ハートビートを提示したときは
+    受信を別タスク（_read_ahead）で読み進め、音声の push が待たされている間も pong を処理する。
+    tracer（trace.TurnTracer）: 最初の TTS チャンクの受信と tts_done を発話IDごとに記録する
+    （ハートビートで時計のずれが分かっていれば、音声ヘッダの送信時刻も記録する）。
+    受信したメッセージ数・バイト数（音声 / JSON）と接続の統計は metrics.REGISTRY に数える。
+    表示は print ではなく log.get_logger("ws_client")（別スレッドで書き出し、LOG_LEVEL で絞り込める）。
+    recorder（recorder.SessionRecorder）: on_pcm_chunk に渡す PCM（とヘッダ）・下りのレート・受け取った JSON を記録する。
+    on_tts_done: tts_done を受け取ったら utter_id（無ければ None）で呼ぶ（JitteredOutput.end_utterance など）。
+    connect: 接続を作る関数（省略時は uri へ websockets.connect）。
     """
     headers = {"Authorization": f"Bearer {token}"}
-    backoff = 0.5
+    if connect is None:
+        connect = lambda: websockets.connect(uri, additional_headers=headers, ping_interval=30, max_size=None)
+    if standby is None:
+        standby = os.getenv("WS_STANDBY", "0") == "1"
+    manager = ConnectionManager(connect, standby=standby)
+    if heartbeat is None:
+        heartbeat = make_heartbeat()
+    codec_offer = _codec_offer("AUDIO_CODEC_DOWNLINK")
+    rate_offer = _rate_offer("DOWNLINK_RATES", str(RATE))
+    header_offer = _header_offer()
+    labels = {"role": "playback"}
+    REGISTRY.add_stats("connection", manager.stats.as_dict, manager.stats.COUNTERS, **labels)
+    if heartbeat is not None:
+        REGISTRY.add_stats("heartbeat", heartbeat.stats, heartbeat.COUNTERS, **labels)
+    recv_audio = REGISTRY.counter("recv_messages_total", "受信したメッセージ数", kind="audio", **labels)
+    recv_audio_bytes = REGISTRY.counter("recv_bytes_total", "受信したバイト数", kind="audio", **labels)
+    recv_control = REGISTRY.counter("recv_messages_total", kind="control", **labels)
+    recv_control_bytes = REGISTRY.counter("recv_bytes_total", kind="control", **labels)
+
+    def set_format(rate: int):
+        if recorder is not None:
+            recorder.record_format(rate)
+        if on_format:
+            on_format(rate)
     while True:
+        beat = None  # ハートビートの送信タスク（hello の返答で取り決められたら動かす）
+        reader = None  # ハートビートを提示したときの受信タスク（_read_ahead）
         try:
-            async with websockets.connect(uri, additional_headers=headers, ping_interval=30, max_size=None) as ws:
-                # サーバ仕様に合わせて hello を送る（role=playback）
+            async with manager.connection() as ws:
+                # サーバ仕様に合わせて hello を送る（role=playback）。
+                # AUDIO_CODEC があれば希望するコーデックも伝え、返答の hello で確定する。
+                hello = {"type": "hello", "role": "playback", "rates": rate_offer, "formats": list(FORMATS)}
+                if codec_offer is not None:
+                    hello["codecs"] = codec_offer
+                if header_offer:
+                    hello["header"] = HEADER_NAME
+                if heartbeat is not None:
+                    hello["heartbeat"] = True
+                codec = make_codec(PCM)
+                framed = False
+                set_format(RATE)  # 返答に rate が無いサーバは従来どおり RATE で送ってくる
                 try:
-                    await ws.send(json.dumps({"type": "hello", "role": "playback"}))
+                    await ws.send(json.dumps(hello))
                 except Exception:
                     pass
+                manager.mark_up()  # 返答を返さないサーバもあるので hello を送った時点で復旧とみなす
                 
                 in_tts = False
+                inbox = None
+                if heartbeat is not None:
+                    inbox = asyncio.Queue()
+                    reader = asyncio.create_task(_read_ahead(ws, heartbeat, inbox))
                 while True:
-                    msg = await ws.recv()
+                    if inbox is None:
+                        msg = await ws.recv()
+                    elif beat is None:
+                        msg = await inbox.get()
+                    else:
+                        # pong は interval ごとに届くはずなので、timeout_s 何も来なければ途絶えている
+                        try:
+                            msg = await asyncio.wait_for(inbox.get(), heartbeat.timeout_s)
+                        except asyncio.TimeoutError:
+                            msg = None
+                        if beat.done() or heartbeat.dead:
+                            raise ConnectionError("ハートビートが途絶えました")
+                        if msg is None:
+                            continue
+                    if isinstance(msg, Exception):
+                        raise msg
                     
                     if isinstance(msg, (bytes, bytearray)):
                         # --- 音声データ受信時の処理 (変更なし) ---
+                        recv_audio.inc()
+                        recv_audio_bytes.inc(len(msg))
                         if mute and not in_tts:
                             mute.set_muted(True)
                             in_tts = True
-                        await on_pcm_chunk(bytes(msg))
+                        if framed:
+                            # 音声ヘッダ付き: 連番・時刻・発話IDを出力側（ジッターバッファ）へ渡す
+                            try:
+                                header, body = unpack_audio(msg)
+                            except ValueError:
+                                continue
+                            if tracer is not None:
+                                synced = heartbeat is not None and heartbeat.offset_ms is not None
+                                tracer.on_tts_chunk(header.utter_id, heartbeat.to_local_us(header.ts_us) if synced else None)
+                            pcm = codec.decode(body)
+                            if recorder is not None:
+                                recorder.record_tts(pcm, header)
+                            await on_pcm_chunk(pcm, header)
+                        else:
+                            if tracer is not None:
+                                tracer.on_tts_chunk()
+                            pcm = codec.decode(msg)
+                            if recorder is not None:
+                                recorder.record_tts(pcm)
+                            await on_pcm_chunk(pcm)
                     
                     else:
                         # --- JSON テキスト受信時の処理 (★ここを修正) ---
+                        recv_control.inc()
+                        recv_control_bytes.inc(len(msg.encode()))
+                        if recorder is not None:
+                            recorder.record_control("playback", msg)
                         try:
                             data = json.loads(msg)
                         except Exception:
@@ -130,7 +603,7 @@ async def playback_task(
                         if msg_type == "ai_text":
                             # ★目標達成: Geminiからのテキストをターミナルに表示
                             ai_text = data.get("text", "(テキストなし)")
-                            print(f"\n💬 [Gemini 応答]: {ai_text}\n")
+                            _log.info("\n💬 [Gemini 応答]: %s\n", ai_text)
                         
                         elif msg_type == "emotion":
                             # ★NEW: 感情分析結果を表示 & LED制御
@@ -142,24 +615,46 @@ async def playback_task(
                                 "平常": "😐"
                             }
                             emoji = emotion_emoji.get(emotion, "❓")
-                            print(f"{emoji} [感情分析]: {emotion}")
+                            _log.info("%s [感情分析]: %s", emoji, emotion)
                             
                             # LEDを制御
                             if led:
                                 led.set_emotion(emotion)
                         
+                        elif msg_type == "hello":
+                            # hello の返答（コーデック・レートの確定）
+                            codec = make_codec(data.get("codec") or PCM)
+                            framed = data.get("header") == HEADER_NAME
+                            set_format(int(data.get("rate") or RATE))
+                            if heartbeat is not None and data.get("heartbeat") is True and beat is None:
+                                beat = asyncio.create_task(heartbeat.run(ws.send))
+                                beat.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+                        elif msg_type == "pong":
+                            pass  # _read_ahead が受け取った時点で heartbeat に渡している
+
                         elif msg_type == "tts_done":
                             # tts_done（合成音声の終了通知）でミュート解除
+                            if tracer is not None:
+                                tracer.on_tts_done(data.get("utter_id"))
+                            if on_tts_done is not None:
+                                utter = data.get("utter_id")
+                                on_tts_done(utter if isinstance(utter, int) else None)
                             if mute:
                                 mute.set_muted(False)
                             in_tts = False
-                            print("ℹ️  [client] 音声再生完了、ミュート解除。")
+                            _log.info("ℹ️  [client] 音声再生完了、ミュート解除。")
                         
                         else:
                             # 不明なJSONメッセージ
-                            print(f"ℹ️  [client] サーバーから不明なJSONを受信: {msg}")
+                            _log.info("ℹ️  [client] サーバーから不明なJSONを受信: %s", msg)
 
-                backoff = 0.5
         except Exception:
-            await asyncio.sleep(backoff)
-            backoff = min(10.0, backoff * 1.7)
\ No newline at end of file
+            await manager.on_failure()
+        finally:
+            if beat is not None:
+                beat.cancel()
+            if reader is not None:
+                reader.cancel()
+            if tracer is not None:
+                tracer.on_disconnect()
\ No newline at end of file
@@ -6,16 +6,32 @@ from typing import Dict, Set
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 
+from client.codec import PCM, make_codec, negotiate_codec
+from client.resample import negotiate_rate
+from client import mux
+from client.framing import HEADER_NAME, now_us, pack_audio, unpack_audio
+
 
 app = FastAPI()
 
 
 PLAYBACK_CLIENTS: Set[WebSocket] = set()
+# playback クライアントごとの下りコーデック（hello で取り決め。ADPCM は状態を持つので接続ごと）
+PLAYBACK_ENCODERS: Dict[WebSocket, object] = {}
+# playback クライアントごとの下りレート（hello の rates から選ぶ。提示が無ければクライアントの既定 24kHz）
+PLAYBACK_RATES: Dict[WebSocket, int] = {}
+# 音声ヘッダ（連番・時刻・発話ID）を付ける playback クライアントと、その次の連番
+PLAYBACK_SEQ: Dict[WebSocket, int] = {}
+DEFAULT_RATE = 24000
+# playback クライアントごとの送信ロック（返答を1つずつ送る）
+PLAYBACK_LOCKS: Dict[object, asyncio.Lock] = {}
+_utter_counter = 0
+_BROADCASTS: Set[asyncio.Task] = set()
 
 
-def _pcm_s16le_sine(duration_sec: float = 1.0, rate: int = 16000, freq: float = 440.0) -> bytes:
+def _pcm_s16le_sine(duration_sec: float = 1.0, rate: int = DEFAULT_RATE, freq: float = 440.0) -> bytes:
     total = int(duration_sec * rate)
-    # 200ms チャンク（= 3200 サンプル = 6400 bytes）で返す呼び元の都合に合わせ
+    # 200ms チャンク（24kHz なら 4800 サンプル = 9600 bytes）で返す呼び元の都合に合わせ
     # ここでは一括生成しておき、送信側で分割する。
     frames = bytearray()
     for n in range(total):
@@ -27,51 +43,171 @@ def _pcm_s16le_sine(duration_sec: float = 1.0, rate: int = 16000, freq: float =
     return bytes(frames)
 
 
-async def _broadcast_tts_mock():
-    if not PLAYBACK_CLIENTS:
-        return
-    pcm = _pcm_s16le_sine(1.0)
-    frame_bytes = 6400  # 200ms
-    # 事前に final_asr を送出（テキストはダミー）。
-    # ASR=Automatic Speech Recognition（音声認識）。ここでは擬似的な認識結果を送る。
-    asr_msg = json.dumps({"type": "final_asr", "text": "(mock) 了解しました。", "utter_id": "mock-utt"})
-    for ws in list(PLAYBACK_CLIENTS):
+async def _send_reply(ws, asr_msg: str, done_msg: str, header_utter: int, pcm: bytes):
+    """1つの playback クライアントへ返答（final_asr → 200ms ごとの音声 → tts_done）を送る。
+
+    クライアントごとのロックで返答を1つずつ送る（続けて届いた stop の返答のチャンクが
+    同じ接続の上で混ざると、発話IDと連番が入り組んでクライアントが古いデータとして捨てる）。
+    ping への pong は受信ループから直接送るので、ロックを待たない。
+    """
+    async with PLAYBACK_LOCKS.setdefault(ws, asyncio.Lock()):
         try:
             await ws.send_text(asr_msg)
         except Exception:
-            pass
-    # 200ms ごとに分割送信
-    for i in range(0, len(pcm), frame_bytes):
-        chunk = pcm[i : i + frame_bytes]
-        send_tasks = []
-        for ws in list(PLAYBACK_CLIENTS):
-            send_tasks.append(ws.send_bytes(chunk))
-        if send_tasks:
+            return
+        # 200ms ごとに分割送信
+        chunk_bytes = len(pcm) // 5
+        for i in range(5):
+            if ws not in PLAYBACK_CLIENTS:
+                return
+            chunk = pcm[i * chunk_bytes : (i + 1) * chunk_bytes]
+            encoder = PLAYBACK_ENCODERS.get(ws)
+            payload = encoder.encode(chunk) if encoder is not None else chunk
+            if ws in PLAYBACK_SEQ:
+                payload = pack_audio(PLAYBACK_SEQ[ws], header_utter, now_us(), payload)
+                PLAYBACK_SEQ[ws] += 1
             try:
-                await asyncio.gather(*send_tasks, return_exceptions=True)
+                await ws.send_bytes(payload)
             except Exception:
-                pass
-        await asyncio.sleep(0.2)
-    # 終了通知（TTS が終わったことを知らせる）
-    done_msg = json.dumps({"type": "tts_done", "utter_id": "mock-utt"})
-    for ws in list(PLAYBACK_CLIENTS):
+                return
+            await asyncio.sleep(0.2)
+        # 終了通知（TTS が終わったことを知らせる）
         try:
             await ws.send_text(done_msg)
         except Exception:
             pass
 
 
-@app.websocket("/ws")
-async def ws_handler(websocket: WebSocket):
+async def _broadcast_tts_mock(utter_id=None):
+    global _utter_counter
+    if not PLAYBACK_CLIENTS:
+        return
+    # 発話ID: stop に utter_id があればそれを返す（音声ヘッダには整数で入れる）
+    _utter_counter += 1
+    header_utter = utter_id if isinstance(utter_id, int) else _utter_counter
+    json_utter = utter_id if utter_id is not None else "mock-utt"
+    # クライアントごとに取り決めたレートで生成する（レートごとに1回だけ）
+    sines: Dict[int, bytes] = {}
+    for ws in PLAYBACK_CLIENTS:
+        rate = PLAYBACK_RATES.get(ws, DEFAULT_RATE)
+        if rate not in sines:
+            sines[rate] = _pcm_s16le_sine(1.0, rate=rate)
+    # 事前に final_asr を送出（テキストはダミー）。
+    # ASR=Automatic Speech Recognition（音声認識）。ここでは擬似的な認識結果を送る。
+    asr_msg = json.dumps({"type": "final_asr", "text": "(mock) 了解しました。", "utter_id": json_utter})
+    done_msg = json.dumps({"type": "tts_done", "utter_id": json_utter})
+    await asyncio.gather(
+        *(
+            _send_reply(ws, asr_msg, done_msg, header_utter, sines[PLAYBACK_RATES.get(ws, DEFAULT_RATE)])
+            for ws in list(PLAYBACK_CLIENTS)
+        ),
+        return_exceptions=True,
+    )
+
+
+class _Stream:
+    """1本の論理ストリーム（通常の接続1本、または多重化接続の1チャンネル）の状態。
+
+    peer は send_text / send_bytes を持つ送り先（WebSocket か _MuxPeer）。
+    """
+
+    def __init__(self, peer, role=None, stream_id=None):
+        self.peer = peer
+        self.role = role
+        self.stream_id = stream_id
+        self.decoder = make_codec(PCM)  # 上り音声の復号（hello でコーデックが決まる）
+        self.header = False  # 上り音声に音声ヘッダが付いているか（hello で決まる）
+        self.next_seq = 0
+        self.lost = 0  # 上り音声の連番の抜け
+
+    async def on_text(self, text: str):
+        try:
+            data = json.loads(text) if text else {}
+        except json.JSONDecodeError:
+            data = {}
+        msg_type = data.get("type")
+        if msg_type == "hello":
+            self.role = data.get("role") or self.role
+            self.stream_id = data.get("stream_id") or self.stream_id
+            reply = {"type": "hello", "accepted": True, "role": self.role}
+            codec_name = PCM
+            if "codecs" in data:
+                # クライアントの希望順で、対応しているコーデックを選ぶ
+                codec_name = negotiate_codec(data.get("codecs"))
+                reply["codec"] = codec_name
+            rate = DEFAULT_RATE
+            if "rates" in data:
+                # クライアントの希望順で、対応しているレートを選ぶ
+                rate = negotiate_rate(data.get("rates"), default=DEFAULT_RATE)
+                reply["rate"] = rate
+            header = data.get("header") == HEADER_NAME
+            if header:
+                reply["header"] = HEADER_NAME
+            if data.get("heartbeat") is True:
+                # ping に pong を返す（クライアントが RTT・時計のずれを測り、途絶えたら張り直す）
+                reply["heartbeat"] = True
+            if self.role == "playback":
+                PLAYBACK_CLIENTS.add(self.peer)
+                PLAYBACK_ENCODERS[self.peer] = make_codec(codec_name)
+                PLAYBACK_RATES[self.peer] = rate
+                if header:
+                    PLAYBACK_SEQ[self.peer] = 0
+                else:
+                    PLAYBACK_SEQ.pop(self.peer, None)
+            else:
+                self.decoder = make_codec(codec_name)
+                self.header = header
+            # 簡易応答（受け付けたことを返す）
+            await self.peer.send_text(json.dumps(reply))
+        elif msg_type == "ping":
+            # すぐに返す（server_us はこのサーバの単調時計。クライアントが時計のずれを求める）
+            await self.peer.send_text(
+                json.dumps({"type": "pong", "id": data.get("id"), "t": data.get("t"), "server_us": now_us()})
+            )
+        elif msg_type == "stop":
+            # 区切り受信→擬似ASR/TTSをプレイバックへブロードキャスト（まとめて送る）。
+            # 受信ループを止めない（その間の ping に答えられるように）よう別タスクで送る
+            task = asyncio.create_task(_broadcast_tts_mock(data.get("utter_id")))
+            _BROADCASTS.add(task)
+            task.add_done_callback(_BROADCASTS.discard)
+        else:
+            # 何もしない（no-op: 特に処理なしの意）
+            pass
+
+    def on_bytes(self, data: bytes):
+        # 音声バイナリ（20ms。24kHz なら 960 bytes）を受信。モック（動作確認用の簡易サーバ）では復号するだけで使用しない。
+        if self.header:
+            try:
+                hdr, data = unpack_audio(data)
+            except ValueError:
+                return
+            if hdr.seq > self.next_seq:
+                self.lost += hdr.seq - self.next_seq
+            self.next_seq = max(self.next_seq, hdr.seq + 1)
+        _ = self.decoder.decode(data)
+
+    def close(self):
+        PLAYBACK_CLIENTS.discard(self.peer)
+        PLAYBACK_ENCODERS.pop(self.peer, None)
+        PLAYBACK_RATES.pop(self.peer, None)
+        PLAYBACK_SEQ.pop(self.peer, None)
+        PLAYBACK_LOCKS.pop(self.peer, None)
+
+
+def _authorized(websocket: WebSocket) -> bool:
     # 簡易認証（存在チェックのみ）。Bearer トークンの形かどうかだけ確認する。
     auth = websocket.headers.get("authorization")
-    if not auth or not auth.lower().startswith("bearer "):
+    return bool(auth and auth.lower().startswith("bearer "))
+
+
+@app.websocket("/ws")
+async def ws_handler(websocket: WebSocket):
+    if not _authorized(websocket):
         await websocket.close(code=4401)
         return
     await websocket.accept()
 
-    role = None
-    stream_id = None
+    stream = _Stream(websocket)
     try:
         while True:
             message = await websocket.receive()
@@ -79,37 +215,66 @@ async def ws_handler(websocket: WebSocket):
             if mtype != "websocket.receive":
                 continue
             if "text" in message:
-                try:
-                    data = json.loads(message["text"]) if message["text"] else {}
-                except json.JSONDecodeError:
-                    data = {}
-                msg_type = data.get("type")
-                if msg_type == "hello":
-                    role = data.get("role")
-                    stream_id = data.get("stream_id")
-                    if role == "playback":
-                        PLAYBACK_CLIENTS.add(websocket)
-                    # 簡易応答（受け付けたことを返す）
-                    await websocket.send_text(json.dumps({"type": "hello", "accepted": True, "role": role}))
-                elif msg_type == "stop":
-                    # 区切り受信→擬似ASR/TTSをプレイバックへブロードキャスト（まとめて送る）
-                    await _broadcast_tts_mock()
-                else:
-                    # 何もしない（no-op: 特に処理なしの意）
-                    pass
+                await stream.on_text(message["text"])
             elif "bytes" in message:
-                # 音声バイナリ（20ms=640 bytes）を受信。モック（動作確認用の簡易サーバ）では使用しない。
-                _ = message["bytes"]
+                stream.on_bytes(message["bytes"])
             else:
                 # その他は無視
                 pass
     except WebSocketDisconnect:
         pass
     finally:
-        if websocket in PLAYBACK_CLIENTS:
-            PLAYBACK_CLIENTS.discard(websocket)
+        stream.close()
+
+
+class _MuxPeer:
+    """多重化接続の1チャンネルへの送り口（WebSocket と同じ send_text / send_bytes を持つ）。"""
+
+    def __init__(self, websocket: WebSocket, channel: int):
+        self.websocket = websocket
+        self.channel = channel
+
+    async def send_text(self, text: str):
+        await self.websocket.send_bytes(mux.pack(self.channel, text))
+
+    async def send_bytes(self, data: bytes):
+        await self.websocket.send_bytes(mux.pack(self.channel, data))
+
+
+@app.websocket("/ws/mux")
+async def ws_mux_handler(websocket: WebSocket):
+    """1本の接続に self/other の送信と再生を束ねたエンドポイント（client/mux.py と同じヘッダ）。"""
+    if not _authorized(websocket):
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+
+    streams: Dict[int, _Stream] = {}
+    try:
+        while True:
+            message = await websocket.receive()
+            if message.get("type") != "websocket.receive" or "bytes" not in message:
+                continue
+            item = mux.unpack(message["bytes"])
+            if item is None or item[0] not in mux.CHANNEL_NAMES:
+                continue
+            channel, body = item
+            stream = streams.get(channel)
+            if stream is None:
+                # チャンネル番号から役割が分かるので、hello が無くても受け付ける
+                stream_id, role = mux.CHANNEL_NAMES[channel]
+                stream = streams[channel] = _Stream(_MuxPeer(websocket, channel), role=role, stream_id=stream_id)
+            if isinstance(body, str):
+                await stream.on_text(body)
+            else:
+                stream.on_bytes(body)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for stream in streams.values():
+            stream.close()
 
 
 @app.get("/")
 async def index():
-    return {"status": "ok", "ws": "/ws"}
+    return {"status": "ok", "ws": "/ws", "mux": "/ws/mux"}
@@ -0,0 +1,6 @@
+"""リポジトリ直下から実行しなくても client パッケージを import できるようにする。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+"""コーデック（G.711 / IMA-ADPCM）と取り決めの確認。"""
+
+import array
+import math
+import warnings
+
+import pytest
+
+from client import codec
+from client.codec import PCM, ImaAdpcmCodec, make_codec, negotiate_codec, parse_codec_list
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop  # 3.13 で削除。あれば基準として比べる
+    except ImportError:
+        audioop = None
+
+
+def _pcm(samples) -> bytes:
+    return array.array("h", samples).tobytes()
+
+
+def _tone(n: int, amp: float = 8000.0, hz: float = 440.0, rate: int = 24000) -> list:
+    return [int(amp * math.sin(2 * math.pi * hz * i / rate)) for i in range(n)]
+
+
+ALL_SAMPLES = _pcm(range(-32768, 32768))
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "pure"])
+def numpy_mode(request, monkeypatch):
+    if request.param and not codec.HAVE_NUMPY:
+        pytest.skip("NumPy がない")
+    monkeypatch.setattr(codec, "HAVE_NUMPY", request.param)
+    return request.param
+
+
+@pytest.mark.skipif(audioop is None, reason="audioop がない（Python 3.13 以降）")
+@pytest.mark.parametrize("name, lin2law, law2lin", [("pcmu", "lin2ulaw", "ulaw2lin"), ("pcma", "lin2alaw", "alaw2lin")])
+def test_g711_matches_audioop(numpy_mode, name, lin2law, law2lin):
+    c = make_codec(name)
+    assert c.encode(ALL_SAMPLES) == getattr(audioop, lin2law)(ALL_SAMPLES, 2)
+    codes = bytes(range(256))
+    assert c.decode(codes) == getattr(audioop, law2lin)(codes, 2)
+
+
+@pytest.mark.parametrize("name", ["pcmu", "pcma"])
+def test_g711_round_trip_error_is_bounded(numpy_mode, name):
+    c = make_codec(name)
+    pcm = _pcm(_tone(480))
+    encoded = c.encode(pcm)
+    assert len(encoded) == 480
+    decoded = array.array("h", c.decode(encoded))
+    for x, y in zip(array.array("h", pcm), decoded):
+        assert abs(x - y) <= max(16, abs(x) // 16)  # 対数圧縮: 誤差は振幅の 1/16 程度まで
+
+
+def test_g711_encode_ignores_odd_byte(numpy_mode):
+    c = make_codec("pcmu")
+    assert len(c.encode(_pcm([0, 100, -100]) + b"\x01")) == 3
+
+
+def test_adpcm_round_trip_snr():
+    samples = _tone(480 * 10)
+    enc, dec = make_codec("ima_adpcm"), make_codec("ima_adpcm")
+    out = array.array("h")
+    for i in range(0, len(samples), 480):
+        block = enc.encode(_pcm(samples[i : i + 480]))
+        assert len(block) == 4 + 480 // 2  # 先頭サンプルはヘッダに入り、残り 479 個を 4 ビットずつ（240 バイト）
+        out.frombytes(dec.decode(block))
+    assert len(out) == len(samples)
+    # 立ち上がり（最初のブロック）を除いて SNR を測る
+    sig = sum(x * x for x in samples[480:])
+    err = sum((x - y) ** 2 for x, y in zip(samples[480:], out[480:]))
+    assert 10 * math.log10(sig / err) > 20
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 480, 481])
+def test_adpcm_block_length_and_padding(n):
+    samples = _tone(n)
+    block = ImaAdpcmCodec().encode(_pcm(samples))
+    assert len(block) == 4 + n // 2
+    decoded = array.array("h", ImaAdpcmCodec().decode(block))
+    assert len(decoded) == n
+    assert decoded[0] == samples[0]
+
+
+def test_adpcm_blocks_decode_independently():
+    samples = _tone(480 * 3)
+    enc = make_codec("ima_adpcm")
+    blocks = [enc.encode(_pcm(samples[i : i + 480])) for i in range(0, len(samples), 480)]
+    # 途中のブロックだけを新しい復号器に渡しても、続けて復号したのと同じになる
+    whole = make_codec("ima_adpcm")
+    expected = [whole.decode(b) for b in blocks]
+    assert make_codec("ima_adpcm").decode(blocks[2]) == expected[2]
+
+
+def test_adpcm_short_input():
+    assert ImaAdpcmCodec().encode(b"") == b""
+    assert ImaAdpcmCodec().decode(b"\x00\x00\x00") == b""
+
+
+def test_pcm_passthrough():
+    c = make_codec(PCM)
+    data = _pcm([1, -1, 32767, -32768])
+    assert c.decode(c.encode(data)) == data
+
+
+def test_make_codec_rejects_unknown():
+    with pytest.raises(ValueError):
+        make_codec("opus")
+
+
+def test_negotiate_codec_prefers_offer_order():
+    assert negotiate_codec(["opus", "pcma", "pcmu"]) == "pcma"
+    assert negotiate_codec(["opus"]) == PCM
+    assert negotiate_codec(None) == PCM
+
+
+def test_parse_codec_list_appends_pcm():
+    assert parse_codec_list(" pcmu, pcma ,") == ["pcmu", "pcma", PCM]
+    assert parse_codec_list("pcm_s16le,pcmu") == [PCM, "pcmu"]
+    assert parse_codec_list(None) == [PCM]
@@ -0,0 +1,45 @@
+"""音声ヘッダ（framing）の書式の確認。"""
+
+import struct
+
+import pytest
+
+from client.framing import HEADER_BYTES, MAGIC, VERSION, pack_audio, unpack_audio
+
+
+def test_header_layout():
+    message = pack_audio(7, 3, 123456789, b"\x01\x02")
+    assert HEADER_BYTES == 18
+    assert message[:HEADER_BYTES] == struct.pack("<BBIIQ", MAGIC, VERSION, 7, 3, 123456789)
+    assert message[HEADER_BYTES:] == b"\x01\x02"
+
+
+def test_round_trip():
+    header, body = unpack_audio(pack_audio(42, 9, 2**40 + 5, b"payload"))
+    assert (header.seq, header.utter_id, header.ts_us) == (42, 9, 2**40 + 5)
+    assert bytes(body) == b"payload"
+
+
+def test_values_wrap_to_field_width():
+    header, _ = unpack_audio(pack_audio(2**32 + 1, -1, -1, b""))
+    assert header.seq == 1
+    assert header.utter_id == 2**32 - 1
+    assert header.ts_us == 2**64 - 1
+
+
+def test_body_is_a_view_without_copy():
+    message = bytearray(pack_audio(0, 0, 0, b"abc"))
+    _, body = unpack_audio(message)
+    message[-1:] = b"z"
+    assert bytes(body) == b"abz"
+
+
+def test_rejects_short_message():
+    with pytest.raises(ValueError):
+        unpack_audio(b"\xa7\x01\x00")
+
+
+@pytest.mark.parametrize("magic, version", [(0x00, VERSION), (MAGIC, VERSION + 1)])
+def test_rejects_bad_magic_or_version(magic, version):
+    with pytest.raises(ValueError):
+        unpack_audio(struct.pack("<BBIIQ", magic, version, 0, 0, 0))
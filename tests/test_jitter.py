@@ -0,0 +1,104 @@
+"""ジッターバッファの連番処理（並べ替え・損失・古いデータ）の確認。"""
+
+import asyncio
+
+from client.audio_io import FRAME_BYTES
+from client.jitter import JitterBuffer
+
+
+def _chunk(tag: int) -> bytes:
+    return bytes([tag]) * FRAME_BYTES  # 1フレーム。中身で何番のチャンクか分かるようにする
+
+
+def _run(jb: JitterBuffer, pushes) -> list:
+    """(seq, utter_id) を順に push し、リングに入った順のタグを返す。"""
+
+    async def main():
+        for seq, utter in pushes:
+            await jb.push_chunk(_chunk(seq), seq=seq, utter_id=utter)
+        out = []
+        while True:
+            frame = jb.pop_frame_nowait()
+            if frame is None:
+                return out
+            out.append(frame[0])
+
+    return asyncio.run(main())
+
+
+def _buffer(**kwargs) -> JitterBuffer:
+    return JitterBuffer(prebuffer_ms=0, **kwargs)
+
+
+def test_in_order():
+    jb = _buffer()
+    assert _run(jb, [(0, 1), (1, 1), (2, 1)]) == [0, 1, 2]
+    st = jb.stats()
+    assert (st["received_chunks"], st["lost_chunks"], st["stale_chunks"], st["reordered_chunks"]) == (3, 0, 0, 0)
+
+
+def test_late_chunk_within_window_is_reordered():
+    jb = _buffer(reorder_window=1)
+    assert _run(jb, [(0, 1), (2, 1), (1, 1), (3, 1)]) == [0, 1, 2, 3]
+    st = jb.stats()
+    assert st["reordered_chunks"] == 1
+    assert st["lost_chunks"] == 0
+    assert st["loss_pct"] == 0.0
+
+
+def test_gap_beyond_window_counts_as_lost():
+    jb = _buffer(reorder_window=1)
+    # 1 を待つのは 1 個まで。3 が来た時点で 1 を損失として 2, 3 へ進む
+    assert _run(jb, [(0, 1), (2, 1), (3, 1), (1, 1)]) == [0, 2, 3]
+    st = jb.stats()
+    assert st["lost_chunks"] == 1
+    assert st["stale_chunks"] == 1  # 損失扱いの後に届いた 1
+    assert st["loss_pct"] == 20.0  # 受け取り 4、損失 1
+
+
+def test_gap_is_not_waited_for_when_buffer_is_empty():
+    jb = _buffer(reorder_window=4)
+
+    async def main():
+        await jb.push_chunk(_chunk(0), seq=0, utter_id=1)
+        assert jb.pop_frame_nowait()[0] == 0
+        jb.release()
+        # 再生待ちが無いので、抜け（1）を待たずにすぐ 2 を出す
+        await jb.push_chunk(_chunk(2), seq=2, utter_id=1)
+        return jb.pop_frame_nowait()[0]
+
+    assert asyncio.run(main()) == 2
+    assert jb.stats()["lost_chunks"] == 1
+
+
+def test_duplicate_and_old_chunks_are_stale():
+    jb = _buffer(reorder_window=2)
+    assert _run(jb, [(0, 1), (1, 1), (1, 1), (0, 1), (3, 1), (3, 1)]) == [0, 1]
+    st = jb.stats()
+    assert st["stale_chunks"] == 3  # 1 と 0 の再送、保留中の 3 の重複
+
+
+def test_late_chunk_of_finished_utterance_is_stale():
+    jb = _buffer()
+    assert _run(jb, [(0, 1), (0, 2), (1, 1), (1, 2)]) == [0, 0, 1]
+    assert jb.stats()["stale_chunks"] == 1
+
+
+def test_new_utterance_gives_up_on_pending_gap():
+    jb = _buffer(reorder_window=2)
+    # 発話 1 の 1 を待っている間に発話 2 が始まった → 待っていた分は届かなかったとみなす
+    assert _run(jb, [(0, 1), (2, 1), (5, 2), (6, 2)]) == [0, 5, 6]
+    st = jb.stats()
+    assert st["lost_chunks"] == 1
+    assert st["reordered_chunks"] == 0
+
+
+def test_headerless_push_skips_sequencing():
+    jb = _buffer()
+
+    async def main():
+        await jb.push_chunk(_chunk(7) * 2)
+        return len(jb)
+
+    assert asyncio.run(main()) == 2
+    assert "received_chunks" not in jb.stats()
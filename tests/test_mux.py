@@ -0,0 +1,47 @@
+"""多重化ヘッダ（mux）の書式の確認。"""
+
+import pytest
+
+from client.mux import CHANNEL_IDS, KIND_AUDIO, KIND_CONTROL, channel_id, pack, unpack
+
+
+def test_audio_round_trip():
+    message = pack(1, b"\x00\xff" * 4)
+    assert message[:2] == bytes((1, KIND_AUDIO))
+    assert unpack(message) == (1, b"\x00\xff" * 4)
+
+
+def test_control_round_trip():
+    text = '{"type": "stop", "text": "了解"}'
+    message = pack(2, text)
+    assert message[:2] == bytes((2, KIND_CONTROL))
+    assert unpack(message) == (2, text)
+
+
+def test_unpack_accepts_bytearray():
+    assert unpack(bytearray(pack(0, b"x"))) == (0, b"x")
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "text frame",  # テキストメッセージは使わない
+        b"\x00",  # ヘッダより短い
+        bytes((0, 9)) + b"x",  # 不明な種類
+        bytes((0, KIND_CONTROL)) + b"\xff\xfe",  # UTF-8 でない JSON
+    ],
+)
+def test_unpack_rejects_malformed(message):
+    assert unpack(message) is None
+
+
+def test_channel_ids_are_unique_bytes():
+    ids = list(CHANNEL_IDS.values())
+    assert len(set(ids)) == len(ids)
+    assert all(0 <= i < 256 for i in ids)
+    assert channel_id("other", "sender") == CHANNEL_IDS[("other", "sender")]
+
+
+def test_channel_id_rejects_unknown_stream():
+    with pytest.raises(ValueError):
+        channel_id("third", "sender")
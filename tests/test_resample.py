@@ -0,0 +1,101 @@
+"""レート変換の出力長・利得・チャンクの区切りによらないことの確認。"""
+
+import array
+import math
+
+import pytest
+
+from client import resample
+from client.resample import RateAdapter, Resampler, negotiate_rate, parse_rate_list
+
+PAIRS = [(48000, 16000), (16000, 24000), (24000, 16000), (48000, 24000), (8000, 48000), (16000, 48000)]
+
+
+def _tone(rate: int, seconds: float, hz: float = 1000.0, amp: float = 10000.0) -> bytes:
+    n = int(rate * seconds)
+    return array.array("h", (int(amp * math.sin(2 * math.pi * hz * i / rate)) for i in range(n))).tobytes()
+
+
+def _rms(samples) -> float:
+    return math.sqrt(sum(x * x for x in samples) / len(samples))
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "pure"])
+def numpy_mode(request, monkeypatch):
+    if request.param and not resample.HAVE_NUMPY:
+        pytest.skip("NumPy がない")
+    monkeypatch.setattr(resample, "HAVE_NUMPY", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("in_rate, out_rate", PAIRS)
+def test_output_length_follows_ratio(numpy_mode, in_rate, out_rate):
+    rs = Resampler(in_rate, out_rate)
+    frame = bytes(in_rate * 20 // 1000 * 2)
+    total = 0
+    for i in range(1, 51):
+        total += len(rs.process(frame)) // 2
+        # 各チャンクは ±1 サンプルずれても、累計は比どおりに保たれる
+        assert abs(total - i * out_rate * 20 // 1000) <= 1
+
+
+@pytest.mark.parametrize("in_rate, out_rate", PAIRS)
+def test_passband_gain_is_unity(numpy_mode, in_rate, out_rate):
+    rs = Resampler(in_rate, out_rate)
+    out = array.array("h", rs.process(_tone(in_rate, 0.2)))
+    steady = out[len(out) // 4 :]  # フィルタの立ち上がりを除く
+    assert _rms(steady) == pytest.approx(10000.0 / math.sqrt(2), rel=0.03)
+
+
+@pytest.mark.parametrize("in_rate, out_rate", PAIRS)
+def test_chunking_does_not_change_output(numpy_mode, in_rate, out_rate):
+    pcm = _tone(in_rate, 0.1)
+    whole = Resampler(in_rate, out_rate).process(pcm)
+    rs = Resampler(in_rate, out_rate)
+    step = in_rate * 20 // 1000 * 2 + 6  # フレーム境界とずらして区切る
+    pieces = b"".join(rs.process(pcm[i : i + step]) for i in range(0, len(pcm), step))
+    assert pieces == whole
+
+
+def test_numpy_and_pure_agree(monkeypatch):
+    if not resample.HAVE_NUMPY:
+        pytest.skip("NumPy がない")
+    pcm = _tone(48000, 0.05)
+    fast = Resampler(48000, 16000).process(pcm)
+    monkeypatch.setattr(resample, "HAVE_NUMPY", False)
+    slow = array.array("h", Resampler(48000, 16000).process(pcm))
+    assert len(fast) == len(slow) * 2
+    assert max(abs(a - b) for a, b in zip(array.array("h", fast), slow)) <= 1  # 丸めの差だけ
+
+
+def test_same_rate_is_passthrough():
+    data = _tone(24000, 0.02)
+    assert Resampler(24000, 24000).process(data) == data
+
+
+def test_reset_restarts_from_silence():
+    rs = Resampler(48000, 16000)
+    pcm = _tone(48000, 0.02)
+    first = rs.process(pcm)
+    rs.process(pcm)
+    rs.reset()
+    assert rs.process(pcm) == first
+
+
+def test_rate_adapter_switches_rate():
+    ra = RateAdapter(24000, 24000)
+    data = _tone(24000, 0.02)
+    assert ra.process(data) == data
+    ra.set_input_rate(16000)
+    assert abs(len(ra.process(_tone(16000, 0.02))) // 2 - 480) <= 1
+
+
+def test_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        Resampler(0, 16000)
+
+
+def test_negotiate_and_parse_rates():
+    assert negotiate_rate([44100, 16000, 24000]) == 16000
+    assert negotiate_rate(["x", None]) == 24000
+    assert parse_rate_list("16000, 24000,") == [16000, 24000]